@@ -0,0 +1,165 @@
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List
+import json
+import sys
+from dotenv import dotenv_values
+from googleapiclient.discovery import build
+
+from gameplay.GameplayGrabber import GameplayGrabber
+from gameplay.GameplayPool import GameplayPool
+from processing.Pipeline import VideoPipeline, prioritizeVideos, videoPriorities
+from processing.RenderScheduler import RenderScheduler
+from storage.DiskBudget import diskBudget
+from storage.RenderQueue import RenderQueue
+from youtube.YoutubeGrabber import YoutubeGrabber
+
+
+@dataclass
+class ChannelConfig:
+    """
+    A channel to reupload the videos of
+
+    Attributes:
+        name (str): The name the channel is searched for by
+        minDuration (float | None): The shortest video to keep in seconds
+        maxDuration (float | None): The longest video to keep in seconds
+        minViews (int | None): The fewest views a video needs to be kept
+    """
+
+    name: str
+    minDuration: float | None = None
+    maxDuration: float | None = None
+    minViews: int | None = None
+
+
+@dataclass
+class BatchConfig:
+    """
+    Everything a batch of many channels is run with, see batch.example.json
+
+    Attributes:
+        channels (List[ChannelConfig]): The channels to reupload the videos of
+        gameplayLinks (List[str]): The gameplay videos shared by every channel
+        priority (str): The order of the work queue, "newest", "oldest",
+            "shortest" or "mostViewed"
+        maxVideos (int | None): Stop after this many videos, None for every video
+        downloadWorkers (int): The number of videos downloaded at once
+        splitWorkers (int): The number of videos split at once
+        maxPendingDownloads (int): The most raw downloads on disk waiting to be split
+        maxPendingRenders (int | None): The most parts waiting to be rendered,
+            None for twice the render workers
+        renderWorkers (int | None): The number of parts rendered at once,
+            None to fit the cores and memory
+        threadsPerRender (int): The encoder threads each render uses
+        backend (str): The render backend of the parts
+        renderFromSource (bool): Render the parts straight from the downloaded video
+        silenceAwareSplits (bool): End the parts at the quietest point near every minute
+        renderQueue (str | None): The path to a render queue to publish the parts to,
+            for worker.py processes to render, None to render them here
+        diskBudgetGigabytes (float | None): The most the downloads, chunks and clips
+            may take up, the least recently used are deleted past it, None for no limit
+    """
+
+    channels: List[ChannelConfig]
+    gameplayLinks: List[str] = field(default_factory=list)
+    priority: str = "newest"
+    maxVideos: int | None = None
+    downloadWorkers: int = 2
+    splitWorkers: int = 1
+    maxPendingDownloads: int = 3
+    maxPendingRenders: int | None = None
+    renderWorkers: int | None = None
+    threadsPerRender: int = 4
+    backend: str = "moviepy"
+    renderFromSource: bool = False
+    silenceAwareSplits: bool = False
+    renderQueue: str | None = None
+    diskBudgetGigabytes: float | None = None
+
+    @classmethod
+    def load(cls, path: Path) -> "BatchConfig":
+        with open(path, "r") as configFile:
+            config = json.load(configFile)
+
+        # A channel can be just its name when it has no filters
+        config["channels"] = [
+            ChannelConfig(channel)
+            if isinstance(channel, str)
+            else ChannelConfig(**channel)
+            for channel in config["channels"]
+        ]
+
+        batchConfig = cls(**config)
+        if batchConfig.priority not in videoPriorities:
+            raise ValueError(f"Unknown video priority {batchConfig.priority}")
+
+        return batchConfig
+
+
+def main():
+    configPath = Path(sys.argv[1] if len(sys.argv) > 1 else "batch.json")
+    config = BatchConfig.load(configPath)
+
+    if config.diskBudgetGigabytes is not None:
+        diskBudget.budget = int(config.diskBudgetGigabytes * 1024**3)
+
+    dotenv = dotenv_values(".env")
+    apiKey = dotenv["GOOGLE_API_KEY"]
+
+    # One api client for every channel
+    service = build("youtube", "v3", developerKey=apiKey)
+
+    youtubeGrabbers = []
+    videoDataList = []
+
+    for channel in config.channels:
+        youtubeGrabber = YoutubeGrabber(apiKey, channel.name, service=service)
+        youtubeGrabbers.append(youtubeGrabber)
+
+        channelVideos = youtubeGrabber.getVideos(sync=True)
+        channelVideos = youtubeGrabber.enrichVideos(channelVideos)
+        videoDataList += youtubeGrabber.filterVideos(
+            channelVideos,
+            minDuration=channel.minDuration,
+            maxDuration=channel.maxDuration,
+            minViews=channel.minViews,
+        )
+
+    videoDataList = prioritizeVideos(videoDataList, config.priority)
+    print(
+        f"Queued {len(videoDataList)} videos from {len(youtubeGrabbers)} channels, "
+        f"{config.priority} first"
+    )
+
+    gameplayPool = (
+        GameplayPool([GameplayGrabber(link) for link in config.gameplayLinks])
+        if config.gameplayLinks
+        else None
+    )
+
+    renderScheduler = RenderScheduler(config.renderWorkers, config.threadsPerRender)
+
+    with renderScheduler:
+        pipeline = VideoPipeline(
+            youtubeGrabbers,
+            gameplayPool,
+            renderScheduler,
+            downloadWorkers=config.downloadWorkers,
+            splitWorkers=config.splitWorkers,
+            maxPendingDownloads=config.maxPendingDownloads,
+            maxPendingRenders=config.maxPendingRenders,
+            backend=config.backend,
+            renderFromSource=config.renderFromSource,
+            silenceAwareSplits=config.silenceAwareSplits,
+            renderQueue=(
+                RenderQueue(Path(config.renderQueue)) if config.renderQueue else None
+            ),
+        )
+        results = pipeline.run(videoDataList, maxVideos=config.maxVideos)
+
+    RenderScheduler.printSummary(results)
+
+
+if __name__ == "__main__":
+    main()
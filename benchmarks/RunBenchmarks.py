@@ -0,0 +1,362 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from functools import partial
+from pathlib import Path
+from typing import Callable, List, Tuple
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import time
+
+from benchmarks.SyntheticMedia import createTestVideo
+from functions.Filesystem import createDirectory
+from functions.Metrics import metrics
+from processing.MediaInfo import probeMedia
+from processing.SplitVideo import Timestamp, getVideoDuration, splitVideoIntoChunks
+
+BENCHMARK_DIRECTORY = Path("data/benchmarks")
+# The caches of a single run, cleared before every run so none starts warm
+CACHE_DIRECTORY = BENCHMARK_DIRECTORY.joinpath("cache")
+METRICS_DIRECTORY = BENCHMARK_DIRECTORY.joinpath("metrics")
+
+
+@dataclass
+class BenchmarkResult:
+    """
+    The measurements of one benchmark on one test video
+
+    Attributes:
+        name (str): The name of the benchmark
+        media (str): The test video, as {width}x{height}-{duration}s
+        wallTime (float): The time the benchmark took in seconds
+        cpuTime (float): The cpu time of the benchmark and its ffmpeg processes
+        peakRss (int): The peak resident memory of the benchmark or any
+            of its ffmpeg processes in bytes
+        bytesWritten (int): The size of every file the benchmark wrote
+        frames (int | None): The frames rendered, if the benchmark renders
+        fps (float | None): The frames rendered per second of wall time
+    """
+
+    name: str
+    media: str
+    wallTime: float
+    cpuTime: float
+    peakRss: int
+    bytesWritten: int
+    frames: int | None = None
+    fps: float | None = None
+
+
+def getDirectorySize(directory: Path) -> int:
+    return sum(file.stat().st_size for file in directory.rglob("*") if file.is_file())
+
+
+def useBenchmarkMetrics():
+    """
+    Log the stages and ffmpeg runs of the benchmarks apart from real runs
+    """
+
+    metrics.logPath = METRICS_DIRECTORY.joinpath("events.jsonl")
+    metrics.prometheusPath = METRICS_DIRECTORY.joinpath("videoreuploader.prom")
+
+
+def clearProbes(mediaDirectory: Path):
+    for probePath in mediaDirectory.glob("*.probe.json"):
+        probePath.unlink(missing_ok=True)
+
+
+def measure(
+    name: str, media: str, function: Callable, workDirectory: Path, frames: int | None
+) -> BenchmarkResult:
+    """
+    Run a benchmark and measure it
+    Runs in a fresh process so the peak memory is only that of this benchmark
+    """
+
+    useBenchmarkMetrics()
+
+    for directory in (workDirectory, CACHE_DIRECTORY):
+        shutil.rmtree(directory, ignore_errors=True)
+        createDirectory(directory)
+
+    startTime = time.perf_counter()
+    function(workDirectory)
+    wallTime = time.perf_counter() - startTime
+
+    selfUsage = resource.getrusage(resource.RUSAGE_SELF)
+    childUsage = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    result = BenchmarkResult(
+        name=name,
+        media=media,
+        wallTime=wallTime,
+        cpuTime=sum(
+            usage.ru_utime + usage.ru_stime for usage in (selfUsage, childUsage)
+        ),
+        # Linux reports the peak in kilobytes
+        peakRss=max(selfUsage.ru_maxrss, childUsage.ru_maxrss) * 1024,
+        bytesWritten=getDirectorySize(workDirectory),
+        frames=frames,
+        fps=frames / wallTime if frames else None,
+    )
+
+    shutil.rmtree(workDirectory, ignore_errors=True)
+    return result
+
+
+def benchmarkProbe(videoPath: Path, workDirectory: Path):
+    getVideoDuration(videoPath)
+
+
+def benchmarkSplit(videoPath: Path, streamCopy: bool, workDirectory: Path):
+    splitVideoIntoChunks(videoPath, workDirectory, streamCopy=streamCopy)
+
+
+def benchmarkRender(
+    videoPath: Path,
+    gameplayPath: Path,
+    backend: str,
+    partLength: float,
+    workDirectory: Path,
+):
+    # Imported here so the probe and split benchmarks do not pay for moviepy
+    from functions.TextCache import textCache
+    from processing.ClipVideoBuilder import ClipVideoBuilder
+
+    textCache.directory = CACHE_DIRECTORY.joinpath("text")
+
+    builder = ClipVideoBuilder(
+        videoTitle="Benchmark video with a title long enough to wrap onto two lines",
+        videoKeywords=["benchmark"],
+        videoOutputDirectory=workDirectory,
+        videoClipPath=videoPath,
+        gameplayClipPath=gameplayPath,
+        currentPart=0,
+        totalParts=1,
+        backend=backend,
+        videoClipRange=Timestamp(0, partLength),
+    )
+    builder.buildVideo()
+
+
+def getFfmpegVersion() -> str:
+    result = subprocess.run(
+        ["ffmpeg", "-version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    return result.stdout.decode().split("\n")[0]
+
+
+def runBenchmarks(
+    durations: List[float],
+    resolutions: List[Tuple[int, int]],
+    backends: List[str],
+    partLength: float,
+) -> List[BenchmarkResult]:
+    """
+    Run every benchmark on every test video
+
+    Args:
+        durations (List[float]): The lengths of the test videos in seconds
+        resolutions (List[Tuple[int, int]]): The sizes of the test videos
+        backends (List[str]): The render backends to benchmark
+        partLength (float): The length of the rendered part in seconds
+
+    Returns:
+        List[BenchmarkResult]: The measurements, in the order they ran
+    """
+
+    useBenchmarkMetrics()
+
+    mediaDirectory = BENCHMARK_DIRECTORY.joinpath("media")
+    workDirectory = BENCHMARK_DIRECTORY.joinpath("work")
+
+    gameplayPath = createTestVideo(
+        mediaDirectory.joinpath("gameplay-1280x720.mp4"),
+        max(durations),
+        1280,
+        720,
+        audio=False,
+    )
+
+    results: List[BenchmarkResult] = []
+
+    # One process per benchmark, so no benchmark sees the memory or caches of another
+    with ProcessPoolExecutor(max_workers=1, max_tasks_per_child=1) as executor:
+
+        def run(
+            name: str,
+            media: str,
+            function: Callable,
+            frames: int | None = None,
+            setup: Callable | None = None,
+        ):
+            # Probes are saved next to the media, so every run starts without them
+            clearProbes(mediaDirectory)
+
+            # Run here, so the benchmark process does not measure it
+            if setup is not None:
+                setup()
+
+            future = executor.submit(
+                measure, name, media, function, workDirectory, frames
+            )
+            result = future.result()
+            results.append(result)
+
+            print(
+                f"{name:>16} {media:>16}: {result.wallTime:8.2f}s"
+                f" {result.peakRss / 1024 / 1024:8.1f} MiB"
+                + (f" {result.fps:8.1f} fps" if result.fps else "")
+            )
+
+        for width, height in resolutions:
+            for duration in durations:
+                media = f"{width}x{height}-{duration:g}s"
+                videoPath = createTestVideo(
+                    mediaDirectory.joinpath(f"{media}.mp4"), duration, width, height
+                )
+                sourceFrames = round(duration * 30)
+
+                run("probe-cold", media, partial(benchmarkProbe, videoPath))
+                run(
+                    "probe-warm",
+                    media,
+                    partial(benchmarkProbe, videoPath),
+                    # Saves the probe to disk, the benchmark process has none in memory
+                    setup=partial(probeMedia, videoPath),
+                )
+                run(
+                    "split-encode",
+                    media,
+                    partial(benchmarkSplit, videoPath, False),
+                    sourceFrames,
+                )
+                run(
+                    "split-copy",
+                    media,
+                    partial(benchmarkSplit, videoPath, True),
+                    sourceFrames,
+                )
+
+                renderLength = min(partLength, duration)
+                for backend in backends:
+                    run(
+                        f"render-{backend}",
+                        media,
+                        partial(
+                            benchmarkRender,
+                            videoPath,
+                            gameplayPath,
+                            backend,
+                            renderLength,
+                        ),
+                        # Parts are always rendered at 24 fps
+                        round(renderLength * 24),
+                    )
+
+    for directory in (workDirectory, CACHE_DIRECTORY):
+        shutil.rmtree(directory, ignore_errors=True)
+    clearProbes(mediaDirectory)
+
+    return results
+
+
+def saveResults(results: List[BenchmarkResult], outputPath: Path) -> Path:
+    createDirectory(outputPath.parent)
+
+    with open(outputPath, "w") as outputFile:
+        json.dump(
+            {
+                "createdAt": datetime.now().isoformat(timespec="seconds"),
+                "machine": {
+                    "platform": platform.platform(),
+                    "python": platform.python_version(),
+                    "cpuCount": os.cpu_count(),
+                    "ffmpeg": getFfmpegVersion(),
+                },
+                "results": [asdict(result) for result in results],
+            },
+            outputFile,
+            indent=4,
+        )
+
+    return outputPath
+
+
+def compareResults(results: List[BenchmarkResult], baselinePath: Path):
+    """
+    Print how much slower or faster every benchmark is than in a saved run
+    """
+
+    with open(baselinePath, "r") as baselineFile:
+        baseline = {
+            (result["name"], result["media"]): result
+            for result in json.load(baselineFile)["results"]
+        }
+
+    print(f"\nCompared to {baselinePath}")
+
+    for result in results:
+        previous = baseline.get((result.name, result.media))
+        if previous is None:
+            continue
+
+        timeChange = result.wallTime / previous["wallTime"] - 1
+        memoryChange = result.peakRss / previous["peakRss"] - 1
+
+        print(
+            f"{result.name:>16} {result.media:>16}: "
+            f"time {timeChange:+7.1%}, memory {memoryChange:+7.1%}"
+        )
+
+
+def parseResolution(resolution: str) -> Tuple[int, int]:
+    width, height = resolution.lower().split("x")
+    return int(width), int(height)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the split and render stages on generated test videos"
+    )
+    parser.add_argument("--durations", type=float, nargs="+", default=[30, 180, 600])
+    parser.add_argument(
+        "--resolutions",
+        type=parseResolution,
+        nargs="+",
+        default=[(640, 360), (1280, 720), (1920, 1080)],
+    )
+    parser.add_argument("--backends", nargs="+", default=["moviepy", "ffmpeg"])
+    parser.add_argument("--part-length", type=float, default=60)
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=BENCHMARK_DIRECTORY.joinpath(
+            "results", f"{datetime.now():%Y-%m-%d-%H%M%S}.json"
+        ),
+    )
+    parser.add_argument(
+        "--compare", type=Path, help="A saved run to compare the results against"
+    )
+    arguments = parser.parse_args()
+
+    results = runBenchmarks(
+        arguments.durations,
+        arguments.resolutions,
+        arguments.backends,
+        arguments.part_length,
+    )
+
+    print(f"\nSaved results to {saveResults(results, arguments.output)}")
+
+    if arguments.compare:
+        compareResults(results, arguments.compare)
+
+
+if __name__ == "__main__":
+    main()
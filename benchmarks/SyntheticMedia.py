@@ -0,0 +1,65 @@
+from pathlib import Path
+import os
+
+from functions.Filesystem import createDirectory
+from processing.SplitVideo import runFfmpeg
+
+
+def createTestVideo(
+    outputPath: Path,
+    duration: float,
+    width: int,
+    height: int,
+    fps: int = 30,
+    audio: bool = True,
+) -> Path:
+    """
+    Generate a test video with the ffmpeg lavfi sources
+    The same arguments always give the same frames and samples,
+    so runs on different days measure the same work
+
+    Args:
+        outputPath (Path): The path to save the video to
+        duration (float): The length of the video in seconds
+        width (int): The width of the video
+        height (int): The height of the video
+        fps (int): The frame rate of the video
+        audio (bool): Add a sine tone as the audio track
+
+    Returns:
+        Path: The path to the generated video
+    """
+
+    if outputPath.is_file():
+        return outputPath
+
+    createDirectory(outputPath.parent)
+    temporaryPath = outputPath.with_suffix(f".{os.getpid()}.tmp.mp4")
+
+    inputs = [
+        "-f", "lavfi",
+        "-i", f"testsrc2=size={width}x{height}:rate={fps}:duration={duration}",
+    ]
+    if audio:
+        inputs += [
+            "-f", "lavfi",
+            "-i", f"sine=frequency=440:sample_rate=44100:duration={duration}",
+        ]
+
+    runFfmpeg(
+        [
+            *inputs,
+            "-c:v", "libx264",
+            "-preset", "veryfast",
+            "-pix_fmt", "yuv420p",
+            # A keyframe every 2 seconds, like a typical youtube upload
+            "-g", str(fps * 2),
+            *(["-c:a", "aac"] if audio else []),
+            "-fflags", "+bitexact",
+            str(temporaryPath),
+        ],
+        check=True,
+    )
+
+    temporaryPath.replace(outputPath)
+    return outputPath
@@ -0,0 +1,360 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Set, Tuple
+from urllib.parse import urljoin, urlsplit
+import http.client
+import json
+import os
+import re
+import threading
+import time
+
+from functions.Filesystem import createDirectory
+from functions.Metrics import metrics
+
+# Errors worth retrying a request for
+retryableErrors = (OSError, http.client.HTTPException)
+
+
+class DownloadError(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    A class to reuse keep-alive connections between requests to the same host
+
+    Attributes:
+        timeout (float): The socket timeout of new connections in seconds
+        idleConnections (Dict[Tuple[str, str], List[HTTPConnection]]): The open
+            connections that are not in use, by scheme and host
+    """
+
+    def __init__(self, timeout: float = 30):
+        self.timeout = timeout
+        self.idleConnections: Dict[
+            Tuple[str, str], List[http.client.HTTPConnection]
+        ] = {}
+        self.lock = threading.Lock()
+
+    def getConnection(self, scheme: str, host: str) -> http.client.HTTPConnection:
+        with self.lock:
+            connections = self.idleConnections.get((scheme, host))
+            if connections:
+                return connections.pop()
+
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, timeout=self.timeout)
+        return http.client.HTTPConnection(host, timeout=self.timeout)
+
+    def releaseConnection(
+        self, scheme: str, host: str, connection: http.client.HTTPConnection
+    ):
+        """
+        Give a connection back once its response has been read completely
+        """
+
+        with self.lock:
+            self.idleConnections.setdefault((scheme, host), []).append(connection)
+
+    def request(
+        self, url: str, headers: Dict[str, str], method: str = "GET"
+    ) -> Tuple[http.client.HTTPResponse, Callable[[bool], None]]:
+        """
+        Send a request on a pooled connection
+
+        Returns:
+            HTTPResponse: The response, its body still unread
+            Callable: Call with True once the body has been read completely
+                to give the connection back, or with False to close it
+        """
+
+        splitUrl = urlsplit(url)
+        path = splitUrl.path + (f"?{splitUrl.query}" if splitUrl.query else "")
+
+        connection = self.getConnection(splitUrl.scheme, splitUrl.netloc)
+        try:
+            connection.request(method, path or "/", headers=headers)
+            response = connection.getresponse()
+        except retryableErrors:
+            # The pooled connection may have been closed by the server
+            connection.close()
+            raise
+
+        def release(reusable: bool = True):
+            if reusable and not response.will_close:
+                self.releaseConnection(splitUrl.scheme, splitUrl.netloc, connection)
+            else:
+                connection.close()
+
+        return response, release
+
+
+class DownloadManager:
+    """
+    A class to download files over several range requests at once
+    Partial downloads are kept next to the output and resumed after a crash
+
+    Attributes:
+        maxDownloads (int): The number of files downloaded at once
+        maxRangesPerDownload (int): The number of ranges of a file downloaded at once
+        rangeSize (int): The size of each range in bytes
+        maxRetries (int): The attempts at a range before the download fails
+        retryBackoff (float): The wait before the first retry in seconds,
+            doubled every retry
+    """
+
+    def __init__(
+        self,
+        maxDownloads: int = 2,
+        maxRangesPerDownload: int = 4,
+        rangeSize: int = 8 * 1024 * 1024,
+        maxRetries: int = 5,
+        retryBackoff: float = 1,
+        timeout: float = 30,
+    ):
+        self.maxDownloads = maxDownloads
+        self.maxRangesPerDownload = maxRangesPerDownload
+        self.rangeSize = rangeSize
+        self.maxRetries = maxRetries
+        self.retryBackoff = retryBackoff
+
+        self.connectionPool = ConnectionPool(timeout)
+        self.downloadSlots = threading.BoundedSemaphore(maxDownloads)
+        self.executor = ThreadPoolExecutor(max_workers=maxDownloads)
+
+    def submit(
+        self, url: str, outputPath: Path, expectedSize: int | None = None
+    ) -> Future:
+        """
+        Download a file in the background
+        """
+
+        return self.executor.submit(self.download, url, outputPath, expectedSize)
+
+    def download(
+        self, url: str, outputPath: Path, expectedSize: int | None = None
+    ) -> Path:
+        """
+        Download a file, resuming it if a previous attempt was cut short
+
+        Args:
+            url (str): The url of the file
+            outputPath (Path): The path to save the file to
+            expectedSize (int | None): The size the file should be in bytes
+
+        Returns:
+            Path: The path to the downloaded file
+        """
+
+        outputPath = Path(outputPath)
+        createDirectory(outputPath.parent)
+
+        with self.downloadSlots:
+            startTime = time.perf_counter()
+            url, totalSize, acceptsRanges = self.withRetries(self.probe, url)
+
+            if expectedSize and totalSize and totalSize != expectedSize:
+                raise DownloadError(
+                    f"{url} is {totalSize} bytes, expected {expectedSize} bytes"
+                )
+
+            partPath = outputPath.with_name(outputPath.name + ".part")
+
+            if acceptsRanges and totalSize:
+                downloadedBytes = self.downloadRanges(url, partPath, totalSize)
+            else:
+                self.withRetries(self.downloadWhole, url, partPath)
+                totalSize = totalSize or partPath.stat().st_size
+                downloadedBytes = partPath.stat().st_size
+
+            if partPath.stat().st_size != totalSize:
+                raise DownloadError(
+                    f"{outputPath} is {partPath.stat().st_size} bytes, "
+                    f"expected {totalSize} bytes"
+                )
+
+            os.replace(partPath, outputPath)
+            self.getProgressPath(partPath).unlink(missing_ok=True)
+
+            metrics.record(
+                "transfer",
+                path=outputPath,
+                bytes=downloadedBytes,
+                wallTime=time.perf_counter() - startTime,
+            )
+
+        return outputPath
+
+    def withRetries(self, function, *arguments):
+        """
+        Call a function, retrying it with exponential backoff when the connection fails
+        """
+
+        for attempt in range(self.maxRetries):
+            try:
+                return function(*arguments)
+            except (*retryableErrors, DownloadError):
+                if attempt == self.maxRetries - 1:
+                    raise
+
+                time.sleep(self.retryBackoff * 2**attempt)
+
+    def probe(self, url: str, redirects: int = 5) -> Tuple[str, int | None, bool]:
+        """
+        Find the size of a file and whether it can be downloaded in ranges
+
+        Returns:
+            str: The url of the file after following redirects
+            int | None: The size of the file in bytes, if known
+            bool: Whether the server accepts range requests
+        """
+
+        response, release = self.connectionPool.request(url, {"Range": "bytes=0-0"})
+
+        if response.status == 200:
+            # The server ignored the range, so do not read the whole file here
+            release(False)
+        else:
+            response.read()
+            release()
+
+        if response.status in (301, 302, 303, 307, 308) and redirects > 0:
+            redirectUrl = urljoin(url, response.getheader("Location"))
+            return self.probe(redirectUrl, redirects - 1)
+
+        if response.status == 206:
+            contentRange = re.match(
+                r"bytes \d+-\d+/(\d+)", response.getheader("Content-Range", "")
+            )
+            return url, int(contentRange.group(1)) if contentRange else None, True
+
+        if response.status == 200:
+            contentLength = response.getheader("Content-Length")
+            return url, int(contentLength) if contentLength else None, False
+
+        raise DownloadError(f"{url} responded with {response.status}")
+
+    @staticmethod
+    def getProgressPath(partPath: Path) -> Path:
+        return partPath.with_name(partPath.name + ".json")
+
+    def downloadRanges(self, url: str, partPath: Path, totalSize: int) -> int:
+        """
+        Download the missing ranges of a partial file
+        The ranges that have finished are recorded so a crash only loses the others
+
+        Returns:
+            int: The bytes downloaded, not counting ranges from an earlier attempt
+        """
+
+        progressPath = self.getProgressPath(partPath)
+        finishedRanges: Set[int] = set()
+
+        if partPath.is_file() and progressPath.is_file():
+            with open(progressPath, "r") as progressFile:
+                progress = json.load(progressFile)
+
+            # Ranges only line up with a partial file of the same size and range size
+            sameFile = progress["totalSize"] == totalSize
+            if sameFile and progress["rangeSize"] == self.rangeSize:
+                finishedRanges = set(progress["finishedRanges"])
+
+        if not finishedRanges:
+            with open(partPath, "wb") as partFile:
+                partFile.truncate(totalSize)
+
+        rangeCount = (totalSize + self.rangeSize - 1) // self.rangeSize
+        missingRanges = [i for i in range(rangeCount) if i not in finishedRanges]
+        progressLock = threading.Lock()
+
+        def downloadRange(rangeIndex: int):
+            start = rangeIndex * self.rangeSize
+            end = min(start + self.rangeSize, totalSize) - 1
+
+            self.withRetries(self.downloadRange, url, partPath, start, end)
+
+            with progressLock:
+                finishedRanges.add(rangeIndex)
+                self.saveProgress(progressPath, totalSize, finishedRanges)
+
+                percentage = len(finishedRanges) / rangeCount
+                print(f"Downloaded {percentage:.0%} of {partPath.stem}", end="\r")
+
+        with ThreadPoolExecutor(max_workers=self.maxRangesPerDownload) as executor:
+            for future in [executor.submit(downloadRange, i) for i in missingRanges]:
+                future.result()
+
+        return sum(
+            min(self.rangeSize, totalSize - i * self.rangeSize) for i in missingRanges
+        )
+
+    def saveProgress(
+        self, progressPath: Path, totalSize: int, finishedRanges: Set[int]
+    ):
+        temporaryPath = progressPath.with_name(progressPath.name + ".tmp")
+
+        with open(temporaryPath, "w") as progressFile:
+            json.dump(
+                {
+                    "totalSize": totalSize,
+                    "rangeSize": self.rangeSize,
+                    "finishedRanges": sorted(finishedRanges),
+                },
+                progressFile,
+            )
+
+        os.replace(temporaryPath, progressPath)
+
+    def downloadRange(self, url: str, partPath: Path, start: int, end: int):
+        response, release = self.connectionPool.request(
+            url, {"Range": f"bytes={start}-{end}"}
+        )
+
+        if response.status != 206:
+            release(False)
+            raise DownloadError(f"{url} responded with {response.status} to a range")
+
+        written = 0
+        try:
+            with open(partPath, "r+b") as partFile:
+                partFile.seek(start)
+
+                while block := response.read(1024 * 1024):
+                    partFile.write(block)
+                    written += len(block)
+        except retryableErrors:
+            release(False)
+            raise
+
+        # The server closed a connection that was cut short, it can not be reused
+        if written != end - start + 1:
+            release(False)
+            raise DownloadError(f"Range {start}-{end} of {url} was cut short")
+
+        release()
+
+    def downloadWhole(self, url: str, partPath: Path):
+        """
+        Download a file in one request, for servers that do not accept ranges
+        """
+
+        response, release = self.connectionPool.request(url, {})
+
+        if response.status != 200:
+            release(False)
+            raise DownloadError(f"{url} responded with {response.status}")
+
+        try:
+            with open(partPath, "wb") as partFile:
+                while block := response.read(1024 * 1024):
+                    partFile.write(block)
+        except retryableErrors:
+            release(False)
+            raise
+
+        # Bytes of the response left unread mean the server closed the connection
+        release(not response.length)
+
+
+downloadManager = DownloadManager()
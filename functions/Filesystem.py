@@ -1,3 +1,4 @@
+import hashlib
 import os
 from pathlib import Path
 
@@ -10,3 +11,15 @@ def createDirectory(path: Path):
         os.makedirs(path)
     return path
 
+
+def getFileChecksum(path: Path) -> str:
+    """
+    Get the sha256 of a file, reading it in blocks
+    """
+
+    fileHash = hashlib.sha256()
+    with open(path, "rb") as file:
+        while block := file.read(1024 * 1024):
+            fileHash.update(block)
+
+    return fileHash.hexdigest()
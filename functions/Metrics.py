@@ -0,0 +1,264 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, Tuple
+import json
+import os
+import subprocess
+import threading
+import time
+
+from functions.Filesystem import createDirectory
+
+try:
+    import resource
+except ImportError:
+    # Not available on windows
+    resource = None
+
+
+def getCpuTime() -> float:
+    """
+    The cpu time of this process and of the subprocesses it has waited for
+    """
+
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def getThreadCpuTime() -> float:
+    """
+    The cpu time of the calling thread
+    """
+
+    if resource is not None and hasattr(resource, "RUSAGE_THREAD"):
+        usage = resource.getrusage(resource.RUSAGE_THREAD)
+        return usage.ru_utime + usage.ru_stime
+
+    return time.thread_time()
+
+
+# The stages being measured in the current context, innermost last
+activeStages: ContextVar[Tuple[Dict, ...]] = ContextVar("activeStages", default=())
+
+
+class Metrics:
+    """
+    A class to record how long every stage takes and how much work it did
+    Events are appended to a JSON-lines log that every process shares,
+    and the Prometheus export is built from that log
+
+    Attributes:
+        logPath (Path): The JSON-lines log the events are appended to
+        prometheusPath (Path): The Prometheus text file the totals are exported to
+    """
+
+    def __init__(
+        self,
+        logPath: Path = Path("data/metrics/events.jsonl"),
+        prometheusPath: Path = Path("data/metrics/videoreuploader.prom"),
+    ):
+        self.logPath = logPath
+        self.prometheusPath = prometheusPath
+        self.lock = threading.Lock()
+
+    def record(self, event: str, **fields):
+        """
+        Append an event to the log
+
+        Args:
+            event (str): The kind of event, "stage", "transfer" or "ffmpeg"
+            **fields: The measurements and labels of the event
+        """
+
+        line = json.dumps(
+            {
+                "time": datetime.now().isoformat(timespec="milliseconds"),
+                "pid": os.getpid(),
+                "event": event,
+                **fields,
+            },
+            default=str,
+        )
+
+        with self.lock:
+            createDirectory(self.logPath.parent)
+            # Each event is a single append, so lines from other processes never mix
+            with open(self.logPath, "a") as logFile:
+                logFile.write(line + "\n")
+
+    def waitForProcess(self, process: subprocess.Popen) -> float | None:
+        """
+        Wait for a subprocess, adding its cpu time to the stages measuring
+        the current thread
+
+        Returns:
+            float | None: The cpu time of the subprocess, None if it can not be read
+        """
+
+        if not hasattr(os, "wait4"):
+            process.wait()
+            return None
+
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        cpuTime = usage.ru_utime + usage.ru_stime
+
+        with self.lock:
+            for stageTimes in activeStages.get():
+                stageTimes["childCpuTime"] += cpuTime
+
+        return cpuTime
+
+    @contextmanager
+    def measureStage(
+        self, stage: str, wholeProcess: bool = False, **labels
+    ) -> Iterator[Dict]:
+        """
+        Measure the wall and cpu time of a stage
+        The cpu time is that of the thread running the stage and of the
+        subprocesses it waited for with waitForProcess, so stages running
+        in other threads at the same time are not counted
+
+        Args:
+            stage (str): The name of the stage
+            wholeProcess (bool): Count the cpu time of every thread of the process
+                and every subprocess it waited for, for stages that have a
+                process to themselves, like a render in a worker
+            **labels: What the stage worked on, such as the video and part
+
+        Yields:
+            Dict: Add "bytes" or "frames" to it to record the throughput of the stage
+        """
+
+        measurement: Dict = {}
+        status = "failed"
+
+        stageTimes = {"childCpuTime": 0.0}
+        stagesToken = activeStages.set((*activeStages.get(), stageTimes))
+
+        startTime = time.perf_counter()
+        startCpuTime = getCpuTime() if wholeProcess else getThreadCpuTime()
+
+        try:
+            yield measurement
+            status = "succeeded"
+        finally:
+            wallTime = time.perf_counter() - startTime
+            activeStages.reset(stagesToken)
+
+            if wholeProcess:
+                cpuTime = getCpuTime() - startCpuTime
+            else:
+                cpuTime = (
+                    getThreadCpuTime() - startCpuTime + stageTimes["childCpuTime"]
+                )
+
+            if measurement.get("bytes"):
+                measurement["bytesPerSecond"] = measurement["bytes"] / wallTime
+            if measurement.get("frames"):
+                measurement["fps"] = measurement["frames"] / wallTime
+
+            self.record(
+                "stage",
+                stage=stage,
+                status=status,
+                wallTime=wallTime,
+                cpuTime=cpuTime,
+                **labels,
+                **measurement,
+            )
+
+    def readEvents(self) -> Iterator[Dict]:
+        if not self.logPath.is_file():
+            return
+
+        with open(self.logPath, "r") as logFile:
+            for line in logFile:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # A process was killed halfway through writing the line
+                    continue
+
+    def exportPrometheus(self) -> Path:
+        """
+        Total the logged events into a Prometheus text file
+        The file is replaced atomically, so it can be read by the node exporter
+        textfile collector at any time
+
+        Returns:
+            Path: The path to the Prometheus text file
+        """
+
+        counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+
+        def add(name: str, value: float, **labels):
+            key = (name, tuple(sorted(labels.items())))
+            counters[key] = counters.get(key, 0) + value
+
+        for event in self.readEvents():
+            if event["event"] == "stage":
+                stage = event["stage"]
+                add("stage_runs_total", 1, stage=stage, status=event["status"])
+                add("stage_wall_seconds_total", event["wallTime"], stage=stage)
+                add("stage_cpu_seconds_total", event["cpuTime"], stage=stage)
+
+                if event.get("frames"):
+                    add("stage_frames_total", event["frames"], stage=stage)
+                    add("stage_frame_seconds_total", event["wallTime"], stage=stage)
+            elif event["event"] == "transfer":
+                add("download_bytes_total", event["bytes"])
+                add("download_seconds_total", event["wallTime"])
+            elif event["event"] == "ffmpeg":
+                add(
+                    "ffmpeg_runs_total",
+                    1,
+                    program=event.get("program", "ffmpeg"),
+                    returnCode=str(event["returnCode"]),
+                )
+                add("ffmpeg_seconds_total", event["wallTime"])
+
+        # Rates over everything logged, the raw totals are exported as well
+        for (name, labels), value in list(counters.items()):
+            if name == "stage_frames_total":
+                frameSeconds = counters[("stage_frame_seconds_total", labels)]
+                counters[("stage_encode_fps", labels)] = value / frameSeconds
+            elif name == "download_bytes_total":
+                downloadSeconds = counters[("download_seconds_total", labels)]
+                counters[("download_bytes_per_second", labels)] = (
+                    value / downloadSeconds
+                )
+
+        lines = []
+        for name in sorted({name for name, _ in counters}):
+            metricType = "counter" if name.endswith("_total") else "gauge"
+            lines.append(f"# TYPE videoreuploader_{name} {metricType}")
+
+            for (counterName, labels), value in sorted(counters.items()):
+                if counterName != name:
+                    continue
+
+                labelText = ",".join(
+                    f'{labelName}="{labelValue}"' for labelName, labelValue in labels
+                )
+                lines.append(
+                    f"videoreuploader_{name}"
+                    + (f"{{{labelText}}}" if labelText else "")
+                    + f" {value}"
+                )
+
+        createDirectory(self.prometheusPath.parent)
+        temporaryPath = self.prometheusPath.with_name(
+            f"{self.prometheusPath.name}.{os.getpid()}.tmp"
+        )
+
+        with open(temporaryPath, "w") as prometheusFile:
+            prometheusFile.write("\n".join(lines) + "\n")
+        os.replace(temporaryPath, self.prometheusPath)
+
+        return self.prometheusPath
+
+
+metrics = Metrics()
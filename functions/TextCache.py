@@ -0,0 +1,167 @@
+from collections import OrderedDict
+from pathlib import Path
+from typing import Tuple
+import hashlib
+import json
+import os
+import numpy as np
+from PIL import Image
+from moviepy.editor import ImageClip, TextClip
+
+from functions.Filesystem import createDirectory
+
+
+class TextCache:
+    """
+    A class to cache rendered text images in memory and on disk
+    Images are keyed by everything that changes how the text looks,
+    so the same title or caption is only rendered by ImageMagick once
+
+    Attributes:
+        directory (Path): The directory the images are saved to
+        maxMemoryEntries (int): The number of images kept in memory
+        maxDiskEntries (int): The number of images kept on disk
+        images (OrderedDict[str, np.ndarray]): The images in memory, least recently used first
+    """
+
+    def __init__(
+        self,
+        directory: Path = Path("data/cache/text"),
+        maxMemoryEntries: int = 64,
+        maxDiskEntries: int = 4096,
+    ):
+        self.directory = directory
+        self.maxMemoryEntries = maxMemoryEntries
+        self.maxDiskEntries = maxDiskEntries
+
+        self.images: OrderedDict[str, np.ndarray] = OrderedDict()
+
+    @staticmethod
+    def getKey(
+        text: str,
+        font: str,
+        fontsize: int,
+        color: str,
+        align: str,
+        size: Tuple[int, int],
+    ) -> str:
+        textParameters = json.dumps(
+            [text, font, fontsize, color, align, list(size)], ensure_ascii=False
+        )
+        return hashlib.sha256(textParameters.encode("utf-8")).hexdigest()
+
+    def getTextImage(
+        self,
+        text: str,
+        font: str,
+        fontsize: int,
+        color: str,
+        align: str,
+        size: Tuple[int, int],
+    ) -> np.ndarray:
+        """
+        Get the rendered text, rendering it only if it is not cached
+
+        Returns:
+            np.ndarray: The RGBA image of the text
+        """
+
+        key = self.getKey(text, font, fontsize, color, align, size)
+
+        if key in self.images:
+            self.images.move_to_end(key)
+            return self.images[key]
+
+        imagePath = self.directory.joinpath(f"{key}.png")
+
+        if imagePath.is_file():
+            image = np.array(Image.open(imagePath).convert("RGBA"))
+            # Mark the image as recently used for disk eviction
+            try:
+                os.utime(imagePath)
+            except FileNotFoundError:
+                pass
+        else:
+            image = self.renderText(text, font, fontsize, color, align, size)
+            self.saveImage(imagePath, image)
+
+        self.images[key] = image
+        if len(self.images) > self.maxMemoryEntries:
+            self.images.popitem(last=False)
+
+        return image
+
+    @staticmethod
+    def renderText(
+        text: str,
+        font: str,
+        fontsize: int,
+        color: str,
+        align: str,
+        size: Tuple[int, int],
+    ) -> np.ndarray:
+        textClip = TextClip(
+            text,
+            fontsize=fontsize,
+            font=font,
+            color=color,
+            align=align,
+            size=size,
+        )
+
+        rgb = textClip.get_frame(0)
+        alpha = np.round(textClip.mask.get_frame(0) * 255)
+
+        return np.dstack([rgb, alpha]).astype(np.uint8)
+
+    def saveImage(self, imagePath: Path, image: np.ndarray):
+        createDirectory(self.directory)
+
+        # Write to a temporary file first so other processes never read half an image
+        temporaryPath = imagePath.with_name(f"{imagePath.stem}.{os.getpid()}.tmp")
+        Image.fromarray(image).save(temporaryPath, format="PNG")
+        os.replace(temporaryPath, imagePath)
+
+        self.evictDisk()
+
+    def evictDisk(self):
+        """
+        Delete the least recently used images over the disk limit
+        """
+
+        lastUsed = {}
+        for imagePath in self.directory.glob("*.png"):
+            try:
+                lastUsed[imagePath] = imagePath.stat().st_mtime
+            except FileNotFoundError:
+                # Evicted by another process in the meantime
+                continue
+
+        if len(lastUsed) <= self.maxDiskEntries:
+            return
+
+        imagePaths = sorted(lastUsed, key=lastUsed.get)
+        for imagePath in imagePaths[: len(imagePaths) - self.maxDiskEntries]:
+            imagePath.unlink(missing_ok=True)
+
+
+textCache = TextCache()
+
+
+def createTextImageClip(
+    text: str,
+    font: str,
+    fontsize: int,
+    color: str,
+    align: str,
+    size: Tuple[int, int],
+) -> ImageClip:
+    """
+    Create a clip of the text, using the cached image when there is one
+    Takes the same arguments as moviepy's TextClip
+    """
+
+    image = textCache.getTextImage(text, font, fontsize, color, align, size)
+
+    mask = ImageClip(image[:, :, 3] / 255, ismask=True)
+    return ImageClip(image[:, :, :3]).set_mask(mask)
@@ -0,0 +1,194 @@
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List
+from PIL import ImageFont
+
+# Font files to try for the ImageMagick font names used by the builder
+fontFiles = {
+    "Arial": ["Arial.ttf", "arial.ttf", "LiberationSans-Regular.ttf", "DejaVuSans.ttf"],
+    "Arial-Bold": [
+        "Arial-Bold.ttf",
+        "Arial Bold.ttf",
+        "arialbd.ttf",
+        "LiberationSans-Bold.ttf",
+        "DejaVuSans-Bold.ttf",
+    ],
+}
+
+
+def loadFont(font: str | None, fontSize: int) -> ImageFont.ImageFont:
+    """
+    Load a font by name or file, falling back to Pillow's default font
+    """
+
+    if font is not None:
+        for fontFile in fontFiles.get(font, [font]):
+            try:
+                return ImageFont.truetype(fontFile, fontSize)
+            except OSError:
+                continue
+
+    return ImageFont.load_default(fontSize)
+
+
+class FontMetrics:
+    """
+    A class to measure text in a font, caching the width of every glyph
+
+    Attributes:
+        imageFont (ImageFont): The loaded font
+        advances (Dict[str, float]): The advance width of each measured glyph
+        lineHeight (int): The height of a line of text
+    """
+
+    def __init__(self, font: str | None, fontSize: int):
+        self.imageFont = loadFont(font, fontSize)
+        self.advances: Dict[str, float] = {}
+
+        ascent, descent = self.imageFont.getmetrics()
+        self.lineHeight = ascent + descent
+
+    def getAdvance(self, glyph: str) -> float:
+        if glyph not in self.advances:
+            self.advances[glyph] = self.imageFont.getlength(glyph)
+
+        return self.advances[glyph]
+
+    def measure(self, text: str, letterSpacing: float = 0) -> float:
+        """
+        Measure the width of a line of text in pixels
+        """
+
+        if not text:
+            return 0
+
+        glyphWidth = sum(self.getAdvance(glyph) for glyph in text)
+        return glyphWidth + (len(text) - 1) * letterSpacing
+
+
+@lru_cache(maxsize=None)
+def getFontMetrics(font: str | None, fontSize: int) -> FontMetrics:
+    """
+    Get the metrics of a font, loading each font and size only once
+    """
+
+    return FontMetrics(font, fontSize)
+
+
+@dataclass
+class LineBox:
+    text: str
+    x: float
+    y: float
+    width: float
+    height: float
+
+
+@dataclass
+class TextLayout:
+    lines: List[LineBox]
+    width: float
+    height: float
+
+    @property
+    def lineCount(self) -> int:
+        return len(self.lines)
+
+    @property
+    def text(self) -> str:
+        return "\n".join(line.text for line in self.lines)
+
+
+def wrapWords(
+    text: str, metrics: FontMetrics, letterSpacing: float, maxWidth: float
+) -> List[str]:
+    """
+    Greedily fill each line with as many words as fit in the width
+    Words wider than a whole line are broken between characters
+    """
+
+    lines: List[str] = []
+    currentLine = ""
+    currentWidth = 0.0
+    spaceWidth = metrics.getAdvance(" ") + 2 * letterSpacing
+
+    for word in text.split():
+        wordWidth = metrics.measure(word, letterSpacing)
+
+        if currentLine and currentWidth + spaceWidth + wordWidth <= maxWidth:
+            currentLine += " " + word
+            currentWidth += spaceWidth + wordWidth
+            continue
+
+        if currentLine:
+            lines.append(currentLine)
+
+        currentLine, currentWidth = word, wordWidth
+
+        # Break the word up until the rest fits on a line
+        while currentWidth > maxWidth and len(currentLine) > 1:
+            splitIndex = 1
+            splitWidth = metrics.getAdvance(currentLine[0])
+
+            while splitIndex < len(currentLine):
+                glyphWidth = metrics.getAdvance(currentLine[splitIndex]) + letterSpacing
+                if splitWidth + glyphWidth > maxWidth:
+                    break
+                splitWidth += glyphWidth
+                splitIndex += 1
+
+            lines.append(currentLine[:splitIndex])
+            currentLine = currentLine[splitIndex:]
+            currentWidth = metrics.measure(currentLine, letterSpacing)
+
+    if currentLine:
+        lines.append(currentLine)
+
+    return lines
+
+
+def layoutText(
+    text: str,
+    fontSize: int,
+    maxWidth: float,
+    letterSpacing: float = 0,
+    font: str | None = None,
+    align: str = "center",
+) -> TextLayout:
+    """
+    Wrap text to a width by measuring it in the font it is drawn with
+
+    Args:
+        text (str): The text to wrap
+        fontSize (int): The size of the font
+        maxWidth (float): The widest a line can be in pixels
+        letterSpacing (float): The extra space between letters in pixels
+        font (str | None): The font name or file, Pillow's default font if None
+        align (str): How lines are aligned in the width, "left", "center" or "right"
+
+    Returns:
+        TextLayout: The lines and the box each one is drawn in
+    """
+
+    metrics = getFontMetrics(font, fontSize)
+
+    lineBoxes = []
+    for i, line in enumerate(wrapWords(text, metrics, letterSpacing, maxWidth)):
+        lineWidth = metrics.measure(line, letterSpacing)
+
+        if align.lower() == "center":
+            x = (maxWidth - lineWidth) / 2
+        elif align.lower() == "right":
+            x = maxWidth - lineWidth
+        else:
+            x = 0
+
+        lineBoxes.append(
+            LineBox(line, x, i * metrics.lineHeight, lineWidth, metrics.lineHeight)
+        )
+
+    return TextLayout(
+        lines=lineBoxes,
+        width=max((line.width for line in lineBoxes), default=0),
+        height=len(lineBoxes) * metrics.lineHeight,
+    )
@@ -1,5 +1,7 @@
-import textwrap
-from PIL import ImageFont
+import os
+import re
+
+from functions.TextLayout import layoutText
 
 def assertResponse(value: any, message: str):
     if not value:
@@ -11,16 +13,68 @@ def softWrapText(
     fontSize: int,
     letterSpacing: int,
     maxWidth: int,
+    font: str | None = None,
 ):
-    imageFont = ImageFont.load_default(fontSize)
+    layout = layoutText(
+        text,
+        fontSize=fontSize,
+        maxWidth=maxWidth,
+        letterSpacing=letterSpacing,
+        font=font,
+    )
+
+    return layout.text, layout.lineCount
+
+def parseIsoDuration(duration: str) -> float:
+    """
+    Parse an ISO 8601 duration like the api's "PT1H2M3S" into seconds
+    """
+
+    match = re.fullmatch(
+        r"P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+(?:\.\d+)?)S)?)?", duration
+    )
+    assert match, f"Invalid duration {duration}"
+
+    days, hours, minutes, seconds = (float(group or 0) for group in match.groups())
+    return ((days * 24 + hours) * 60 + minutes) * 60 + seconds
+
+def getAvailableMemory() -> int | None:
+    """
+    Get the available physical memory in bytes, None if it cannot be determined
+    Uses MemAvailable, which counts the page cache that can be reclaimed,
+    free pages are only used where the kernel does not report it
+    """
+
+    try:
+        with open("/proc/meminfo", "r") as memoryInfo:
+            for line in memoryInfo:
+                if line.startswith("MemAvailable:"):
+                    # Reported in kibibytes
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+def getWorkerCount(memoryPerWorker: int, threadsPerWorker: int = 1) -> int:
+    """
+    Get how many workers the machine can run at once
+
+    Args:
+        memoryPerWorker (int): The memory a single worker needs in bytes
+        threadsPerWorker (int): The cores a single worker keeps busy
 
-    textWidth = imageFont.getlength(text) + (len(text) - 1) * letterSpacing
-    letterWidth = textWidth / len(text)
+    Returns:
+        int: The number of workers, at least 1
+    """
 
-    if textWidth < maxWidth:
-        return text, 1
+    workerCount = (os.cpu_count() or 1) // threadsPerWorker
 
-    maxChars = maxWidth / letterWidth
-    wrappedText = textwrap.fill(text, width=maxChars)
-    return wrappedText, wrappedText.count("\n") + 1
+    availableMemory = getAvailableMemory()
+    if availableMemory is not None:
+        workerCount = min(workerCount, availableMemory // memoryPerWorker)
 
+    return max(1, workerCount)
@@ -1,9 +1,11 @@
 from pathlib import Path
 from typing import List
+import os
 from pytube import YouTube as PytubeDownloader
-from pytube.cli import on_progress
-from functions.Filesystem import createDirectory
+from functions.Metrics import metrics
 from processing.SplitVideo import splitVideoIntoChunks
+from storage.ArtifactStore import artifactStore, getSafeName
+from youtube.StreamSelector import downloadSelection, selectStreams
 
 
 class GameplayGrabber:
@@ -13,56 +15,93 @@ class GameplayGrabber:
     Attributes:
         link (str): The link to the gameplay video
         pytube (PytubeDownloader): The PytubeDownloader object
-        videoDirectory (Path): The directory to save the video
+        videoId (str): The id of the gameplay video, its artifacts are saved under
+        videoPath (Path): The path to the full downloaded video
+        splitDirectory (Path): The directory of the 1 minute clips
         alreadyDownloaded (bool): Whether the video has already been downloaded
     """
 
+    downloadParameters = {"targetWidth": 720}
+    splitParameters = {"download": downloadParameters, "chunkLength": 60}
+
     def __init__(self, link: str):
         self.link = link
-        self.pytube = PytubeDownloader(link, on_progress_callback=on_progress)
-        self.videoDirectory = Path(f"data/Gameplay/{self.pytube.title}")
+        self.pytube = PytubeDownloader(link)
+        self.videoId = self.pytube.video_id
 
-        self.alreadyDownloaded = self.videoDirectory.exists()
+        self.videoPath = artifactStore.getPath(
+            self.videoId, "download", self.downloadParameters, "main.mp4"
+        )
+        self.splitDirectory = artifactStore.getDirectory(
+            self.videoId, "split", self.splitParameters
+        )
 
-        createDirectory(self.videoDirectory)
+        artifactStore.link(
+            artifactStore.getVideoDirectory(self.videoId),
+            Path("data/Gameplay", f"{getSafeName(self.pytube.title)} [{self.videoId}]"),
+        )
+
+        # Downloads from before the artifact store are moved into it
+        legacyPath = Path("data/Gameplay", self.pytube.title, "main.mp4")
+        if not self.videoPath.is_file() and legacyPath.is_file():
+            os.replace(legacyPath, self.videoPath)
+
+        self.alreadyDownloaded = self.videoPath.is_file()
 
     def getGameplayClips(self) -> List[Path]:
         """
         Get the gameplay clips from the directory
         """
 
-        if self.alreadyDownloaded:
+        if self.splitDirectory.is_dir():
             return [
                 file
-                for file in self.videoDirectory.iterdir()
+                for file in self.splitDirectory.iterdir()
                 if file.is_file() and "part" in file.name and file.suffix == ".mp4"
             ]
         else:
-            exit("Gameplay not downloaded")
+            exit("Gameplay not split")
 
     def getGameplayClip(self, index: int) -> Path:
         """
         Get a specific gameplay clip from the directory
         """
 
-        return self.videoDirectory.joinpath(f"part-{index}.mp4")
+        return self.splitDirectory.joinpath(f"part-{index}.mp4")
 
-    def download(self) -> List[Path]:
+    def download(self, split: bool = True) -> List[Path]:
         """
         Download the gameplay video
+
+        Args:
+            split (bool): Split the video into 1 minute clips,
+                not needed when clips are served by a GameplayPool
+
+        Returns:
+            List[Path]: The clips, or the full video if it was not split
         """
 
         if self.alreadyDownloaded:
             print(f"{self.pytube.title} already exists")
-            return self.getGameplayClips()
-
-        stream = self.pytube.streams.get_highest_resolution()
-        videoPath = stream.download(
-            output_path=self.videoDirectory, filename="main.mp4"
-        )
-
-        self.alreadyDownloaded = True
-
-        splitVideoIntoChunks(videoPath, self.videoDirectory)
+        else:
+            with metrics.measureStage(
+                "gameplay-download", video=self.pytube.title
+            ) as measurement:
+                selection = selectStreams(
+                    self.pytube.streams, **self.downloadParameters
+                )
+                downloadSelection(selection, self.videoPath)
+                measurement["bytes"] = self.videoPath.stat().st_size
+
+            self.alreadyDownloaded = True
+
+        if not split:
+            return [self.videoPath]
+
+        if not self.splitDirectory.is_dir():
+            with artifactStore.writeDirectory(
+                self.videoId, "split", self.splitParameters
+            ) as temporaryDirectory:
+                splitVideoIntoChunks(self.videoPath, temporaryDirectory)
 
         return self.getGameplayClips()
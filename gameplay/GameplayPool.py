@@ -0,0 +1,116 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List
+import os
+import threading
+
+from functions.Filesystem import createDirectory
+from gameplay.GameplayGrabber import GameplayGrabber
+from processing.MediaInfo import probeMedia
+from processing.SplitVideo import runFfmpeg
+from storage.DiskBudget import DiskBudget, diskBudget
+
+
+@dataclass
+class GameplayClip:
+    """
+    A range of a gameplay video, extracted only when it is needed
+
+    Attributes:
+        sourcePath (Path): The path to the full gameplay video
+        start (float): Where the clip starts in the source, in seconds
+        duration (float): The length of the clip in seconds
+    """
+
+    sourcePath: Path
+    start: float
+    duration: float
+
+    def getPath(self) -> Path:
+        return self.sourcePath.parent.joinpath(
+            "clips", f"{self.start:.3f}-{self.duration:.3f}.mp4"
+        )
+
+    def extract(self) -> Path:
+        """
+        Extract the clip from the source
+        Seeks on the input so only the clip itself is decoded
+
+        Returns:
+            Path: The path to the extracted clip
+        """
+
+        clipPath = self.getPath()
+        if clipPath.is_file():
+            DiskBudget.markUsed(clipPath)
+            return clipPath
+
+        createDirectory(clipPath.parent)
+        temporaryPath = clipPath.with_suffix(f".{os.getpid()}.tmp.mp4")
+
+        runFfmpeg(
+            [
+                "-ss", str(self.start),
+                "-i", str(self.sourcePath),
+                "-t", str(self.duration),
+                "-an",
+                str(temporaryPath),
+            ],
+            check=True,
+        )
+
+        temporaryPath.replace(clipPath)
+        return clipPath
+
+
+class GameplayPool:
+    """
+    A class to hand out gameplay clips of an exact duration
+    Each source is read from a rotating offset and clips alternate between
+    sources, so footage only repeats once every source has been used up
+
+    Attributes:
+        sourcePaths (List[Path]): The paths to the full gameplay videos
+        offsets (Dict[Path, float]): Where the next clip of each source starts
+    """
+
+    def __init__(self, gameplayGrabbers: List[GameplayGrabber]):
+        assert gameplayGrabbers, "The gameplay pool needs at least one gameplay video"
+
+        self.sourcePaths = []
+        for gameplayGrabber in gameplayGrabbers:
+            gameplayGrabber.download(split=False)
+            self.sourcePaths.append(gameplayGrabber.videoPath)
+            # Every clip is cut from the source, so it is kept for as long as the pool
+            diskBudget.pin(gameplayGrabber.videoPath)
+
+        self.offsets: Dict[Path, float] = {path: 0 for path in self.sourcePaths}
+        self.nextSource = 0
+
+        self.lock = threading.Lock()
+
+    def reserveClip(self, duration: float) -> GameplayClip:
+        """
+        Reserve the next clip of a duration, without extracting it yet
+
+        Args:
+            duration (float): The length of the clip in seconds
+
+        Returns:
+            GameplayClip: The range of gameplay to put under the video
+        """
+
+        with self.lock:
+            sourcePath = self.sourcePaths[self.nextSource]
+            self.nextSource = (self.nextSource + 1) % len(self.sourcePaths)
+
+            sourceDuration = probeMedia(sourcePath).duration
+            start = self.offsets[sourcePath]
+
+            # Start the source over once the rest of it is too short
+            if start + duration > sourceDuration:
+                start = 0
+
+            self.offsets[sourcePath] = start + duration
+
+        return GameplayClip(sourcePath, start, min(duration, sourceDuration))
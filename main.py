@@ -1,59 +1,32 @@
-from pathlib import Path
 from dotenv import dotenv_values
-import concurrent.futures
 
-from functions.Filesystem import createDirectory
 from gameplay.GameplayGrabber import GameplayGrabber
-from processing.ClipVideoBuilder import ClipVideoBuilder
+from gameplay.GameplayPool import GameplayPool
+from processing.Pipeline import VideoPipeline
+from processing.RenderScheduler import RenderScheduler
 from youtube.YoutubeGrabber import YoutubeGrabber
-from youtube.YoutubeVideo import YoutubeVideo
 
-dotenv = dotenv_values(".env")
-apiKey = dotenv["GOOGLE_API_KEY"]
 
-targetChannel = "SamONellaAcademy"
-gameplayLinks = ["https://www.youtube.com/watch?v=n_Dv4JMiwK8"]
+def main():
+    dotenv = dotenv_values(".env")
+    apiKey = dotenv["GOOGLE_API_KEY"]
 
-youtubeGrabber = YoutubeGrabber(apiKey, targetChannel)
-videoDataList = youtubeGrabber.getVideos()
+    targetChannel = "SamONellaAcademy"
+    gameplayLinks = ["https://www.youtube.com/watch?v=n_Dv4JMiwK8"]
 
-gameplayGrabber = GameplayGrabber(gameplayLinks[0])
-gameplayIndex = 1
+    youtubeGrabber = YoutubeGrabber(apiKey, targetChannel)
+    videoDataList = youtubeGrabber.getVideos(sync=True)
+    videoDataList = youtubeGrabber.enrichVideos(videoDataList)
+    videoDataList = youtubeGrabber.filterVideos(videoDataList)
 
-outputDirectory = Path("output")
-createDirectory(outputDirectory)
+    gameplayPool = GameplayPool([GameplayGrabber(link) for link in gameplayLinks])
 
+    with RenderScheduler() as renderScheduler:
+        pipeline = VideoPipeline([youtubeGrabber], gameplayPool, renderScheduler)
+        results = pipeline.run(videoDataList, maxVideos=1)
 
-for videoData in videoDataList:
-    video = YoutubeVideo(youtubeGrabber, videoData)
-    videoOutputDirectory = outputDirectory.joinpath(video.title)
-
-    if videoOutputDirectory.exists():
-        print(f"Video {video.title} already exists, skipping")
-        continue
-
-    video.download()
-    video.split()
-
-    splits = video.getVideoSplits()
-
-    createDirectory(videoOutputDirectory)
-
-    for i, splitPath in enumerate(splits):
-        gameplayClipPath = gameplayGrabber.getGameplayClip(gameplayIndex)
-
-        videoBuilder = ClipVideoBuilder(
-            videoData=video,
-            videoOutputDirectory=videoOutputDirectory,
-            videoClipPath=splitPath,
-            gameplayClipPath=gameplayClipPath,
-            currentPart=i,
-            totalParts=len(splits)
-        )
-
-        videoBuilder.buildVideo()
-
-
-    break
+    RenderScheduler.printSummary(results)
 
 
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,108 @@
 import json
 from pathlib import Path
+from typing import List
+import time
+import numpy as np
+from PIL import Image
 from moviepy.editor import (
     VideoFileClip,
     CompositeVideoClip,
-    TextClip,
     ColorClip,
-    TextClip,
-    vfx
+    ImageClip,
 )
+from moviepy.audio.io.ffmpeg_audiowriter import FFMPEG_AudioWriter
+from moviepy.video.io.ffmpeg_writer import FFMPEG_VideoWriter
 
 from functions.Filesystem import createDirectory
+from functions.Metrics import metrics
+from functions.TextCache import createTextImageClip
 from functions.utils import softWrapText
-from youtube.YoutubeVideo import YoutubeVideo
+from processing.MediaInfo import probeMedia
+from processing.SplitVideo import Timestamp, runFfmpeg
+
+def recordWriterExitCodes(writerClass: type):
+    """
+    Log the exit code of the ffmpeg a moviepy writer pipes into, like runFfmpeg
+    does for its own runs, as moviepy waits for it but never checks the code
+    """
+
+    writerInit = writerClass.__init__
+    writerClose = writerClass.close
+
+    def __init__(writer, *arguments, **keywordArguments):
+        writer.startTime = time.perf_counter()
+        writerInit(writer, *arguments, **keywordArguments)
+
+    def close(writer):
+        # Closing again once the process has been waited for does nothing
+        process = getattr(writer, "proc", None)
+        writerClose(writer)
+
+        if process is not None and process.returncode is not None:
+            metrics.record(
+                "ffmpeg",
+                program="moviepy",
+                output=writer.filename,
+                returnCode=process.returncode,
+                wallTime=time.perf_counter() - writer.startTime,
+            )
+
+    writerClass.__init__ = __init__
+    writerClass.close = close
+
+
+for writerClass in (FFMPEG_VideoWriter, FFMPEG_AudioWriter):
+    recordWriterExitCodes(writerClass)
+
 
 class ClipVideoBuilder:
+    """
+    A class to build a tiktok style part of a video
+
+    Attributes:
+        videoTitle (str): The title of the source video
+        videoKeywords (List[str] | None): The keywords of the source video
+        backend (str): How the video is rendered, "moviepy" or "ffmpeg"
+        gameplayClipPath (Path | None): The gameplay to put under the video, if any
+        videoClipRange (Timestamp | None): The range of the video clip to render,
+            None to render all of it
+    """
+
+    backends = ("moviepy", "ffmpeg")
+
     def __init__(
         self,
-        videoData: YoutubeVideo,
+        videoTitle: str,
+        videoKeywords: List[str] | None,
         videoOutputDirectory: Path,
         videoClipPath: Path,
-        gameplayClipPath: Path,
+        gameplayClipPath: Path | None,
         currentPart: int,
         totalParts: int,
+        backend: str = "moviepy",
+        threads: int = 4,
+        videoClipRange: Timestamp | None = None,
     ):
-        self.videoData = videoData
+        if backend not in self.backends:
+            raise ValueError(f"Unknown render backend {backend}")
+
+        self.videoTitle = videoTitle
+        self.videoKeywords = videoKeywords
 
         self.videoClipPath = videoClipPath
+        self.videoClipRange = videoClipRange
         self.gameplayClipPath = gameplayClipPath
+        self.backend = backend
 
         self.width, self.height = 720, 1280
         self.topOffset = 80
+        self.fps = 24
+        self.threads = threads
 
         self.outputDirectory = videoOutputDirectory.joinpath(f"part-{currentPart}")
         self.outputPath = self.outputDirectory.joinpath("output.mp4")
+        # Rendered here and moved into place once finished
+        self.temporaryPath = self.outputDirectory.joinpath("output.tmp.mp4")
         self.metadataPath = self.outputDirectory.joinpath("metadata.json")
 
         self.wrappedLines = 1
@@ -42,25 +112,31 @@ class ClipVideoBuilder:
         self.totalParts = totalParts
 
         createDirectory(self.outputDirectory)
-        self.createMetadata()
 
     def createMetadata(self):
         with open(self.metadataPath, "w") as metadataFile:
             metadata = {
-                "title": self.videoData.title,
-                "tags": self.videoData.keywords,
+                "title": self.videoTitle,
+                "tags": self.videoKeywords,
             }
             json.dump(metadata, metadataFile)
 
+    def getTitlePosition(self) -> int:
+        return 50 + self.topOffset
+
+    def getCaptionPosition(self) -> int:
+        return 60 + (50 * self.wrappedLines) + self.topOffset
+
     def createTextClipTitle(self):
         videoTitle, wrappedLines = softWrapText(
-            self.videoData.title,
+            self.videoTitle,
             fontSize=40,
             letterSpacing=1,
             maxWidth=self.width * 0.8,
+            font="Arial-Bold",
         )
 
-        textClipTitle = TextClip(
+        textClipTitle = createTextImageClip(
             videoTitle,
             fontsize=40,
             font="Arial-Bold",
@@ -69,18 +145,18 @@ class ClipVideoBuilder:
             size=(self.width, 50 * wrappedLines),
         )
 
+        self.wrappedLines = wrappedLines
+
         textClipTitle = textClipTitle.set_position(
-            ("center", 50 + self.topOffset)
+            ("center", self.getTitlePosition())
         ).set_duration(self.videoDuration)
 
-        self.wrappedLines = wrappedLines
-
         return textClipTitle
 
     def createTextClipCaption(self):
         videoCaption = f"Part {self.currentPart + 1} of {self.totalParts}"
 
-        textClipCaption = TextClip(
+        textClipCaption = createTextImageClip(
             videoCaption,
             fontsize=40,
             font="Arial",
@@ -90,82 +166,181 @@ class ClipVideoBuilder:
         )
 
         textClipCaption = textClipCaption.set_position(
-            ("center", 60 + (50 * self.wrappedLines) + self.topOffset)
+            ("center", self.getCaptionPosition())
         )
         textClipCaption = textClipCaption.set_duration(self.videoDuration)
 
         return textClipCaption
 
+    def createStaticOverlay(self) -> np.ndarray:
+        """
+        Flatten the background, title and caption into a single frame
+        They never change, so they only have to be composited once per part
+
+        Returns:
+            np.ndarray: The RGB frame of the overlay
+        """
+
+        background = ColorClip(size=(self.width, self.height), color=(0, 0, 0))
+        background = background.set_duration(self.videoDuration)
+
+        textClipTitle = self.createTextClipTitle()
+        textClipCaption = self.createTextClipCaption()
+
+        staticClip = CompositeVideoClip([background, textClipTitle, textClipCaption])
+        return staticClip.get_frame(0)
+
     def buildVideo(self):
+        """
+        Render the part with the selected backend
+        """
+
+        # Parts render in worker processes of their own, so the cpu time of the
+        # whole process includes the ffmpeg moviepy writes through
+        with metrics.measureStage(
+            "render",
+            wholeProcess=True,
+            video=self.videoTitle,
+            part=self.currentPart,
+            backend=self.backend,
+        ) as measurement:
+            if self.backend == "ffmpeg":
+                self.buildVideoFfmpeg()
+            else:
+                self.buildVideoMoviepy()
+
+            measurement["frames"] = round(self.videoDuration * self.fps)
+
+        self.temporaryPath.replace(self.outputPath)
+
+        # Written last so a part with metadata is always a finished part
+        self.createMetadata()
+
+    def buildVideoMoviepy(self):
+        """
+        Render the part by compositing every frame with moviepy
+        """
+
         width, height = self.width, self.height
         topOffset = self.topOffset
 
         videoClip: VideoFileClip = VideoFileClip(str(self.videoClipPath))
+        if self.videoClipRange is not None:
+            videoClip = videoClip.subclip(
+                self.videoClipRange.start, self.videoClipRange.end
+            )
         videoClip = videoClip.resize(width=width)
 
-        gameplayClip: VideoFileClip = VideoFileClip(str(self.gameplayClipPath))
-        gameplayClip = gameplayClip.resize(width=width)
-        gameplayClip = gameplayClip.without_audio()
-
-        videoDuration = max(videoClip.duration, gameplayClip.duration)
-        self.videoDuration = videoDuration
-
-        background = ColorClip(size=(width, height), color=(0, 0, 0))
-        background = background.set_duration(videoDuration)
+        clips = [videoClip]
+        videoDuration = videoClip.duration
 
         centerY = height // 2
         videoClipHeight = videoClip.size[1]
 
-        videoClip = videoClip.set_position(
-            ("center", centerY - videoClipHeight + topOffset)
-        )
-        gameplayClip = gameplayClip.set_position(("center", centerY + topOffset))
-
-        textClipTitle = self.createTextClipTitle()
-        textClipCaption = self.createTextClipCaption()
-
-        finalClip = CompositeVideoClip(
-            [
-                background,
-                textClipTitle,
-                textClipCaption,
-                videoClip,
-                gameplayClip,
-            ]
-        )
+        if self.gameplayClipPath is not None:
+            gameplayClip: VideoFileClip = VideoFileClip(str(self.gameplayClipPath))
+            gameplayClip = gameplayClip.resize(width=width)
+            gameplayClip = gameplayClip.without_audio()
+            gameplayClip = gameplayClip.set_position(("center", centerY + topOffset))
 
-        finalClip.write_videofile(str(self.outputPath), fps=24, threads=4)
+            # Gameplay past the end of the video would only be wasted frames
+            if gameplayClip.duration > videoDuration:
+                gameplayClip = gameplayClip.subclip(0, videoDuration)
 
-    def buildVideo(self):
-        width, height = self.width, self.height
-        topOffset = self.topOffset
+            clips.append(gameplayClip)
 
-        videoClip: VideoFileClip = VideoFileClip(str(self.videoClipPath))
-        videoClip = videoClip.resize(width=width)
+            # The video sits on top of the gameplay
+            videoClip = videoClip.set_position(
+                ("center", centerY - videoClipHeight + topOffset)
+            )
+        else:
+            videoClip = videoClip.set_position(
+                ("center", centerY - (videoClipHeight // 2) + topOffset)
+            )
 
-        videoDuration  =videoClip.duration
+        clips[0] = videoClip
         self.videoDuration = videoDuration
 
-        background = ColorClip(size=(width, height), color=(0, 0, 0))
-        background = background.set_duration(videoDuration)
+        staticOverlay = ImageClip(self.createStaticOverlay())
+        staticOverlay = staticOverlay.set_duration(videoDuration)
 
-        centerY = height // 2
-        videoClipHeight = videoClip.size[1]
+        # The opaque overlay is the background, so only the videos are blended
+        finalClip = CompositeVideoClip([staticOverlay, *clips], use_bgclip=True)
 
-        videoClip = videoClip.set_position(
-            ("center", centerY - (videoClipHeight // 2) + topOffset)
+        # Moviepy names its temporary audio after the output in the working
+        # directory, where every part would share it
+        finalClip.write_videofile(
+            str(self.temporaryPath),
+            fps=self.fps,
+            threads=self.threads,
+            temp_audiofile=str(self.outputDirectory.joinpath("output.tmp.mp3")),
         )
 
-        textClipTitle = self.createTextClipTitle()
-        textClipCaption = self.createTextClipCaption()
+    def buildVideoFfmpeg(self):
+        """
+        Render the part with a single ffmpeg filter_complex
+        Only the static overlay is rendered by moviepy, once, as a still image
+        """
 
-        finalClip = CompositeVideoClip(
-            [
-                background,
-                textClipTitle,
-                textClipCaption,
-                videoClip,
+        width = self.width
+        topOffset = self.topOffset
+
+        # The overlay input ends the render, so gameplay is cut to the video
+        if self.videoClipRange is not None:
+            videoDuration = self.videoClipRange.end - self.videoClipRange.start
+            # Seek on the input so only the range itself is decoded
+            videoInput = [
+                "-ss", str(self.videoClipRange.start),
+                "-t", str(videoDuration),
+                "-i", str(self.videoClipPath),
             ]
-        )
+        else:
+            videoDuration = probeMedia(self.videoClipPath).duration
+            videoInput = ["-i", str(self.videoClipPath)]
 
-        finalClip.write_videofile(str(self.outputPath), fps=24, threads=4)
+        self.videoDuration = videoDuration
+
+        overlayPath = self.outputDirectory.joinpath("overlay.png")
+        Image.fromarray(self.createStaticOverlay()).save(overlayPath)
+
+        inputs = [
+            "-loop", "1",
+            "-framerate", str(self.fps),
+            "-t", str(videoDuration),
+            "-i", str(overlayPath),
+            *videoInput,
+        ]
+
+        filters = [f"[1:v]scale={width}:-2[video]"]
+
+        if self.gameplayClipPath is not None:
+            inputs += ["-i", str(self.gameplayClipPath)]
+            filters += [
+                f"[2:v]scale={width}:-2[gameplay]",
+                # The video sits on top of the gameplay
+                f"[0:v][video]overlay=(W-w)/2:H/2-h+{topOffset}"
+                ":eof_action=pass[top]",
+                f"[top][gameplay]overlay=(W-w)/2:H/2+{topOffset}"
+                ":eof_action=pass[out]",
+            ]
+        else:
+            filters += [
+                f"[0:v][video]overlay=(W-w)/2:H/2-h/2+{topOffset}"
+                ":eof_action=pass[out]",
+            ]
+
+        runFfmpeg(
+            [
+                *inputs,
+                "-filter_complex", ";".join(filters),
+                "-map", "[out]",
+                "-map", "1:a?",
+                "-r", str(self.fps),
+                "-c:v", "libx264",
+                "-pix_fmt", "yuv420p",
+                "-c:a", "aac",
+                "-threads", str(self.threads),
+                str(self.temporaryPath),
+            ],
+            check=True,
+        )
@@ -0,0 +1,55 @@
+from bisect import bisect_left, bisect_right
+from pathlib import Path
+from typing import List
+
+from processing.MediaInfo import probeMedia
+
+
+class KeyframeIndex:
+    """
+    A class to look up the keyframes of a video around a timestamp
+
+    Attributes:
+        keyframes (List[float]): The sorted timestamps of every keyframe, in seconds
+    """
+
+    def __init__(self, keyframes: List[float]):
+        self.keyframes = sorted(keyframes)
+
+    @classmethod
+    def fromMedia(cls, mediaPath: Path) -> "KeyframeIndex":
+        """
+        Build the index from the cached probe of a video
+        """
+
+        return cls(probeMedia(mediaPath).keyframes)
+
+    def atOrAfter(self, timestamp: float) -> float | None:
+        index = bisect_left(self.keyframes, timestamp)
+        return self.keyframes[index] if index < len(self.keyframes) else None
+
+    def atOrBefore(self, timestamp: float) -> float | None:
+        index = bisect_right(self.keyframes, timestamp)
+        return self.keyframes[index - 1] if index > 0 else None
+
+    def nearest(self, timestamp: float) -> float | None:
+        candidates = [
+            keyframe
+            for keyframe in (self.atOrBefore(timestamp), self.atOrAfter(timestamp))
+            if keyframe is not None
+        ]
+        return min(
+            candidates, key=lambda keyframe: abs(keyframe - timestamp), default=None
+        )
+
+    def snap(self, timestamp: float, tolerance: float) -> float | None:
+        """
+        Get the nearest keyframe, None if it is further away than the tolerance
+        """
+
+        keyframe = self.nearest(timestamp)
+
+        if keyframe is None or abs(keyframe - timestamp) > tolerance:
+            return None
+
+        return keyframe
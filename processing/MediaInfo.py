@@ -0,0 +1,196 @@
+from dataclasses import asdict, dataclass, field, fields
+from fractions import Fraction
+from pathlib import Path
+from typing import Dict, List, Tuple
+import json
+import os
+import subprocess
+import threading
+import time
+
+from functions.Metrics import metrics
+
+
+@dataclass
+class MediaInfo:
+    """
+    The information ffprobe reports about a media file
+
+    Attributes:
+        size (int): The size of the file in bytes, part of the cache key
+        modifiedTime (float): When the file was last modified, part of the cache key
+        duration (float): The duration in seconds
+        bitrate (int | None): The overall bitrate in bits per second
+        width (int | None): The width of the video stream
+        height (int | None): The height of the video stream
+        fps (float | None): The frame rate of the video stream
+        videoCodec (str | None): The codec of the video stream
+        videoProfile (str | None): The codec profile of the video stream, like "High"
+        videoLevel (int | None): The codec level of the video stream, 31 for 3.1
+        pixelFormat (str | None): The pixel format of the video stream
+        audioCodec (str | None): The codec of the audio stream
+        keyframes (List[float]): The timestamps of every video keyframe, in seconds
+    """
+
+    size: int
+    modifiedTime: float
+    duration: float
+    bitrate: int | None = None
+    width: int | None = None
+    height: int | None = None
+    fps: float | None = None
+    videoCodec: str | None = None
+    videoProfile: str | None = None
+    videoLevel: int | None = None
+    pixelFormat: str | None = None
+    audioCodec: str | None = None
+    keyframes: List[float] = field(default_factory=list)
+
+
+# Probes already read by this process, by path, size and modified time
+mediaInfoCache: Dict[Tuple[str, int, float], MediaInfo] = {}
+mediaInfoLock = threading.Lock()
+
+
+def getProbePath(mediaPath: Path) -> Path:
+    return mediaPath.with_name(mediaPath.name + ".probe.json")
+
+
+def runProbe(mediaPath: Path) -> dict:
+    """
+    Run ffprobe once for the format, the streams and the packet flags
+    Packets are read without decoding, so finding the keyframes is cheap
+    """
+
+    startTime = time.perf_counter()
+    result = subprocess.run(
+        [
+            "ffprobe",
+            "-v", "error",
+            "-print_format", "json",
+            "-show_entries",
+            "format=duration,bit_rate"
+            ":stream=index,codec_type,codec_name,profile,level,pix_fmt"
+            ",width,height,avg_frame_rate"
+            ":packet=stream_index,pts_time,flags",
+            str(mediaPath),
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+
+    metrics.record(
+        "ffmpeg",
+        program="ffprobe",
+        input=mediaPath,
+        returnCode=result.returncode,
+        wallTime=time.perf_counter() - startTime,
+    )
+
+    # The error carries ffprobe's stderr
+    result.check_returncode()
+
+    return json.loads(result.stdout)
+
+
+def parseProbe(probe: dict, size: int, modifiedTime: float) -> MediaInfo:
+    streams = probe.get("streams", [])
+    videoStream = next((s for s in streams if s["codec_type"] == "video"), None)
+    audioStream = next((s for s in streams if s["codec_type"] == "audio"), None)
+
+    mediaFormat = probe.get("format", {})
+    mediaInfo = MediaInfo(
+        size=size,
+        modifiedTime=modifiedTime,
+        duration=float(mediaFormat.get("duration", 0)),
+        bitrate=int(mediaFormat["bit_rate"]) if "bit_rate" in mediaFormat else None,
+        audioCodec=audioStream["codec_name"] if audioStream else None,
+    )
+
+    if videoStream is None:
+        return mediaInfo
+
+    mediaInfo.width = videoStream.get("width")
+    mediaInfo.height = videoStream.get("height")
+    mediaInfo.videoCodec = videoStream.get("codec_name")
+    mediaInfo.videoProfile = videoStream.get("profile")
+    mediaInfo.pixelFormat = videoStream.get("pix_fmt")
+
+    # Unknown levels are reported as -99
+    if videoStream.get("level", -99) > 0:
+        mediaInfo.videoLevel = videoStream["level"]
+
+    frameRate = videoStream.get("avg_frame_rate", "0/0")
+    if not frameRate.endswith("/0"):
+        mediaInfo.fps = float(Fraction(frameRate))
+
+    mediaInfo.keyframes = sorted(
+        float(packet["pts_time"])
+        for packet in probe.get("packets", [])
+        if packet.get("stream_index") == videoStream["index"]
+        and "K" in packet.get("flags", "")
+        and "pts_time" in packet
+    )
+
+    return mediaInfo
+
+
+def probeMedia(mediaPath: Path) -> MediaInfo:
+    """
+    Get the information of a media file, probing it only once
+    Probes are cached in memory and saved next to the media as {name}.probe.json,
+    and are reused for as long as the file keeps its size and modified time
+
+    Args:
+        mediaPath (Path): The path to the media file
+
+    Returns:
+        MediaInfo: The information of the media file
+    """
+
+    mediaPath = Path(mediaPath)
+    stat = mediaPath.stat()
+    cacheKey = (str(mediaPath.resolve()), stat.st_size, stat.st_mtime)
+
+    with mediaInfoLock:
+        if cacheKey in mediaInfoCache:
+            return mediaInfoCache[cacheKey]
+
+    probePath = getProbePath(mediaPath)
+    mediaInfo = None
+
+    if probePath.is_file():
+        try:
+            with open(probePath, "r") as probeFile:
+                savedProbe = json.load(probeFile)
+
+            # Probes saved before a field was added are probed again
+            if {mediaField.name for mediaField in fields(MediaInfo)} <= set(savedProbe):
+                mediaInfo = MediaInfo(**savedProbe)
+        except (json.JSONDecodeError, TypeError):
+            mediaInfo = None
+
+        if mediaInfo and (mediaInfo.size, mediaInfo.modifiedTime) != cacheKey[1:]:
+            # The media has changed since it was probed
+            mediaInfo = None
+
+    if mediaInfo is None:
+        mediaInfo = parseProbe(runProbe(mediaPath), stat.st_size, stat.st_mtime)
+        saveProbe(probePath, mediaInfo)
+
+    with mediaInfoLock:
+        mediaInfoCache[cacheKey] = mediaInfo
+
+    return mediaInfo
+
+
+def saveProbe(probePath: Path, mediaInfo: MediaInfo):
+    temporaryPath = probePath.with_name(f"{probePath.name}.{os.getpid()}.tmp")
+
+    try:
+        with open(temporaryPath, "w") as probeFile:
+            json.dump(asdict(mediaInfo), probeFile)
+        os.replace(temporaryPath, probePath)
+    except OSError:
+        # The probe is still cached in memory if the directory is read only
+        pass
@@ -0,0 +1,537 @@
+from pathlib import Path
+from queue import Queue
+from typing import Dict, List, Set, Tuple
+from concurrent.futures import Future
+from functools import partial
+import threading
+import time
+import traceback
+
+from functions.Filesystem import createDirectory
+from functions.Metrics import metrics
+from gameplay.GameplayPool import GameplayPool
+from processing.RenderScheduler import RenderJob, RenderResult, RenderScheduler
+from processing.MediaInfo import probeMedia
+from processing.SplitVideo import Timestamp
+from storage.ArtifactStore import artifactStore, getSafeName
+from storage.DiskBudget import diskBudget
+from storage.JobStore import JobStore
+from storage.RenderQueue import RenderQueue
+from storage.VideoCatalog import VideoCatalog, VideoRecord
+from youtube.YoutubeGrabber import YoutubeGrabber
+from youtube.YoutubeVideo import YoutubeVideo
+
+
+# How the videos of every channel are ordered in the work queue
+videoPriorities = {
+    "newest": lambda record: record.publishedAt,
+    "oldest": lambda record: record.publishedAt,
+    "shortest": lambda record: (record.duration is None, record.duration or 0),
+    "mostViewed": lambda record: record.viewCount or 0,
+}
+
+
+def prioritizeVideos(records: List[VideoRecord], priority: str) -> List[VideoRecord]:
+    """
+    Order the videos of many channels into a single work queue
+
+    Args:
+        records (List[VideoRecord]): The videos to order
+        priority (str): "newest", "oldest", "shortest" or "mostViewed",
+            videos that have not been enriched go last when ordering by duration
+
+    Returns:
+        List[VideoRecord]: The videos, the first to be processed first
+    """
+
+    if priority not in videoPriorities:
+        raise ValueError(f"Unknown video priority {priority}")
+
+    return sorted(
+        records,
+        key=videoPriorities[priority],
+        reverse=priority in ("newest", "mostViewed"),
+    )
+
+
+class VideoPipeline:
+    """
+    A class to download, split and render videos with the stages overlapping
+    The next video downloads while the current one splits and earlier parts render
+
+    Attributes:
+        youtubeGrabbers (Dict[str, YoutubeGrabber]): The grabbers the videos are
+            downloaded with, by the channel they were fetched for
+        gameplayPool (GameplayPool | None): The pool the gameplay clips come from,
+            None to render without gameplay
+        renderScheduler (RenderScheduler): The scheduler the parts are rendered by
+        outputDirectory (Path): The directory the rendered videos are linked from,
+            they are saved in the artifact store
+        downloadWorkers (int): The number of videos downloaded at once
+        splitWorkers (int): The number of videos split at once
+        maxPendingDownloads (int): The most raw downloads on disk waiting to be split,
+            or when rendering from source, waiting for all of their parts to render
+        maxPendingRenders (int): The most parts submitted to the scheduler and not
+            yet rendered, splitting waits once they are reached so the earlier
+            stages can not run ahead of rendering. Defaults to twice its workers
+        backend (str): The render backend of the parts
+        renderFromSource (bool): Render the parts straight from ranges of the
+            downloaded video instead of splitting it into files first
+        silenceAwareSplits (bool): End the parts at the quietest point near every
+            minute instead of on the exact minute
+        jobStore (JobStore): The record of finished work, used to resume batches
+        renderQueue (RenderQueue | None): Publish the parts to this queue for render
+            workers on any machine, instead of rendering them in the scheduler.
+            Their results are copied into the job store at the start and end of a run
+        diskWaitTimeout (float | None): The longest a download waits for the disk
+            budget to free up before going ahead anyway, in seconds
+        sourceHolds (Dict[str, int]): The parts of each video rendering from its
+            download, its download slot is given back once they have all finished
+    """
+
+    def __init__(
+        self,
+        youtubeGrabbers: List[YoutubeGrabber],
+        gameplayPool: GameplayPool | None,
+        renderScheduler: RenderScheduler,
+        outputDirectory: Path = Path("output"),
+        downloadWorkers: int = 1,
+        splitWorkers: int = 1,
+        maxPendingDownloads: int = 2,
+        maxPendingRenders: int | None = None,
+        backend: str = "moviepy",
+        jobStore: JobStore | None = None,
+        renderFromSource: bool = False,
+        silenceAwareSplits: bool = False,
+        renderQueue: RenderQueue | None = None,
+        diskWaitTimeout: float | None = 1800,
+    ):
+        self.youtubeGrabbers = {
+            youtubeGrabber.targetChannel: youtubeGrabber
+            for youtubeGrabber in youtubeGrabbers
+        }
+        self.gameplayPool = gameplayPool
+        self.renderScheduler = renderScheduler
+        self.outputDirectory = outputDirectory
+
+        self.downloadWorkers = downloadWorkers
+        self.splitWorkers = splitWorkers
+        self.maxPendingDownloads = maxPendingDownloads
+        self.maxPendingRenders = maxPendingRenders or renderScheduler.maxWorkers * 2
+        self.backend = backend
+        self.jobStore = jobStore or JobStore()
+        self.renderFromSource = renderFromSource
+        self.silenceAwareSplits = silenceAwareSplits
+        self.renderQueue = renderQueue
+        self.diskWaitTimeout = diskWaitTimeout
+
+        # Held from the submission of a part until it has rendered
+        self.renderSlots = threading.BoundedSemaphore(self.maxPendingRenders)
+
+        # Parts rendered here from source read the download until they finish
+        self.holdsSources = self.renderFromSource and self.renderQueue is None
+        self.sourceHolds: Dict[str, int] = {}
+        self.sourceLock = threading.Lock()
+        self.downloadSlots: threading.BoundedSemaphore | None = None
+
+        # Unfinished and queued jobs keep their intermediates in any process
+        diskBudget.addPinSource(self.getReferencedPaths)
+
+        createDirectory(self.outputDirectory)
+
+    def run(
+        self, videoDataList: List[VideoRecord], maxVideos: int | None = None
+    ) -> Dict[str, List[RenderResult]]:
+        """
+        Process the videos through every stage
+
+        Args:
+            videoDataList (List[VideoRecord]): The fetched videos to process
+            maxVideos (int | None): Stop after this many videos have been queued,
+                videos that are already complete are not counted
+
+        Returns:
+            Dict[str, List[RenderResult]]: The render results grouped by video title
+        """
+
+        downloadQueue: Queue[YoutubeVideo | None] = Queue(maxsize=self.downloadWorkers)
+        splitQueue: Queue[YoutubeVideo | None] = Queue(maxsize=self.maxPendingDownloads)
+
+        # Held from the start of a download until its video has been split,
+        # or rendered when the parts are rendered from the download
+        self.downloadSlots = threading.BoundedSemaphore(self.maxPendingDownloads)
+
+        downloadThreads = self.startWorkers(
+            self.downloadWorkers, self.downloadStage, downloadQueue, splitQueue
+        )
+        splitThreads = self.startWorkers(self.splitWorkers, self.splitStage, splitQueue)
+
+        # Videos the workers have finished since the last run are skipped
+        self.syncRenderQueue()
+
+        queuedVideos = 0
+        for videoData in videoDataList:
+            if maxVideos is not None and queuedVideos >= maxVideos:
+                break
+
+            video = YoutubeVideo(self.youtubeGrabbers[videoData.channel], videoData)
+
+            if self.jobStore.isVideoComplete(video.videoId, self.getRenderKey(video)):
+                print(f"Video {video.title} already exists, skipping")
+                continue
+
+            self.downloadSlots.acquire()
+            downloadQueue.put(video)
+            queuedVideos += 1
+
+        self.stopWorkers(downloadThreads, downloadQueue)
+        self.stopWorkers(splitThreads, splitQueue)
+
+        results = self.renderScheduler.collect()
+        self.syncRenderQueue()
+
+        print(f"Exported metrics to {metrics.exportPrometheus()}")
+
+        return results
+
+    @staticmethod
+    def startWorkers(count: int, stage, *arguments) -> List[threading.Thread]:
+        threads = [
+            threading.Thread(target=stage, args=arguments, daemon=True)
+            for _ in range(count)
+        ]
+        for thread in threads:
+            thread.start()
+
+        return threads
+
+    @staticmethod
+    def stopWorkers(threads: List[threading.Thread], queue: Queue):
+        """
+        Let the workers finish the queue, then wait for them to exit
+        """
+
+        for _ in threads:
+            queue.put(None)
+        for thread in threads:
+            thread.join()
+
+    def getRenderParameters(self, youtubeGrabber: YoutubeGrabber) -> dict:
+        return {
+            "split": youtubeGrabber.getSplitParameters(self.silenceAwareSplits),
+            "renderFromSource": self.renderFromSource,
+            "backend": self.backend,
+        }
+
+    def getRenderKey(self, video: YoutubeVideo) -> str:
+        """
+        Get the key of the render artifact, the name of its directory
+        """
+
+        return artifactStore.getKey(
+            "render", self.getRenderParameters(video.youtubeGrabber)
+        )
+
+    def getRenderKeys(self) -> Set[str]:
+        """
+        Get the render keys of the current settings, one for every channel
+        """
+
+        return {
+            artifactStore.getKey("render", self.getRenderParameters(youtubeGrabber))
+            for youtubeGrabber in self.youtubeGrabbers.values()
+        }
+
+    def getVideoOutputDirectory(self, video: YoutubeVideo) -> Path:
+        """
+        Get the render artifact of a video, linked from output/{title} [{videoId}]
+        """
+
+        videoOutputDirectory = artifactStore.createArtifact(
+            video.videoId, "render", self.getRenderParameters(video.youtubeGrabber)
+        )
+
+        artifactStore.link(
+            videoOutputDirectory,
+            self.outputDirectory.joinpath(
+                f"{getSafeName(video.title)} [{video.videoId}]"
+            ),
+        )
+
+        return videoOutputDirectory
+
+    def getReferencedPaths(self) -> List[Path]:
+        """
+        Get the intermediates the recorded jobs still need, the downloads and chunks
+        of unfinished videos and the clips of parts waiting in the render queue
+        """
+
+        paths = [
+            artifactStore.getVideoDirectory(videoId)
+            for videoId in self.jobStore.getUnfinishedVideos()
+        ]
+
+        if self.renderQueue is not None:
+            for job in self.renderQueue.getQueuedJobs():
+                paths.append(job.videoClipPath)
+
+                if job.gameplayClip is not None:
+                    paths.append(job.gameplayClip.sourcePath)
+                    paths.append(job.gameplayClip.getPath())
+
+        return paths
+
+    def holdSource(self, videoId: str):
+        with self.sourceLock:
+            self.sourceHolds[videoId] = self.sourceHolds.get(videoId, 0) + 1
+
+    def releaseSource(self, videoId: str):
+        """
+        Give back the download slot of a video once nothing reads its download
+        """
+
+        with self.sourceLock:
+            self.sourceHolds[videoId] -= 1
+            if self.sourceHolds[videoId] > 0:
+                return
+
+            del self.sourceHolds[videoId]
+
+        self.downloadSlots.release()
+
+    def markFailed(self, video: YoutubeVideo, action: str):
+        """
+        Record the exception being handled as the failure of a video
+        The worker carries on with the next video even if the job store is locked
+        """
+
+        error = traceback.format_exc()
+        print(f"Failed to {action} {video.title}\n{error}")
+
+        try:
+            self.jobStore.markVideo(video.videoId, video.title, "failed", error=error)
+        except Exception:
+            print(f"Failed to record the failure of {video.title}")
+            traceback.print_exc()
+
+    def isDownloaded(self, video: YoutubeVideo) -> bool:
+        """
+        Whether a video has been downloaded or split before, and is still on disk
+        """
+
+        stage = self.jobStore.getVideoStage(video.videoId)
+
+        # Once split, the chunks are all the renders need
+        isSplit = (
+            stage == "split"
+            and not self.renderFromSource
+            and video.youtubeGrabber.getSplitDirectory(
+                video.videoId, self.silenceAwareSplits
+            ).is_dir()
+        )
+
+        return stage in ("downloaded", "split") and (
+            video.videoPath.is_file() or isSplit
+        )
+
+    def downloadStage(self, downloadQueue: Queue, splitQueue: Queue):
+        while (video := downloadQueue.get()) is not None:
+            # Everything here reads the databases, which can be locked, so any
+            # failure gives the slot back instead of ending the worker
+            try:
+                if not self.isDownloaded(video):
+                    # Make room before the download, instead of filling the disk
+                    if not diskBudget.waitForSpace(self.diskWaitTimeout):
+                        print(f"Disk budget is full, downloading {video.title} anyway")
+
+                    # Pinned until the job store records the download,
+                    # which keeps it after
+                    with diskBudget.pinned(
+                        artifactStore.getVideoDirectory(video.videoId)
+                    ):
+                        startTime = time.perf_counter()
+                        video.download()
+                        self.jobStore.markVideo(
+                            video.videoId,
+                            video.title,
+                            "downloaded",
+                            duration=time.perf_counter() - startTime,
+                        )
+            except Exception:
+                self.markFailed(video, "download")
+                self.downloadSlots.release()
+                continue
+
+            splitQueue.put(video)
+
+    def splitStage(self, splitQueue: Queue):
+        while (video := splitQueue.get()) is not None:
+            # Kept until every part is submitted, so a part that renders quickly
+            # can not give the slot back while the others are still being queued
+            if self.holdsSources:
+                self.holdSource(video.videoId)
+
+            try:
+                # Splits are made once, this only splits again if they were evicted
+                startTime = time.perf_counter()
+                splits = (
+                    video.getVideoSegments(self.silenceAwareSplits)
+                    if self.renderFromSource
+                    else video.split(self.silenceAwareSplits)
+                )
+
+                if self.jobStore.getVideoStage(video.videoId) != "split":
+                    self.jobStore.markVideo(
+                        video.videoId,
+                        video.title,
+                        "split",
+                        duration=time.perf_counter() - startTime,
+                        totalParts=len(splits),
+                    )
+
+                # Other split settings can plan another number of parts, so
+                # every render artifact is finished against its own plan
+                self.jobStore.markPlan(
+                    video.videoId, self.getRenderKey(video), len(splits)
+                )
+
+                self.submitRenders(video)
+            except Exception:
+                self.markFailed(video, "split")
+            finally:
+                if self.holdsSources:
+                    self.releaseSource(video.videoId)
+                else:
+                    self.downloadSlots.release()
+
+    def getParts(self, video: YoutubeVideo) -> List[Tuple[Path, Timestamp | None]]:
+        """
+        Get the file and range every part of a video is rendered from
+        """
+
+        if self.renderFromSource:
+            return [
+                (segment.sourcePath, segment.timestamp)
+                for segment in video.getVideoSegments(self.silenceAwareSplits)
+            ]
+
+        return [
+            (splitPath, None)
+            for splitPath in video.getVideoSplits(self.silenceAwareSplits)
+        ]
+
+    def submitRenders(self, video: YoutubeVideo):
+        parts = self.getParts(video)
+
+        videoOutputDirectory = self.getVideoOutputDirectory(video)
+        createDirectory(videoOutputDirectory)
+
+        # Parts rendered with other settings are in another artifact, so they are
+        # rendered again and every part of the video ends up in this one
+        renderedParts = self.jobStore.getRenderedParts(
+            video.videoId, self.getRenderKey(video)
+        )
+
+        for i, (videoClipPath, videoClipRange) in enumerate(parts):
+            if i in renderedParts:
+                continue
+
+            gameplayClip = None
+            if self.gameplayPool is not None:
+                partDuration = (
+                    videoClipRange.end - videoClipRange.start
+                    if videoClipRange
+                    else probeMedia(videoClipPath).duration
+                )
+                gameplayClip = self.gameplayPool.reserveClip(partDuration)
+
+            job = RenderJob(
+                videoId=video.videoId,
+                videoTitle=video.title,
+                videoKeywords=video.keywords,
+                videoOutputDirectory=videoOutputDirectory,
+                videoClipPath=videoClipPath,
+                gameplayClip=gameplayClip,
+                currentPart=i,
+                totalParts=len(parts),
+                backend=self.backend,
+                videoClipRange=videoClipRange,
+            )
+
+            if self.renderQueue is not None:
+                self.renderQueue.publish(job)
+                continue
+
+            if gameplayClip is not None:
+                diskBudget.pin(gameplayClip.getPath())
+
+            self.renderSlots.acquire()
+            if self.holdsSources:
+                self.holdSource(video.videoId)
+
+            try:
+                future = self.renderScheduler.submit(job)
+            except BaseException:
+                self.renderSlots.release()
+                if self.holdsSources:
+                    self.releaseSource(video.videoId)
+                raise
+
+            future.add_done_callback(partial(self.recordRender, job))
+
+    def recordRender(self, job: RenderJob, future: Future):
+        """
+        Record a finished render in the job store as soon as it completes
+        """
+
+        self.renderSlots.release()
+        if self.holdsSources:
+            self.releaseSource(job.videoId)
+
+        try:
+            result: RenderResult = future.result()
+        except Exception:
+            result = RenderResult(job, 0, traceback.format_exc())
+
+        if job.gameplayClip is not None:
+            diskBudget.unpin(job.gameplayClip.getPath())
+
+        self.recordResult(result)
+
+    def recordResult(self, result: RenderResult):
+        job = result.job
+
+        self.jobStore.markPart(
+            job.videoId,
+            job.currentPart,
+            "rendered" if result.succeeded else "failed",
+            duration=result.duration,
+            outputPath=result.outputPath,
+            checksum=result.checksum,
+            error=result.error,
+            renderKey=job.renderKey,
+        )
+
+        if self.jobStore.isVideoComplete(job.videoId, job.renderKey):
+            VideoCatalog.load().updateVideo(job.videoId, state="processed")
+
+    def syncRenderQueue(self):
+        """
+        Copy the results render workers have written to the queue into the job store
+        Results rendered with other settings are left in the queue, they would
+        replace the parts rendered with the current ones
+        """
+
+        if self.renderQueue is None:
+            return
+
+        renderKeys = self.getRenderKeys()
+
+        for result in self.renderQueue.getResults():
+            job = result.job
+            if job.renderKey not in renderKeys:
+                continue
+
+            renderedParts = self.jobStore.getRenderedParts(job.videoId, job.renderKey)
+            if job.currentPart not in renderedParts:
+                self.recordResult(result)
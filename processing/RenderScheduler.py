@@ -0,0 +1,182 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List
+import multiprocessing
+import time
+import traceback
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from functions.Filesystem import getFileChecksum
+from functions.utils import getWorkerCount
+from gameplay.GameplayPool import GameplayClip
+from processing.ClipVideoBuilder import ClipVideoBuilder
+from processing.SplitVideo import Timestamp
+
+# Rough memory a single render needs in bytes
+RENDER_WORKER_MEMORY = 2 * 1024 * 1024 * 1024
+
+
+@dataclass
+class RenderJob:
+    """
+    Everything a worker process needs to render one part
+    """
+
+    videoId: str
+    videoTitle: str
+    videoKeywords: List[str] | None
+    videoOutputDirectory: Path
+    videoClipPath: Path
+    gameplayClip: GameplayClip | None
+    currentPart: int
+    totalParts: int
+    backend: str = "moviepy"
+    videoClipRange: Timestamp | None = None
+
+    @property
+    def renderKey(self) -> str:
+        """
+        The key of the render artifact the part is rendered into, its output directory
+        """
+
+        return self.videoOutputDirectory.name
+
+
+@dataclass
+class RenderResult:
+    job: RenderJob
+    duration: float
+    error: str | None = None
+    outputPath: Path | None = None
+    checksum: str | None = None
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None
+
+
+def renderPart(job: RenderJob, threads: int) -> RenderResult:
+    """
+    Render a single part, catching any failure so the batch keeps going
+    Runs inside a worker process
+    """
+
+    startTime = time.perf_counter()
+
+    try:
+        # Extracted here so gameplay clips are cut in parallel by the workers
+        gameplayClipPath = job.gameplayClip.extract() if job.gameplayClip else None
+
+        videoBuilder = ClipVideoBuilder(
+            videoTitle=job.videoTitle,
+            videoKeywords=job.videoKeywords,
+            videoOutputDirectory=job.videoOutputDirectory,
+            videoClipPath=job.videoClipPath,
+            gameplayClipPath=gameplayClipPath,
+            currentPart=job.currentPart,
+            totalParts=job.totalParts,
+            backend=job.backend,
+            threads=threads,
+            videoClipRange=job.videoClipRange,
+        )
+        videoBuilder.buildVideo()
+        checksum = getFileChecksum(videoBuilder.outputPath)
+    except Exception:
+        return RenderResult(job, time.perf_counter() - startTime, traceback.format_exc())
+
+    return RenderResult(
+        job,
+        time.perf_counter() - startTime,
+        outputPath=videoBuilder.outputPath,
+        checksum=checksum,
+    )
+
+
+class RenderScheduler:
+    """
+    A class to render parts of one or more videos in a process pool
+
+    Attributes:
+        threadsPerRender (int): The encoder threads each render uses
+        maxWorkers (int): The number of parts rendered at once
+        jobs (Dict[Future, RenderJob]): The submitted renders, in submission order
+    """
+
+    def __init__(self, maxWorkers: int | None = None, threadsPerRender: int = 4):
+        self.threadsPerRender = threadsPerRender
+        self.maxWorkers = maxWorkers or getWorkerCount(
+            RENDER_WORKER_MEMORY, threadsPerRender
+        )
+
+        # Spawned, as a forked worker can inherit a lock held by another thread
+        # of the pipeline, like the metrics writer, and hang on it forever
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.maxWorkers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        self.jobs: Dict[Future, RenderJob] = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.shutdown()
+
+    def submit(self, job: RenderJob) -> Future:
+        """
+        Queue a part for rendering
+        """
+
+        future = self.executor.submit(renderPart, job, self.threadsPerRender)
+        self.jobs[future] = job
+        return future
+
+    def submitAll(self, jobs: List[RenderJob]) -> List[Future]:
+        return [self.submit(job) for job in jobs]
+
+    def collect(self) -> Dict[str, List[RenderResult]]:
+        """
+        Wait for every submitted render
+
+        Returns:
+            Dict[str, List[RenderResult]]: The results grouped by video title,
+                ordered by part
+        """
+
+        results: Dict[str, List[RenderResult]] = {}
+
+        for future, job in self.jobs.items():
+            try:
+                result = future.result()
+            except Exception:
+                # The worker process itself died
+                result = RenderResult(job, 0, traceback.format_exc())
+
+            results.setdefault(job.videoTitle, []).append(result)
+
+        for videoResults in results.values():
+            videoResults.sort(key=lambda result: result.job.currentPart)
+
+        self.jobs = {}
+        return results
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+    @staticmethod
+    def printSummary(results: Dict[str, List[RenderResult]]):
+        """
+        Print how many parts of each video rendered and why the others failed
+        """
+
+        for videoTitle, videoResults in results.items():
+            failed = [result for result in videoResults if not result.succeeded]
+            renderTime = sum(result.duration for result in videoResults)
+
+            print(
+                f"{videoTitle}: {len(videoResults) - len(failed)} of "
+                f"{len(videoResults)} parts rendered in {renderTime:.1f}s"
+            )
+
+            for result in failed:
+                print(f"  Part {result.job.currentPart + 1} failed:\n{result.error}")
@@ -0,0 +1,119 @@
+from dataclasses import replace
+import os
+import shutil
+import socket
+import threading
+import time
+
+from processing.RenderScheduler import renderPart
+from storage.RenderQueue import RenderLease, RenderQueue
+
+
+class RenderWorker:
+    """
+    A class to render the jobs of a RenderQueue until it runs dry
+    Parts are rendered into a staging directory of their lease and only moved
+    into place once the queue confirms the lease is still held
+    Results are only written to the queue, as the job store uses WAL, which
+    can not be shared between machines, so the pipeline copies them over
+
+    Attributes:
+        renderQueue (RenderQueue): The queue the jobs are claimed from
+        workerId (str): The name of this worker, unique across machines
+        leaseDuration (float): How long a lease lasts without a heartbeat in seconds
+        threads (int): The encoder threads each render uses
+        pollInterval (float): The wait between claims while the queue is empty
+        exitWhenDrained (bool): Stop once every job has been rendered or has failed,
+            instead of waiting for more jobs
+    """
+
+    def __init__(
+        self,
+        renderQueue: RenderQueue,
+        leaseDuration: float = 120,
+        threads: int = 4,
+        pollInterval: float = 5,
+        exitWhenDrained: bool = False,
+    ):
+        self.renderQueue = renderQueue
+        self.workerId = f"{socket.gethostname()}-{os.getpid()}"
+
+        self.leaseDuration = leaseDuration
+        self.threads = threads
+        self.pollInterval = pollInterval
+        self.exitWhenDrained = exitWhenDrained
+
+    def run(self):
+        while True:
+            lease = self.renderQueue.claim(self.workerId, self.leaseDuration)
+
+            if lease is None:
+                if self.exitWhenDrained and self.renderQueue.isDrained():
+                    return
+
+                time.sleep(self.pollInterval)
+                continue
+
+            self.renderLease(lease)
+
+    def renderLease(self, lease: RenderLease):
+        """
+        Render a claimed part, heartbeating the lease until it has finished
+        """
+
+        job = lease.job
+        print(
+            f"{self.workerId} rendering part {job.currentPart + 1} of {job.videoTitle}"
+        )
+
+        stagingDirectory = job.videoOutputDirectory.joinpath(
+            ".staging", f"part-{job.currentPart}-lease-{lease.token}"
+        )
+        stagedPartDirectory = stagingDirectory.joinpath(f"part-{job.currentPart}")
+        partDirectory = job.videoOutputDirectory.joinpath(f"part-{job.currentPart}")
+
+        rendered = threading.Event()
+        heartbeatThread = threading.Thread(
+            target=self.heartbeat, args=(lease, rendered), daemon=True
+        )
+        heartbeatThread.start()
+
+        try:
+            result = renderPart(
+                replace(job, videoOutputDirectory=stagingDirectory), self.threads
+            )
+        finally:
+            rendered.set()
+            heartbeatThread.join()
+
+        if result.succeeded:
+
+            def publishOutput():
+                partDirectory.mkdir(parents=True, exist_ok=True)
+                # The metadata goes last, it marks the part as finished
+                for fileName in ("output.mp4", "metadata.json"):
+                    os.replace(
+                        stagedPartDirectory.joinpath(fileName),
+                        partDirectory.joinpath(fileName),
+                    )
+
+            outputPath = partDirectory.joinpath("output.mp4")
+            if not self.renderQueue.complete(
+                lease,
+                outputPath,
+                publishOutput,
+                duration=result.duration,
+                checksum=result.checksum,
+            ):
+                print(f"{self.workerId} lost the lease on part {job.currentPart + 1}")
+        else:
+            self.renderQueue.fail(lease, result.error, duration=result.duration)
+
+        shutil.rmtree(stagingDirectory, ignore_errors=True)
+
+    def heartbeat(self, lease: RenderLease, rendered: threading.Event):
+        # Renew well before the lease runs out, so a slow write does not lose it
+        while not rendered.wait(self.leaseDuration / 3):
+            if not self.renderQueue.heartbeat(lease, self.leaseDuration):
+                print(f"{self.workerId} lost the lease on {lease.job.videoTitle}")
+                return
@@ -0,0 +1,147 @@
+from pathlib import Path
+from typing import List
+import math
+import subprocess
+import time
+import numpy as np
+
+from functions.Metrics import metrics
+from processing.MediaInfo import probeMedia
+from processing.SplitVideo import Timestamp, getChunkTimestamps, mergeShortLastChunk
+
+# Bytes of decoded audio read from ffmpeg at a time
+AUDIO_BLOCK_SIZE = 1024 * 1024
+
+
+def computeAudioLevels(
+    inputVideo: Path, sampleRate: int = 8000, windowLength: float = 0.05
+) -> np.ndarray:
+    """
+    Get the loudness of a video over time
+    The audio is decoded once as low rate mono and read in blocks, so only
+    the levels are kept in memory and never the decoded audio itself
+
+    Args:
+        inputVideo (Path): The path to the input video
+        sampleRate (int): The sample rate the audio is decoded at
+        windowLength (float): The length of each window in seconds
+
+    Returns:
+        np.ndarray: The RMS level of every window, window i starts at i * windowLength
+    """
+
+    windowSamples = max(1, round(sampleRate * windowLength))
+    # 16 bit samples, blocks are whole windows so none straddle two reads
+    windowBytes = windowSamples * 2
+    blockSize = max(1, AUDIO_BLOCK_SIZE // windowBytes) * windowBytes
+
+    startTime = time.perf_counter()
+    process = subprocess.Popen(
+        [
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel", "error",
+            "-i", str(inputVideo),
+            "-vn",
+            "-ac", "1",
+            "-ar", str(sampleRate),
+            "-f", "s16le",
+            "pipe:1",
+        ],
+        stdout=subprocess.PIPE,
+    )
+
+    levels: List[np.ndarray] = []
+    leftover = b""
+
+    while block := process.stdout.read(blockSize):
+        block = leftover + block
+        wholeBytes = len(block) - len(block) % windowBytes
+        leftover = block[wholeBytes:]
+
+        samples = np.frombuffer(block[:wholeBytes], dtype=np.int16)
+        windows = samples.astype(np.float32).reshape(-1, windowSamples)
+        levels.append(np.sqrt(np.mean(np.square(windows), axis=1)))
+
+    # The last window may only be partly filled
+    if len(leftover) >= 2:
+        samples = np.frombuffer(leftover[: len(leftover) - len(leftover) % 2], np.int16)
+        levels.append(np.sqrt([np.mean(np.square(samples.astype(np.float32)))]))
+
+    process.stdout.close()
+    cpuTime = metrics.waitForProcess(process)
+
+    metrics.record(
+        "ffmpeg",
+        program="ffmpeg",
+        input=inputVideo,
+        output="pipe:1",
+        returnCode=process.returncode,
+        wallTime=time.perf_counter() - startTime,
+        cpuTime=cpuTime,
+    )
+
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, process.args)
+
+    return np.concatenate(levels) if levels else np.zeros(0, dtype=np.float32)
+
+
+def planSilenceBoundaries(
+    inputVideo: Path,
+    chunkLength: float = 60,
+    searchWindow: float = 5,
+    maxLength: float | None = None,
+    windowLength: float = 0.05,
+) -> List[Timestamp]:
+    """
+    Plan the chunk boundaries of a video at the quietest points near every minute
+    Falls back to the fixed chunks when the video has no audio
+
+    Args:
+        inputVideo (Path): The path to the input video
+        chunkLength (float): The length a chunk should be in seconds
+        searchWindow (float): How far a boundary may move from its target in seconds
+        maxLength (float | None): The longest a chunk may be, defaults to two chunks
+        windowLength (float): The length of the windows the audio is measured in
+
+    Returns:
+        List[Timestamp]: The start and end of every chunk, in order
+    """
+
+    mediaInfo = probeMedia(inputVideo)
+    duration = mediaInfo.duration
+
+    if mediaInfo.audioCodec is None:
+        return getChunkTimestamps(duration, chunkLength)
+
+    if maxLength is None:
+        maxLength = chunkLength * 2
+    assert maxLength >= chunkLength, "Chunks can not be longer than the max length"
+
+    levels = computeAudioLevels(inputVideo, windowLength=windowLength)
+
+    timeStamps: List[Timestamp] = []
+    start = 0
+
+    while duration - start > chunkLength:
+        target = start + chunkLength
+        searchStart = max(start + windowLength, target - searchWindow)
+        searchEnd = min(target + searchWindow, start + maxLength, duration)
+
+        firstWindow = math.ceil(searchStart / windowLength)
+        lastWindow = min(math.floor(searchEnd / windowLength), len(levels))
+
+        if firstWindow < lastWindow:
+            quietestWindow = firstWindow + int(np.argmin(levels[firstWindow:lastWindow]))
+            end = round(min((quietestWindow + 0.5) * windowLength, searchEnd), 3)
+        else:
+            # The audio ended before the search window
+            end = target
+
+        timeStamps.append(Timestamp(start, end))
+        start = end
+
+    timeStamps.append(Timestamp(start, duration))
+
+    return mergeShortLastChunk(timeStamps, chunkLength, maxLength)
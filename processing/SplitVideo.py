@@ -1,160 +1,564 @@
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Tuple
+from typing import List
 import math
+import shutil
 import subprocess
+import time
 from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
 
+from functions.Filesystem import createDirectory
+from functions.Metrics import metrics
+from functions.utils import getWorkerCount
+from processing.KeyframeIndex import KeyframeIndex
+from processing.MediaInfo import probeMedia
 
-def getVideoDuration(inputVideo: Path) -> int:
+# Rough memory a single ffmpeg split needs in bytes, with a few encoder threads
+SPLIT_WORKER_MEMORY = 512 * 1024 * 1024
+
+# The h264 profiles libx264 can encode, by the name ffprobe reports them with
+x264Profiles = {
+    "Constrained Baseline": "baseline",
+    "Baseline": "baseline",
+    "Main": "main",
+    "High": "high",
+}
+# The pixel formats of those profiles
+x264PixelFormats = ("yuv420p", "yuvj420p")
+
+
+def getVideoDuration(inputVideo: Path) -> float:
     """
     Get the duration of a video in seconds
     """
-    result = subprocess.run(
+    return probeMedia(inputVideo).duration
+
+
+@dataclass
+class Timestamp:
+    start: float
+    end: float
+
+
+@dataclass
+class VideoSegment:
+    """
+    A chunk of a video that is read straight from the source when rendering
+    instead of being split into its own file first
+    """
+
+    sourcePath: Path
+    index: int
+    timestamp: Timestamp
+
+    @property
+    def duration(self) -> float:
+        return self.timestamp.end - self.timestamp.start
+
+
+def runFfmpeg(arguments: List[str], check: bool = False) -> subprocess.CompletedProcess:
+    """
+    Run ffmpeg quietly with the given arguments, overwriting any outputs
+    Every run is logged with its exit code and cpu time
+
+    Args:
+        arguments (List[str]): The arguments after the global options
+        check (bool): Raise a CalledProcessError if ffmpeg fails
+
+    Returns:
+        subprocess.CompletedProcess: The finished ffmpeg process
+    """
+
+    command = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", *arguments]
+
+    startTime = time.perf_counter()
+    process = subprocess.Popen(command)
+    cpuTime = metrics.waitForProcess(process)
+    result = subprocess.CompletedProcess(command, process.returncode)
+
+    metrics.record(
+        "ffmpeg",
+        program="ffmpeg",
+        output=arguments[-1],
+        returnCode=result.returncode,
+        wallTime=time.perf_counter() - startTime,
+        cpuTime=cpuTime,
+    )
+
+    if check:
+        result.check_returncode()
+
+    return result
+
+
+def getFrameCount(inputVideo: Path, duration: float) -> int | None:
+    """
+    Estimate the frames in a range of a video from its frame rate
+    """
+
+    fps = probeMedia(inputVideo).fps
+    return round(duration * fps) if fps else None
+
+
+def getChunkTimestamps(duration: float, chunkLength: int = 60) -> List[Timestamp]:
+    """
+    Plan the chunk boundaries of a video
+
+    Args:
+        duration (float): The duration of the video in seconds
+        chunkLength (int): The length of each chunk in seconds
+
+    Returns:
+        List[Timestamp]: The start and end of every chunk
+    """
+
+    timeStamps: List[Timestamp] = []
+
+    # Calculate the number of chunks
+    numChunks = math.ceil(duration / chunkLength)
+
+    for i in range(numChunks):
+        startTime = i * chunkLength
+        endTime = min((i + 1) * chunkLength, duration)
+        timeStamps.append(Timestamp(startTime, endTime))
+
+    return mergeShortLastChunk(timeStamps, chunkLength)
+
+
+def mergeShortLastChunk(
+    timeStamps: List[Timestamp], chunkLength: float, maxLength: float | None = None
+) -> List[Timestamp]:
+    """
+    Combine the last chunk with the preceding one if it is less than a chunk long
+
+    Args:
+        timeStamps (List[Timestamp]): The planned chunks, changed in place
+        chunkLength (float): The length a chunk should be in seconds
+        maxLength (float | None): Only combine them if the result is at most this long
+
+    Returns:
+        List[Timestamp]: The planned chunks
+    """
+
+    if len(timeStamps) > 1 and timeStamps[-1].end - timeStamps[-1].start < chunkLength:
+        lastChunkIndex = len(timeStamps) - 2
+        mergedChunk = Timestamp(timeStamps[lastChunkIndex].start, timeStamps[-1].end)
+
+        if maxLength is None or mergedChunk.end - mergedChunk.start <= maxLength:
+            timeStamps.pop()
+            timeStamps[lastChunkIndex] = mergedChunk
+
+    return timeStamps
+
+
+def getVideoSegments(
+    inputVideo: Path, timeStamps: List[Timestamp] | None = None
+) -> List[VideoSegment]:
+    """
+    Plan the 1-minute chunks of a video without splitting it
+
+    Args:
+        inputVideo (Path): The path to the input video
+        timeStamps (List[Timestamp] | None): The chunks to use instead of 1-minute ones
+
+    Returns:
+        List[VideoSegment]: The chunks, in order
+    """
+
+    if timeStamps is None:
+        timeStamps = getChunkTimestamps(getVideoDuration(inputVideo))
+
+    return [
+        VideoSegment(inputVideo, i, timestamp) for i, timestamp in enumerate(timeStamps)
+    ]
+
+
+def splitVideoChunk(
+    inputVideo: Path,
+    outputFileName: Path,
+    start: float,
+    end: float,
+    threads: int | None = None,
+):
+    """
+    Split a single chunk out of a video
+    Seeks on the input so only the chunk itself is decoded
+
+    Args:
+        threads (int | None): The encoder threads, None for ffmpeg's default
+            of about one and a half per core
+    """
+
+    threadArguments = ["-threads", str(threads)] if threads else []
+
+    runFfmpeg(
         [
-            "ffprobe",
-            "-v",
-            "error",
-            "-show_entries",
-            "format=duration",
-            "-of",
-            "default=noprint_wrappers=1:nokey=1",
-            str(inputVideo),
+            "-ss", str(start),
+            "-i", str(inputVideo),
+            "-t", str(end - start),
+            *threadArguments,
+            str(outputFileName),
         ],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
+        check=True,
     )
-    duration = float(result.stdout)
-    return int(duration)
 
 
-@dataclass
-class Timestamp:
-    start: int
-    end: int
+def getSegmentPaths(outputDir: Path) -> List[Path]:
+    """
+    Get the chunks the segment muxer wrote, in chunk order
+    """
 
+    return sorted(
+        outputDir.glob("part-*.mp4"),
+        key=lambda path: int(path.stem.removeprefix("part-")),
+    )
+
+
+def splitVideoIntoChunks(
+    inputVideo: Path,
+    outputDir: Path,
+    streamCopy: bool = False,
+    timeStamps: List[Timestamp] | None = None,
+) -> List[Path]:
+    """
+    Split a video into 1-minute chunks and save them to the output directory
+    The source is read once by ffmpeg's segment muxer
 
-def splitVideoChunk(inputVideo: Path, outputFileName: Path, start: int, end: int):
-    subprocess.run(
+    Args:
+        inputVideo (Path): The path to the input video
+        outputDir (Path): The path to the output directory
+        streamCopy (bool): Copy the streams instead of re-encoding them,
+            chunks will then start on the first keyframe at or after each boundary,
+            so there can be fewer chunks than planned
+        timeStamps (List[Timestamp] | None): The chunks to use instead of 1-minute ones
+
+    Returns:
+        List[Path]: The paths to the chunks that were written
+    """
+
+    duration = getVideoDuration(inputVideo)
+    if timeStamps is None:
+        timeStamps = getChunkTimestamps(duration)
+
+    # Every chunk after the first starts a new segment
+    segmentTimes = ",".join(str(timestamp.start) for timestamp in timeStamps[1:])
+
+    if streamCopy:
+        codecArguments = ["-c", "copy"]
+    else:
+        # Force keyframes on the boundaries so the segments are cut exactly
+        codecArguments = ["-force_key_frames", segmentTimes] if segmentTimes else []
+
+    print(f"Splitting into {len(timeStamps)} chunks")
+
+    with metrics.measureStage(
+        "split", video=inputVideo, method="copy" if streamCopy else "segment"
+    ) as measurement:
+        runFfmpeg(
+            [
+                "-i", str(inputVideo),
+                *codecArguments,
+                "-f", "segment",
+                "-segment_times", segmentTimes or str(duration),
+                "-reset_timestamps", "1",
+                str(outputDir / "part-%d.mp4"),
+            ],
+            check=True,
+        )
+
+        # Read back from disk, a keyframe can cover several boundaries
+        videoPaths = getSegmentPaths(outputDir)
+
+        measurement["parts"] = len(videoPaths)
+        if not streamCopy:
+            measurement["frames"] = getFrameCount(inputVideo, duration)
+
+    return videoPaths
+
+def splitVideoIntoChunksParallel(
+    inputVideo: Path,
+    outputDir: Path,
+    maxWorkers: int | None = None,
+    timeStamps: List[Timestamp] | None = None,
+    threadsPerWorker: int = 2,
+) -> List[Path]:
+    """
+    Split a video into 1-minute chunks, splitting several chunks at once
+    Each worker seeks on the input so it only decodes its own chunk
+
+    Args:
+        inputVideo (Path): The path to the input video
+        outputDir (Path): The path to the output directory
+        maxWorkers (int): The number of chunks to split at once,
+            defaults to what the cores and memory allow
+        timeStamps (List[Timestamp] | None): The chunks to use instead of 1-minute ones
+        threadsPerWorker (int): The encoder threads of each chunk, so the
+            workers together do not run more encoder threads than there are cores
+
+    Returns:
+        List[Path]: The paths to the output video chunks, in chunk order
+    """
+
+    if timeStamps is None:
+        timeStamps = getChunkTimestamps(getVideoDuration(inputVideo))
+
+    # A video without any duration has nothing to split
+    if not timeStamps:
+        return []
+
+    if maxWorkers is None:
+        maxWorkers = getWorkerCount(SPLIT_WORKER_MEMORY, threadsPerWorker)
+
+    videoPaths = [Path(outputDir / f"part-{i}.mp4") for i in range(len(timeStamps))]
+
+    with metrics.measureStage(
+        "split", video=inputVideo, method="parallel"
+    ) as measurement, ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+        # Run in the context of the stage, so it is given the cpu time of the splits
+        futures = [
+            executor.submit(
+                copy_context().run,
+                splitVideoChunk,
+                inputVideo,
+                videoPath,
+                timestamp.start,
+                timestamp.end,
+                threadsPerWorker,
+            )
+            for videoPath, timestamp in zip(videoPaths, timeStamps)
+        ]
+
+        for i, future in enumerate(futures):
+            future.result()
+            print(f"Split {i + 1} of {len(futures)}", end="\r")
+
+        measurement["parts"] = len(timeStamps)
+        measurement["frames"] = getFrameCount(
+            inputVideo, timeStamps[-1].end - timeStamps[0].start
+        )
+
+    return videoPaths
+
+
+def copyVideoRange(
+    inputVideo: Path, outputFileName: Path, start: float, end: float
+):
+    """
+    Copy a range of a video without re-encoding it
+    The range has to start on a keyframe
+    """
+
+    runFfmpeg(
         [
-            "ffmpeg",
-            "-hide_banner",
-            "-loglevel","error",
-            "-y",
+            "-ss", str(start),
             "-i", str(inputVideo),
+            "-t", str(end - start),
+            "-c", "copy",
+            "-avoid_negative_ts", "make_zero",
+            str(outputFileName),
+        ],
+        check=True,
+    )
+
+
+def getMatchingEncoderArguments(inputVideo: Path) -> List[str] | None:
+    """
+    Get the libx264 arguments that encode the same profile, level and pixel
+    format as a video, so re-encoded pieces can be joined to its copied GOPs
+
+    Returns:
+        List[str] | None: The encoder arguments, None if libx264 can not match it
+    """
+
+    mediaInfo = probeMedia(inputVideo)
+    profile = x264Profiles.get(mediaInfo.videoProfile)
+
+    if (
+        mediaInfo.videoCodec != "h264"
+        or profile is None
+        or mediaInfo.videoLevel is None
+        or mediaInfo.pixelFormat not in x264PixelFormats
+    ):
+        return None
+
+    return [
+        "-c:v", "libx264",
+        "-profile:v", profile,
+        "-level", f"{mediaInfo.videoLevel / 10:g}",
+        "-pix_fmt", mediaInfo.pixelFormat,
+    ]
+
+
+def encodeVideoPiece(
+    inputVideo: Path,
+    outputFileName: Path,
+    start: float,
+    end: float,
+    encoderArguments: List[str],
+):
+    """
+    Re-encode a range of a video into an MPEG-TS piece of a smart cut
+    """
+
+    runFfmpeg(
+        [
             "-ss", str(start),
-            "-to", str(end),
+            "-i", str(inputVideo),
+            "-t", str(end - start),
+            *encoderArguments,
+            "-c:a", "aac",
+            "-f", "mpegts",
             str(outputFileName),
-        ]
+        ],
+        check=True,
     )
 
-def splitVideoIntoChunks(inputVideo: Path, outputDir) -> List[Path]:
+
+def smartCutVideoChunk(
+    inputVideo: Path,
+    outputFileName: Path,
+    start: float,
+    end: float,
+    keyframeIndex: KeyframeIndex,
+    encoderArguments: List[str],
+):
     """
-    Split a video into 1-minute chunks and save them to the output directory
+    Cut a chunk exactly, re-encoding only the partial GOPs at its edges
+    The whole GOPs between the first and last keyframe of the chunk are copied
+
+    The pieces are MPEG-TS, which repeats the parameter sets before every
+    keyframe, so the encoded edges and the copied middle each keep their own
+    once they are joined into a single file
+    """
+
+    firstKeyframe = keyframeIndex.atOrAfter(start)
+    lastKeyframe = keyframeIndex.atOrBefore(end)
+
+    # Too short to contain a whole GOP, so there is nothing to copy
+    if firstKeyframe is None or lastKeyframe is None or firstKeyframe >= lastKeyframe:
+        splitVideoChunk(inputVideo, outputFileName, start, end)
+        return
+
+    pieceDirectory = outputFileName.with_name(f".{outputFileName.stem}-pieces")
+    createDirectory(pieceDirectory)
+
+    pieces = []
+
+    if firstKeyframe > start:
+        pieces.append(pieceDirectory / "head.ts")
+        encodeVideoPiece(inputVideo, pieces[-1], start, firstKeyframe, encoderArguments)
+
+    pieces.append(pieceDirectory / "middle.ts")
+    runFfmpeg(
+        [
+            "-ss", str(firstKeyframe),
+            "-i", str(inputVideo),
+            "-t", str(lastKeyframe - firstKeyframe),
+            "-c", "copy",
+            "-bsf:v", "h264_mp4toannexb",
+            "-avoid_negative_ts", "make_zero",
+            "-f", "mpegts",
+            str(pieces[-1]),
+        ],
+        check=True,
+    )
+
+    if end > lastKeyframe:
+        pieces.append(pieceDirectory / "tail.ts")
+        encodeVideoPiece(inputVideo, pieces[-1], lastKeyframe, end, encoderArguments)
+
+    concatListPath = pieceDirectory / "pieces.txt"
+    concatListPath.write_text(
+        "".join(f"file '{piece.resolve()}'\n" for piece in pieces)
+    )
+
+    runFfmpeg(
+        [
+            "-f", "concat",
+            "-safe", "0",
+            "-i", str(concatListPath),
+            "-c", "copy",
+            "-bsf:a", "aac_adtstoasc",
+            str(outputFileName),
+        ],
+        check=True,
+    )
+
+    shutil.rmtree(pieceDirectory)
+
+
+def splitVideoIntoChunksSmart(
+    inputVideo: Path,
+    outputDir: Path,
+    tolerance: float = 1,
+    exact: bool = False,
+    timeStamps: List[Timestamp] | None = None,
+) -> List[Path]:
+    """
+    Split a video into 1-minute chunks, copying instead of re-encoding where it can
+    Boundaries within the tolerance of a keyframe are moved onto it and those
+    chunks are copied whole, the others only re-encode their partial GOPs
 
     Args:
         inputVideo (Path): The path to the input video
         outputDir (Path): The path to the output directory
+        tolerance (float): How far a boundary can move to a keyframe, in seconds
+        exact (bool): Never move boundaries, always cut on the exact second
+        timeStamps (List[Timestamp] | None): The chunks to use instead of 1-minute ones
 
     Returns:
         List[Path]: The paths to the output video chunks
     """
 
-    timeStamps: List[Tuple[Timestamp]] = []
+    # The edges are encoded to match the copied GOPs, everything is
+    # re-encoded when libx264 can not make the same kind of stream
+    encoderArguments = getMatchingEncoderArguments(inputVideo)
+    if encoderArguments is None:
+        return splitVideoIntoChunks(inputVideo, outputDir, timeStamps=timeStamps)
 
-    # Get the duration of the video
-    duration = getVideoDuration(inputVideo)
+    keyframeIndex = KeyframeIndex.fromMedia(inputVideo)
+    if timeStamps is None:
+        timeStamps = getChunkTimestamps(getVideoDuration(inputVideo))
 
-    # Calculate the number of chunks
-    numChunks = math.ceil(duration / 60)
+    if not timeStamps:
+        return []
 
-    # Split the video into chunks
-    for i in range(numChunks):
-        startTime = i * 60
-        endTime = min((i + 1) * 60, duration)
-        timeStamps.append((Timestamp(startTime, endTime)))
-
-    # Combine the last part with the preceding one if less than a minute
-    if len(timeStamps) > 1 and timeStamps[-1].end - timeStamps[-1].start < 60:
-        lastChunk = timeStamps.pop()
-        lastChunkIndex = len(timeStamps) - 1
-        timeStamps[lastChunkIndex] = Timestamp(
-            timeStamps[lastChunkIndex].start, lastChunk.end
-        )
+    # Snap each shared boundary once so the chunks stay back to back
+    boundaries = [timeStamps[0].start] + [timestamp.end for timestamp in timeStamps]
+
+    if not exact:
+        for i, boundary in enumerate(boundaries[1:-1], start=1):
+            keyframe = keyframeIndex.snap(boundary, tolerance)
+            if keyframe is not None:
+                boundaries[i] = keyframe
 
     videoPaths = []
 
-    for i, timestamp in enumerate(timeStamps):
-        outputFileName = outputDir / f"part-{i}.mp4"
-        videoPaths.append(Path(outputFileName))
+    with metrics.measureStage("split", video=inputVideo, method="smart") as measurement:
+        for i, (start, end) in enumerate(zip(boundaries, boundaries[1:])):
+            outputFileName = Path(outputDir / f"part-{i}.mp4")
+            videoPaths.append(outputFileName)
 
-        subprocess.run([
-            "ffmpeg",
-            "-hide_banner",
-            "-loglevel", "error",
-            "-y",
-            "-i", str(inputVideo),
-            "-ss", str(timestamp.start),
-            "-to", str(timestamp.end),
-            str(outputFileName)
-        ])
+            startsOnKeyframe = keyframeIndex.atOrAfter(start) == start
+            endsOnKeyframe = (
+                end == boundaries[-1] or keyframeIndex.atOrAfter(end) == end
+            )
 
-        print(f"Split {i} of {numChunks}", end="\r")
-    
-    return videoPaths
+            if startsOnKeyframe and endsOnKeyframe:
+                copyVideoRange(inputVideo, outputFileName, start, end)
+            else:
+                smartCutVideoChunk(
+                    inputVideo,
+                    outputFileName,
+                    start,
+                    end,
+                    keyframeIndex,
+                    encoderArguments,
+                )
+
+            print(f"Split {i + 1} of {len(timeStamps)}", end="\r")
 
-# from concurrent.futures import ThreadPoolExecutor
-
-# def splitVideoChunkThreaded(inputVideo: Path, outputFileName: Path, start: int, end: int):
-#     subprocess.run([
-#         "ffmpeg",
-#         "-hide_banner",
-#         "-loglevel", "error",
-#         "-y",
-#         "-i", str(inputVideo),
-#         "-ss", str(start),
-#         "-to", str(end),
-#         str(outputFileName)
-#     ])
-
-# def splitVideoIntoChunks(inputVideo: Path, outputDir: Path) -> List[Path]:
-#     """
-#     Split a video into 1-minute chunks and save them to the output directory using threading
-
-#     Args:
-#         inputVideo (Path): The path to the input video
-#         outputDir (Path): The path to the output directory
-
-#     Returns:
-#         List[Path]: The paths to the output video chunks
-#     """
-
-#     # Get the duration of the video
-#     duration = getVideoDuration(inputVideo)
-
-#     # Calculate the number of chunks
-#     numChunks = math.ceil(duration / 60)
-
-#     # Create a ThreadPoolExecutor
-#     with ThreadPoolExecutor(max_workers=5) as executor:
-#         futures = []
-        
-#         # Split the video into chunks
-#         for i in range(numChunks):
-#             startTime = i * 60
-#             endTime = min((i + 1) * 60, duration)
-
-#             outputFileName = outputDir / f"part-{i}.mp4"
-
-#             # Submit the task to the executor
-#             future = executor.submit(
-#                 splitVideoChunkThreaded, inputVideo, outputFileName, startTime, endTime
-#             )
-#             futures.append(future)
-
-#         # Wait for all tasks to complete
-#         for future in futures:
-#             future.result()
-
-#     # Return the paths to the output video chunks
-#     return [outputDir / f"part-{i}.mp4" for i in range(numChunks)]
+        measurement["parts"] = len(videoPaths)
+
+    return videoPaths
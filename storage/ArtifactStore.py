@@ -0,0 +1,156 @@
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+import hashlib
+import json
+import os
+import re
+import shutil
+
+from functions.Filesystem import createDirectory
+
+# Characters that are not allowed in, or change the meaning of, a path
+unsafeCharacters = re.compile(r'[\\/:*?"<>|\x00-\x1f]')
+
+
+def getSafeName(name: str, maxLength: int = 100) -> str:
+    """
+    Turn a title into something that can be used as a file name
+    """
+
+    safeName = unsafeCharacters.sub("_", name).strip(" .")
+    return safeName[:maxLength] or "_"
+
+
+class ArtifactStore:
+    """
+    A class to keep everything made from a video under its video id
+    Each artifact is keyed by its kind and the parameters it was made with,
+    so the same work is never repeated, whatever the video is called
+
+    Path -> data/artifacts/{videoId}/{kind}-{parameters hash}/
+
+    Kinds:
+        "download" holds main.mp4 and its probe, "plan" the chunk boundaries,
+        "split" the chunk files and "render" the rendered parts
+
+    Attributes:
+        root (Path): The directory every artifact is saved under
+    """
+
+    def __init__(self, root: Path = Path("data/artifacts")):
+        self.root = root
+
+    @staticmethod
+    def getKey(kind: str, parameters: dict | None = None) -> str:
+        if not parameters:
+            return kind
+
+        serializedParameters = json.dumps(parameters, sort_keys=True, default=str)
+        parametersHash = hashlib.sha256(serializedParameters.encode("utf-8"))
+
+        return f"{kind}-{parametersHash.hexdigest()[:12]}"
+
+    def getVideoDirectory(self, videoId: str) -> Path:
+        return self.root.joinpath(videoId)
+
+    def getDirectory(
+        self, videoId: str, kind: str, parameters: dict | None = None
+    ) -> Path:
+        return self.getVideoDirectory(videoId).joinpath(self.getKey(kind, parameters))
+
+    def createArtifact(
+        self, videoId: str, kind: str, parameters: dict | None = None
+    ) -> Path:
+        """
+        Create the directory of an artifact that is written file by file
+        Every file written to it must be written atomically
+        """
+
+        directory = self.getDirectory(videoId, kind, parameters)
+        createDirectory(directory)
+        self.saveParameters(directory, parameters)
+
+        return directory
+
+    def getPath(
+        self, videoId: str, kind: str, parameters: dict | None, name: str
+    ) -> Path:
+        """
+        Get the path of a file of an artifact, creating its directory
+        """
+
+        return self.createArtifact(videoId, kind, parameters).joinpath(name)
+
+    @contextmanager
+    def writeDirectory(
+        self, videoId: str, kind: str, parameters: dict | None = None
+    ) -> Iterator[Path]:
+        """
+        Build an artifact of many files in a temporary directory
+        It is only moved into place once it is complete, so an artifact
+        directory that exists is always a finished one
+
+        Yields:
+            Path: The temporary directory to write the files to
+        """
+
+        directory = self.getDirectory(videoId, kind, parameters)
+        temporaryDirectory = directory.with_name(f"{directory.name}.{os.getpid()}.tmp")
+
+        shutil.rmtree(temporaryDirectory, ignore_errors=True)
+        createDirectory(temporaryDirectory)
+
+        try:
+            yield temporaryDirectory
+            self.saveParameters(temporaryDirectory, parameters)
+
+            if directory.is_dir():
+                # Another run finished the same artifact first
+                shutil.rmtree(temporaryDirectory)
+            else:
+                os.replace(temporaryDirectory, directory)
+        except BaseException:
+            shutil.rmtree(temporaryDirectory, ignore_errors=True)
+            raise
+
+    @classmethod
+    def saveParameters(cls, directory: Path, parameters: dict | None):
+        # Saved so a person can tell what made an artifact
+        parametersPath = directory.joinpath("parameters.json")
+        if parameters and not parametersPath.is_file():
+            cls.writeJson(parametersPath, parameters)
+
+    @staticmethod
+    def writeJson(path: Path, data):
+        temporaryPath = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+
+        with open(temporaryPath, "w") as jsonFile:
+            json.dump(data, jsonFile, indent=4, default=str)
+        os.replace(temporaryPath, path)
+
+    @staticmethod
+    def readJson(path: Path):
+        with open(path, "r") as jsonFile:
+            return json.load(jsonFile)
+
+    @staticmethod
+    def link(target: Path, linkPath: Path):
+        """
+        Point a human readable path at an artifact
+        Links are only for browsing, nothing reads through them
+        """
+
+        createDirectory(linkPath.parent)
+        temporaryPath = linkPath.with_name(f"{linkPath.name}.{os.getpid()}.tmp")
+
+        try:
+            temporaryPath.unlink(missing_ok=True)
+            temporaryPath.symlink_to(os.path.relpath(target, linkPath.parent))
+            os.replace(temporaryPath, linkPath)
+        except OSError as error:
+            # Symlinks need extra permissions on windows
+            print(f"Could not link {linkPath} to {target}: {error}")
+
+
+artifactStore = ArtifactStore()
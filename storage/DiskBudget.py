@@ -0,0 +1,256 @@
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Set
+import os
+import shutil
+import threading
+import time
+
+
+@dataclass
+class DiskEntry:
+    """
+    An intermediate file or directory that can be deleted and made again
+
+    Attributes:
+        path (Path): The file or directory
+        size (int): The size of everything in it in bytes
+        lastUsed (float): When it was last used, as its modified time
+    """
+
+    path: Path
+    size: int
+    lastUsed: float
+
+
+def getSize(path: Path) -> int:
+    if path.is_file():
+        return path.stat().st_size
+
+    return sum(file.stat().st_size for file in path.rglob("*") if file.is_file())
+
+
+class DiskBudget:
+    """
+    A class to keep the intermediate media of the artifact store within a
+    number of bytes. Raw downloads, split chunks and gameplay clips are deleted
+    least recently used first, unless they are pinned by a job that still
+    needs them. Plans and rendered parts are never deleted, so they are not
+    counted against the budget either
+
+    What queued and unfinished jobs need is read from the databases they are
+    recorded in by the pin sources, so a budget pass in any process keeps it.
+    Pins only hold for the process that made them, for work it has in hand
+
+    Attributes:
+        root (Path): The artifact store directory the budget covers
+        budget (int | None): The most bytes the intermediates may use,
+            None for no limit
+        highWatermark (float): The share of the budget downloads are held back at
+        pollInterval (float): The wait between checks while the budget is full
+        pins (Dict[Path, int]): The paths pinned by this process, with the number
+            of jobs pinning them
+        pinSources (List[Callable]): Return the paths the recorded jobs still need
+    """
+
+    def __init__(
+        self,
+        root: Path = Path("data/artifacts"),
+        budget: int | None = None,
+        highWatermark: float = 0.9,
+        pollInterval: float = 10,
+    ):
+        self.root = root
+        self.budget = budget
+        self.highWatermark = highWatermark
+        self.pollInterval = pollInterval
+
+        self.pins: Dict[Path, int] = {}
+        self.pinSources: List[Callable[[], Iterable[Path]]] = []
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def getPinKey(path: Path) -> Path:
+        return Path(os.path.abspath(path))
+
+    def pin(self, path: Path):
+        """
+        Keep a file, or everything in a directory, from being evicted
+        """
+
+        key = self.getPinKey(path)
+        with self.lock:
+            self.pins[key] = self.pins.get(key, 0) + 1
+
+    def unpin(self, path: Path):
+        key = self.getPinKey(path)
+        with self.lock:
+            if self.pins.get(key, 0) <= 1:
+                self.pins.pop(key, None)
+            else:
+                self.pins[key] -= 1
+
+    @contextmanager
+    def pinned(self, path: Path) -> Iterator[Path]:
+        self.pin(path)
+        try:
+            yield path
+        finally:
+            self.unpin(path)
+
+    def addPinSource(self, pinSource: Callable[[], Iterable[Path]]):
+        """
+        Keep every path a function returns from being evicted, asked on every pass
+        """
+
+        with self.lock:
+            self.pinSources.append(pinSource)
+
+    def getPins(self) -> Set[Path]:
+        with self.lock:
+            pins = set(self.pins)
+            pinSources = list(self.pinSources)
+
+        for pinSource in pinSources:
+            pins.update(self.getPinKey(path) for path in pinSource())
+
+        return pins
+
+    def isPinned(self, path: Path, pins: Set[Path] | None = None) -> bool:
+        """
+        Whether a path is pinned, or is inside or holds a pinned path
+        """
+
+        key = self.getPinKey(path)
+        if pins is None:
+            pins = self.getPins()
+
+        return any(
+            pin == key or pin in key.parents or key in pin.parents for pin in pins
+        )
+
+    @staticmethod
+    def markUsed(path: Path):
+        """
+        Record that an intermediate was used, moving it to the back of the eviction order
+        """
+
+        try:
+            os.utime(path)
+        except OSError:
+            # It was evicted in the meantime
+            pass
+
+    def getEntries(self) -> List[DiskEntry]:
+        """
+        Find every intermediate that can be evicted, in progress writes are left out
+        """
+
+        entries: List[DiskEntry] = []
+        if not self.root.is_dir():
+            return entries
+
+        def addEntry(path: Path):
+            try:
+                entries.append(DiskEntry(path, getSize(path), path.stat().st_mtime))
+            except OSError:
+                # Deleted while scanning
+                pass
+
+        for videoDirectory in self.root.iterdir():
+            if not videoDirectory.is_dir():
+                continue
+
+            for artifactDirectory in videoDirectory.iterdir():
+                if artifactDirectory.name.endswith(".tmp"):
+                    continue
+
+                if artifactDirectory.name.startswith("download"):
+                    videoPath = artifactDirectory.joinpath("main.mp4")
+                    if videoPath.is_file():
+                        addEntry(videoPath)
+
+                    for clipPath in artifactDirectory.glob("clips/*.mp4"):
+                        if not clipPath.name.endswith(".tmp.mp4"):
+                            addEntry(clipPath)
+                elif artifactDirectory.name.startswith("split"):
+                    addEntry(artifactDirectory)
+
+        return entries
+
+    def getUsage(self) -> int:
+        """
+        The bytes used by the intermediates that can be evicted
+        """
+
+        return sum(entry.size for entry in self.getEntries())
+
+    def evict(self, targetUsage: int) -> int:
+        """
+        Delete the least recently used intermediates until they fit
+
+        Args:
+            targetUsage (int): The bytes the intermediates should use at most
+
+        Returns:
+            int: The bytes the intermediates use afterwards
+        """
+
+        entries = self.getEntries()
+        usage = sum(entry.size for entry in entries)
+        if usage <= targetUsage:
+            return usage
+
+        pins = self.getPins()
+
+        for entry in sorted(entries, key=lambda entry: entry.lastUsed):
+            if usage <= targetUsage:
+                break
+
+            if self.isPinned(entry.path, pins):
+                continue
+
+            if entry.path.is_dir():
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                entry.path.unlink(missing_ok=True)
+                # The cached probe of a deleted video is of no use
+                entry.path.with_name(entry.path.name + ".probe.json").unlink(
+                    missing_ok=True
+                )
+
+            usage -= entry.size
+            print(f"Evicted {entry.path} ({entry.size / 1024 / 1024:.0f} MiB)")
+
+        return usage
+
+    def waitForSpace(self, timeout: float | None = None) -> bool:
+        """
+        Wait until the intermediates are below the high watermark, evicting what it can
+        Everything left may be pinned by jobs that are still running,
+        so this waits for them to finish and unpin it
+
+        Args:
+            timeout (float | None): Give up waiting after this many seconds
+
+        Returns:
+            bool: Whether the intermediates are below the high watermark
+        """
+
+        if self.budget is None:
+            return True
+
+        targetUsage = int(self.budget * self.highWatermark)
+        startTime = time.monotonic()
+
+        while self.evict(targetUsage) > targetUsage:
+            if timeout is not None and time.monotonic() - startTime >= timeout:
+                return False
+
+            time.sleep(self.pollInterval)
+
+        return True
+
+
+diskBudget = DiskBudget()
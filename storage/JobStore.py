@@ -0,0 +1,334 @@
+from pathlib import Path
+from typing import List, Set
+import sqlite3
+import threading
+import time
+
+from functions.Filesystem import createDirectory
+
+
+class JobStore:
+    """
+    A class to record how far every video and part has been processed
+    Lets a rerun skip exactly the work that has already finished
+
+    Stages:
+        Videos go through "downloaded" then "split", parts end up "rendered",
+        either can be "failed"
+
+    Parts are recorded with the key of the render artifact they were rendered
+    into, so parts rendered with other settings are not counted as done.
+    The number of parts is planned for every render key, as other split
+    settings can cut the video into another number of parts
+
+    Attributes:
+        databasePath (Path): The path to the SQLite database
+    """
+
+    stages = ("downloaded", "split", "rendered", "failed")
+
+    def __init__(self, databasePath: Path = Path("data/jobs.sqlite3")):
+        self.databasePath = databasePath
+        createDirectory(databasePath.parent)
+
+        # Render results are recorded from the scheduler's callback thread
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(databasePath, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+
+        with self.connection:
+            self.connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS videos (
+                    videoId TEXT PRIMARY KEY,
+                    title TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    totalParts INTEGER,
+                    updatedAt REAL NOT NULL,
+                    error TEXT
+                );
+                CREATE TABLE IF NOT EXISTS videoStages (
+                    videoId TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    finishedAt REAL NOT NULL,
+                    duration REAL,
+                    PRIMARY KEY (videoId, stage)
+                );
+                CREATE TABLE IF NOT EXISTS parts (
+                    videoId TEXT NOT NULL,
+                    part INTEGER NOT NULL,
+                    stage TEXT NOT NULL,
+                    finishedAt REAL NOT NULL,
+                    duration REAL,
+                    outputPath TEXT,
+                    checksum TEXT,
+                    error TEXT,
+                    renderKey TEXT,
+                    PRIMARY KEY (videoId, part)
+                );
+                """
+            )
+
+            partColumns = {
+                row[1] for row in self.connection.execute("PRAGMA table_info(parts)")
+            }
+            if "renderKey" not in partColumns:
+                self.addRenderKeys()
+
+            hasPlans = self.connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'plans'"
+            ).fetchone()
+            if hasPlans is None:
+                self.addPlans()
+
+    def addRenderKeys(self):
+        """
+        Add the render key to a database made before parts were recorded with it,
+        reading it from the render artifact in the output path of every part
+        """
+
+        self.connection.execute("ALTER TABLE parts ADD COLUMN renderKey TEXT")
+
+        rows = self.connection.execute(
+            "SELECT videoId, part, outputPath FROM parts WHERE outputPath IS NOT NULL"
+        ).fetchall()
+
+        # {renderKey}/part-{n}/output.mp4
+        self.connection.executemany(
+            "UPDATE parts SET renderKey = ? WHERE videoId = ? AND part = ?",
+            [
+                (Path(outputPath).parent.parent.name, videoId, part)
+                for videoId, part, outputPath in rows
+            ],
+        )
+
+    def addPlans(self):
+        """
+        Add the part counts of every render key to a database made before they
+        were planned per render key, taking the total of the video for the render
+        keys its parts were rendered into
+        """
+
+        self.connection.execute(
+            """
+            CREATE TABLE plans (
+                videoId TEXT NOT NULL,
+                renderKey TEXT NOT NULL,
+                totalParts INTEGER NOT NULL,
+                plannedAt REAL NOT NULL,
+                PRIMARY KEY (videoId, renderKey)
+            )
+            """
+        )
+
+        self.connection.execute(
+            """
+            INSERT INTO plans (videoId, renderKey, totalParts, plannedAt)
+            SELECT parts.videoId, parts.renderKey, videos.totalParts,
+                MAX(parts.finishedAt)
+            FROM parts
+            JOIN videos ON videos.videoId = parts.videoId
+            WHERE parts.renderKey IS NOT NULL AND videos.totalParts IS NOT NULL
+            GROUP BY parts.videoId, parts.renderKey
+            """
+        )
+
+    def markVideo(
+        self,
+        videoId: str,
+        title: str,
+        stage: str,
+        duration: float | None = None,
+        totalParts: int | None = None,
+        error: str | None = None,
+    ):
+        """
+        Record that a video has finished a stage
+
+        Args:
+            videoId (str): The id of the video
+            title (str): The title of the video
+            stage (str): The stage the video finished
+            duration (float | None): How long the stage took in seconds
+            totalParts (int | None): The number of parts, known once split
+            error (str | None): Why the video failed
+        """
+
+        assert stage in self.stages, f"Unknown stage {stage}"
+        finishedAt = time.time()
+
+        with self.lock, self.connection:
+            self.connection.execute(
+                """
+                INSERT INTO videos (videoId, title, stage, totalParts, updatedAt, error)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (videoId) DO UPDATE SET
+                    title = excluded.title,
+                    stage = excluded.stage,
+                    totalParts = COALESCE(excluded.totalParts, videos.totalParts),
+                    updatedAt = excluded.updatedAt,
+                    error = excluded.error
+                """,
+                (videoId, title, stage, totalParts, finishedAt, error),
+            )
+            self.connection.execute(
+                "INSERT OR REPLACE INTO videoStages VALUES (?, ?, ?, ?)",
+                (videoId, stage, finishedAt, duration),
+            )
+
+    def markPart(
+        self,
+        videoId: str,
+        part: int,
+        stage: str,
+        duration: float | None = None,
+        outputPath: Path | None = None,
+        checksum: str | None = None,
+        error: str | None = None,
+        renderKey: str | None = None,
+    ):
+        """
+        Record that a part has been rendered or has failed
+        A part rendered with other settings replaces the earlier one
+        """
+
+        assert stage in self.stages, f"Unknown stage {stage}"
+
+        with self.lock, self.connection:
+            self.connection.execute(
+                """
+                INSERT OR REPLACE INTO parts (
+                    videoId, part, stage, finishedAt, duration,
+                    outputPath, checksum, error, renderKey
+                )
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    videoId,
+                    part,
+                    stage,
+                    time.time(),
+                    duration,
+                    str(outputPath) if outputPath else None,
+                    checksum,
+                    error,
+                    renderKey,
+                ),
+            )
+
+    def markPlan(self, videoId: str, renderKey: str, totalParts: int):
+        """
+        Record the number of parts a video is rendered as into a render artifact
+        The plan recorded last is the one the video is being rendered with
+
+        Args:
+            videoId (str): The id of the video
+            renderKey (str): The key of the render artifact
+            totalParts (int): The number of parts in the split plan
+        """
+
+        plannedAt = time.time()
+
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO plans VALUES (?, ?, ?, ?)",
+                (videoId, renderKey, totalParts, plannedAt),
+            )
+            self.connection.execute(
+                "UPDATE videos SET totalParts = ? WHERE videoId = ?",
+                (totalParts, videoId),
+            )
+
+    def getVideoStage(self, videoId: str) -> str | None:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT stage FROM videos WHERE videoId = ?", (videoId,)
+            ).fetchone()
+
+        return row[0] if row else None
+
+    def getRenderedParts(self, videoId: str, renderKey: str | None = None) -> Set[int]:
+        """
+        Get the parts of a video that have been rendered
+
+        Args:
+            videoId (str): The id of the video
+            renderKey (str | None): Only count parts rendered into this render
+                artifact, None to count every part
+        """
+
+        with self.lock:
+            rows = self.connection.execute(
+                """
+                SELECT part FROM parts
+                WHERE videoId = ? AND stage = 'rendered'
+                    AND (? IS NULL OR renderKey = ?)
+                """,
+                (videoId, renderKey, renderKey),
+            ).fetchall()
+
+        return {row[0] for row in rows}
+
+    def isVideoComplete(self, videoId: str, renderKey: str | None = None) -> bool:
+        """
+        Whether every part of the video has been rendered, into the render
+        artifact of the render key if one is given, against the parts planned for it
+        """
+
+        with self.lock:
+            if renderKey is None:
+                row = self.connection.execute(
+                    """
+                    SELECT videos.totalParts, COUNT(parts.part)
+                    FROM videos
+                    LEFT JOIN parts
+                        ON parts.videoId = videos.videoId AND parts.stage = 'rendered'
+                    WHERE videos.videoId = ?
+                    GROUP BY videos.videoId
+                    """,
+                    (videoId,),
+                ).fetchone()
+            else:
+                row = self.connection.execute(
+                    """
+                    SELECT plans.totalParts, COUNT(parts.part)
+                    FROM plans
+                    LEFT JOIN parts
+                        ON parts.videoId = plans.videoId AND parts.stage = 'rendered'
+                        AND parts.renderKey = plans.renderKey
+                    WHERE plans.videoId = ? AND plans.renderKey = ?
+                    GROUP BY plans.videoId
+                    """,
+                    (videoId, renderKey),
+                ).fetchone()
+
+        return row is not None and row[0] is not None and row[1] >= row[0]
+
+    def getUnfinishedVideos(self) -> List[str]:
+        """
+        Get the videos that are downloaded or split but do not have every part of
+        their latest plan rendered yet, their downloads and chunks are still needed
+        """
+
+        with self.lock:
+            rows = self.connection.execute(
+                """
+                SELECT videos.videoId
+                FROM videos
+                LEFT JOIN plans
+                    ON plans.videoId = videos.videoId
+                    AND plans.plannedAt = (
+                        SELECT MAX(latest.plannedAt) FROM plans AS latest
+                        WHERE latest.videoId = videos.videoId
+                    )
+                LEFT JOIN parts
+                    ON parts.videoId = videos.videoId AND parts.stage = 'rendered'
+                    AND parts.renderKey = plans.renderKey
+                WHERE videos.stage IN ('downloaded', 'split')
+                GROUP BY videos.videoId
+                HAVING plans.totalParts IS NULL
+                    OR COUNT(parts.part) < plans.totalParts
+                """
+            ).fetchall()
+
+        return [row[0] for row in rows]
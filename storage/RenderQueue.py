@@ -0,0 +1,458 @@
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+import json
+import sqlite3
+import threading
+import time
+
+from functions.Filesystem import createDirectory
+from gameplay.GameplayPool import GameplayClip
+from processing.RenderScheduler import RenderJob, RenderResult
+from processing.SplitVideo import Timestamp
+
+RENDER_JOBS_TABLE = """
+CREATE TABLE IF NOT EXISTS renderJobs (
+    videoId TEXT NOT NULL,
+    renderKey TEXT NOT NULL,
+    part INTEGER NOT NULL,
+    job TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    leaseOwner TEXT,
+    leaseToken INTEGER NOT NULL DEFAULT 0,
+    leaseExpiresAt REAL,
+    publishedAt REAL NOT NULL,
+    updatedAt REAL NOT NULL,
+    outputPath TEXT,
+    error TEXT,
+    duration REAL,
+    checksum TEXT,
+    PRIMARY KEY (videoId, renderKey, part)
+)
+"""
+
+
+def serializeJob(job: RenderJob) -> str:
+    return json.dumps(asdict(job), default=str)
+
+
+def getJobKey(job: RenderJob) -> Tuple[str, str, int]:
+    """
+    Get the row of a job, parts rendered with other settings go into
+    another render artifact so they are queued separately
+    """
+
+    return (job.videoId, job.renderKey, job.currentPart)
+
+
+def deserializeJob(text: str) -> RenderJob:
+    data = json.loads(text)
+
+    gameplayClip = data["gameplayClip"]
+    if gameplayClip is not None:
+        gameplayClip = GameplayClip(
+            Path(gameplayClip["sourcePath"]),
+            gameplayClip["start"],
+            gameplayClip["duration"],
+        )
+
+    videoClipRange = data["videoClipRange"]
+    if videoClipRange is not None:
+        videoClipRange = Timestamp(**videoClipRange)
+
+    return RenderJob(
+        **{
+            **data,
+            "videoOutputDirectory": Path(data["videoOutputDirectory"]),
+            "videoClipPath": Path(data["videoClipPath"]),
+            "gameplayClip": gameplayClip,
+            "videoClipRange": videoClipRange,
+        }
+    )
+
+
+@dataclass
+class RenderLease:
+    """
+    A claim on a render job, valid until it expires or the job is claimed again
+
+    Attributes:
+        job (RenderJob): The part to render
+        workerId (str): The worker holding the lease
+        token (int): Increases with every claim of the job, so a worker whose
+            lease expired can not finish a job another worker has claimed since
+    """
+
+    job: RenderJob
+    workerId: str
+    token: int
+
+
+class RenderQueue:
+    """
+    A class to hand out render jobs to workers on any machine
+    Workers claim a job for a lease, renew it while rendering, and a job whose
+    lease expires is handed to the next worker, up to maxAttempts times
+
+    The database can live on a filesystem shared by several machines, so it
+    uses the rollback journal instead of WAL, which only works on one machine.
+    It is the only database workers write to, the pipeline copies the results
+    into its JobStore with getResults
+
+    Lease expiry is stored as time.time() of the worker that claimed or renewed
+    it, and compared against the clock of the worker claiming next. The clocks
+    of every machine have to agree to well within a third of the lease, the
+    heartbeat interval, or workers with a clock running ahead take over leases
+    that are still being renewed and parts are rendered twice, though only
+    ever published once
+
+    States:
+        Jobs are "pending" until claimed, "leased" while rendering,
+        then "rendered", or "failed" once out of attempts
+
+    Attributes:
+        databasePath (Path): The path to the SQLite database
+        maxAttempts (int): The claims of a job before it fails
+    """
+
+    states = ("pending", "leased", "rendered", "failed")
+
+    def __init__(
+        self,
+        databasePath: Path = Path("data/renderQueue.sqlite3"),
+        maxAttempts: int = 3,
+    ):
+        self.databasePath = databasePath
+        self.maxAttempts = maxAttempts
+        createDirectory(databasePath.parent)
+
+        self.lock = threading.Lock()
+        # Transactions are started by hand so claims can take the write lock up front
+        self.connection = sqlite3.connect(
+            databasePath, timeout=60, isolation_level=None, check_same_thread=False
+        )
+
+        with self.lock:
+            self.connection.execute(RENDER_JOBS_TABLE)
+
+            # Queues made before the render results were kept in them
+            columns = self.getColumns(self.connection)
+            for column, columnType in (("duration", "REAL"), ("checksum", "TEXT")):
+                if column not in columns:
+                    self.connection.execute(
+                        f"ALTER TABLE renderJobs ADD COLUMN {column} {columnType}"
+                    )
+
+        if "renderKey" not in columns:
+            self.transaction(self.addRenderKeys)
+
+    @staticmethod
+    def getColumns(connection: sqlite3.Connection) -> List[str]:
+        return [row[1] for row in connection.execute("PRAGMA table_info(renderJobs)")]
+
+    def addRenderKeys(self, connection: sqlite3.Connection):
+        """
+        Rebuild a queue made before jobs were keyed by their render artifact,
+        reading the key from the output directory of every job
+        """
+
+        # Another worker may have rebuilt it in the meantime
+        if "renderKey" in self.getColumns(connection):
+            return
+
+        connection.execute("ALTER TABLE renderJobs ADD COLUMN renderKey TEXT")
+        rows = connection.execute("SELECT rowid, job FROM renderJobs").fetchall()
+        connection.executemany(
+            "UPDATE renderJobs SET renderKey = ? WHERE rowid = ?",
+            [(deserializeJob(job).renderKey, rowid) for rowid, job in rows],
+        )
+
+        # The primary key can only be changed by making the table again
+        columns = ", ".join(self.getColumns(connection))
+        connection.execute("ALTER TABLE renderJobs RENAME TO renderJobsWithoutKeys")
+        connection.execute(RENDER_JOBS_TABLE)
+        connection.execute(
+            f"""
+            INSERT INTO renderJobs ({columns})
+            SELECT {columns} FROM renderJobsWithoutKeys
+            """
+        )
+        connection.execute("DROP TABLE renderJobsWithoutKeys")
+
+    def transaction(self, function: Callable):
+        """
+        Run a function inside a write transaction, holding the database lock
+        from the start so no other worker can claim the same job in between
+        """
+
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                result = function(self.connection)
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+
+            self.connection.execute("COMMIT")
+            return result
+
+    def publish(self, job: RenderJob):
+        """
+        Queue a part for rendering
+        A part that is already queued or rendered is left alone, a failed one is retried
+        Parts are queued per render artifact, one rendered with other settings
+        is queued again
+        """
+
+        now = time.time()
+
+        self.transaction(
+            lambda connection: connection.execute(
+                """
+                INSERT INTO renderJobs
+                    (videoId, renderKey, part, job, state, publishedAt, updatedAt)
+                VALUES (?, ?, ?, ?, 'pending', ?, ?)
+                ON CONFLICT (videoId, renderKey, part) DO UPDATE SET
+                    job = excluded.job,
+                    state = 'pending',
+                    attempts = 0,
+                    updatedAt = excluded.updatedAt,
+                    error = NULL
+                WHERE renderJobs.state = 'failed'
+                """,
+                (*getJobKey(job), serializeJob(job), now, now),
+            )
+        )
+
+    def claim(self, workerId: str, leaseDuration: float) -> RenderLease | None:
+        """
+        Claim the oldest job that is pending or whose lease has expired
+
+        Args:
+            workerId (str): The worker claiming the job
+            leaseDuration (float): How long the lease lasts without a heartbeat
+
+        Returns:
+            RenderLease | None: The lease on the job, None if there is nothing to render
+        """
+
+        def claimJob(connection: sqlite3.Connection) -> RenderLease | None:
+            now = time.time()
+
+            # Jobs that keep losing their worker are given up on
+            connection.execute(
+                """
+                UPDATE renderJobs
+                SET state = 'failed', updatedAt = ?, error = 'Every lease expired'
+                WHERE state = 'leased' AND leaseExpiresAt < ? AND attempts >= ?
+                """,
+                (now, now, self.maxAttempts),
+            )
+
+            row = connection.execute(
+                """
+                SELECT rowid, job, leaseToken FROM renderJobs
+                WHERE state = 'pending' OR (state = 'leased' AND leaseExpiresAt < ?)
+                ORDER BY publishedAt, part
+                LIMIT 1
+                """,
+                (now,),
+            ).fetchone()
+
+            if row is None:
+                return None
+
+            rowid, job, leaseToken = row
+            connection.execute(
+                """
+                UPDATE renderJobs
+                SET state = 'leased', attempts = attempts + 1, leaseOwner = ?,
+                    leaseToken = ?, leaseExpiresAt = ?, updatedAt = ?
+                WHERE rowid = ?
+                """,
+                (workerId, leaseToken + 1, now + leaseDuration, now, rowid),
+            )
+
+            return RenderLease(deserializeJob(job), workerId, leaseToken + 1)
+
+        return self.transaction(claimJob)
+
+    def heartbeat(self, lease: RenderLease, leaseDuration: float) -> bool:
+        """
+        Extend a lease
+
+        Returns:
+            bool: Whether the lease is still held, False once another worker has
+                claimed the job
+        """
+
+        now = time.time()
+
+        cursor = self.transaction(
+            lambda connection: connection.execute(
+                """
+                UPDATE renderJobs SET leaseExpiresAt = ?, updatedAt = ?
+                WHERE videoId = ? AND renderKey = ? AND part = ?
+                    AND state = 'leased' AND leaseToken = ?
+                """,
+                (now + leaseDuration, now, *getJobKey(lease.job), lease.token),
+            )
+        )
+
+        return cursor.rowcount == 1
+
+    def complete(
+        self,
+        lease: RenderLease,
+        outputPath: Path,
+        publishOutput: Callable[[], None],
+        duration: float | None = None,
+        checksum: str | None = None,
+    ) -> bool:
+        """
+        Finish a job, publishing its output only if the lease is still held
+        The output is published inside the transaction, so only one worker
+        can ever publish a part
+
+        Args:
+            lease (RenderLease): The lease the part was rendered under
+            outputPath (Path): Where the rendered part ends up
+            publishOutput (Callable): Moves the rendered part into place
+            duration (float | None): How long the render took in seconds
+            checksum (str | None): The checksum of the rendered part
+
+        Returns:
+            bool: Whether the part was published
+        """
+
+        def completeJob(connection: sqlite3.Connection) -> bool:
+            if not self.isLeaseHeld(connection, lease):
+                return False
+
+            publishOutput()
+
+            connection.execute(
+                """
+                UPDATE renderJobs
+                SET state = 'rendered', leaseExpiresAt = NULL, updatedAt = ?,
+                    outputPath = ?, error = NULL, duration = ?, checksum = ?
+                WHERE videoId = ? AND renderKey = ? AND part = ?
+                """,
+                (
+                    time.time(),
+                    str(outputPath),
+                    duration,
+                    checksum,
+                    *getJobKey(lease.job),
+                ),
+            )
+            return True
+
+        return self.transaction(completeJob)
+
+    def fail(
+        self, lease: RenderLease, error: str, duration: float | None = None
+    ) -> str | None:
+        """
+        Give a job back after its render failed, to be retried if it has attempts left
+
+        Returns:
+            str | None: The new state of the job, None if the lease was no longer held
+        """
+
+        def failJob(connection: sqlite3.Connection) -> str | None:
+            if not self.isLeaseHeld(connection, lease):
+                return None
+
+            attempts = connection.execute(
+                """
+                SELECT attempts FROM renderJobs
+                WHERE videoId = ? AND renderKey = ? AND part = ?
+                """,
+                getJobKey(lease.job),
+            ).fetchone()[0]
+            state = "failed" if attempts >= self.maxAttempts else "pending"
+
+            connection.execute(
+                """
+                UPDATE renderJobs
+                SET state = ?, leaseOwner = NULL, leaseExpiresAt = NULL,
+                    updatedAt = ?, error = ?, duration = ?
+                WHERE videoId = ? AND renderKey = ? AND part = ?
+                """,
+                (state, time.time(), error, duration, *getJobKey(lease.job)),
+            )
+            return state
+
+        return self.transaction(failJob)
+
+    @staticmethod
+    def isLeaseHeld(connection: sqlite3.Connection, lease: RenderLease) -> bool:
+        row = connection.execute(
+            """
+            SELECT state, leaseToken FROM renderJobs
+            WHERE videoId = ? AND renderKey = ? AND part = ?
+            """,
+            getJobKey(lease.job),
+        ).fetchone()
+
+        return row is not None and row == ("leased", lease.token)
+
+    def getQueuedJobs(self) -> List[RenderJob]:
+        """
+        The jobs that are waiting for a worker or are being rendered
+        """
+
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT job FROM renderJobs WHERE state IN ('pending', 'leased')"
+            ).fetchall()
+
+        return [deserializeJob(row[0]) for row in rows]
+
+    def getResults(self) -> List[RenderResult]:
+        """
+        The results of every job that has been rendered or has run out of attempts
+        """
+
+        with self.lock:
+            rows = self.connection.execute(
+                """
+                SELECT job, state, duration, outputPath, checksum, error
+                FROM renderJobs
+                WHERE state IN ('rendered', 'failed')
+                ORDER BY videoId, renderKey, part
+                """
+            ).fetchall()
+
+        return [
+            RenderResult(
+                deserializeJob(job),
+                duration or 0,
+                error=(error or "Failed") if state == "failed" else None,
+                outputPath=Path(outputPath) if outputPath else None,
+                checksum=checksum,
+            )
+            for job, state, duration, outputPath, checksum, error in rows
+        ]
+
+    def getCounts(self) -> Dict[str, int]:
+        """
+        The number of jobs in every state
+        """
+
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT state, COUNT(*) FROM renderJobs GROUP BY state"
+            ).fetchall()
+
+        return {state: 0 for state in self.states} | dict(rows)
+
+    def isDrained(self) -> bool:
+        """
+        Whether every job has been rendered or has failed
+        """
+
+        counts = self.getCounts()
+        return counts["pending"] == 0 and counts["leased"] == 0
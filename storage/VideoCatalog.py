@@ -0,0 +1,198 @@
+from dataclasses import asdict, dataclass, fields
+from pathlib import Path
+from typing import Dict, List
+import json
+import os
+import threading
+
+from functions.Filesystem import createDirectory
+
+
+@dataclass
+class VideoRecord:
+    """
+    The compact information kept about a fetched video
+
+    Attributes:
+        videoId (str): The id of the video
+        channel (str): The target channel the video was fetched for
+        channelId (str): The channel id of the video
+        title (str): The title of the video
+        description (str): The description of the video
+        publishedAt (str): When the video was uploaded, as an ISO 8601 string
+        duration (float | None): The duration in seconds, once known
+        tags (List[str] | None): The tags of the video, once known
+        viewCount (int | None): The views of the video, once known
+        streamFormat (dict | None): The streams the video was downloaded from
+        state (str): How far the video has been processed,
+            "new", "processed" or "unavailable"
+    """
+
+    videoId: str
+    channel: str
+    channelId: str
+    title: str
+    description: str
+    publishedAt: str
+    duration: float | None = None
+    tags: List[str] | None = None
+    viewCount: int | None = None
+    streamFormat: dict | None = None
+    state: str = "new"
+
+    @classmethod
+    def fromDict(cls, data: dict) -> "VideoRecord":
+        # Ignore keys from newer or older versions of the catalog
+        names = {field.name for field in fields(cls)}
+        return cls(**{key: value for key, value in data.items() if key in names})
+
+    @classmethod
+    def fromSearchResult(cls, channel: str, searchResult: dict) -> "VideoRecord":
+        snippet = searchResult["snippet"]
+
+        return cls(
+            videoId=searchResult["id"]["videoId"],
+            channel=channel,
+            channelId=snippet["channelId"],
+            title=snippet["title"],
+            description=snippet["description"],
+            publishedAt=snippet["publishedAt"],
+        )
+
+
+class VideoCatalog:
+    """
+    A class to keep every fetched video indexed in memory
+    The catalog is loaded once per process and persisted as a log of records,
+    appending each change and compacting the log once it has grown too long
+
+    Attributes:
+        path (Path): The path to the catalog log
+        videos (Dict[str, VideoRecord]): The videos by video id
+        channels (Dict[str, Dict[str, VideoRecord]]): The videos by channel,
+            then video id
+    """
+
+    catalogs: Dict[Path, "VideoCatalog"] = {}
+    catalogsLock = threading.Lock()
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.lock = threading.RLock()
+
+        self.videos: Dict[str, VideoRecord] = {}
+        self.channels: Dict[str, Dict[str, VideoRecord]] = {}
+        self.logLines = 0
+
+        createDirectory(path.parent)
+        self.read()
+
+    @classmethod
+    def load(cls, path: Path = Path("data/catalog.jsonl")) -> "VideoCatalog":
+        """
+        Get the catalog of a path, reading it only the first time
+        """
+
+        with cls.catalogsLock:
+            if path not in cls.catalogs:
+                cls.catalogs[path] = cls(path)
+
+            return cls.catalogs[path]
+
+    def read(self):
+        if not self.path.is_file():
+            return
+
+        endsWithNewline = True
+
+        with open(self.path, "r", encoding="utf-8") as catalogFile:
+            for line in catalogFile:
+                endsWithNewline = line.endswith("\n")
+                if not line.strip():
+                    continue
+
+                try:
+                    record = VideoRecord.fromDict(json.loads(line))
+                except (json.JSONDecodeError, TypeError):
+                    # A line cut short by a crash mid-append
+                    continue
+
+                self.index(record)
+                self.logLines += 1
+
+        # Drop the cut short line so the next append starts on a line of its own
+        if not endsWithNewline:
+            self.compact()
+
+    def index(self, record: VideoRecord):
+        self.videos[record.videoId] = record
+        self.channels.setdefault(record.channel, {})[record.videoId] = record
+
+    @staticmethod
+    def serialize(record: VideoRecord) -> str:
+        return json.dumps(asdict(record), ensure_ascii=False) + "\n"
+
+    def get(self, videoId: str) -> VideoRecord | None:
+        return self.videos.get(videoId)
+
+    def __contains__(self, videoId: str) -> bool:
+        return videoId in self.videos
+
+    def getChannelVideos(self, channel: str) -> List[VideoRecord]:
+        """
+        Get the videos of a channel, newest first
+        """
+
+        channelVideos = self.channels.get(channel, {}).values()
+        return sorted(channelVideos, key=lambda record: record.publishedAt, reverse=True)
+
+    def addVideos(self, records: List[VideoRecord]):
+        """
+        Add or replace videos, appending them to the log
+        """
+
+        if not records:
+            return
+
+        with self.lock:
+            with open(self.path, "a", encoding="utf-8") as catalogFile:
+                for record in records:
+                    catalogFile.write(self.serialize(record))
+                catalogFile.flush()
+                os.fsync(catalogFile.fileno())
+
+            for record in records:
+                self.index(record)
+            self.logLines += len(records)
+
+            # Rewrite once most of the log is superseded records
+            if self.logLines > 2 * len(self.videos) + 1000:
+                self.compact()
+
+    def updateVideo(self, videoId: str, **changes) -> VideoRecord:
+        """
+        Change some fields of a video and persist it
+        """
+
+        with self.lock:
+            record = VideoRecord(**{**asdict(self.videos[videoId]), **changes})
+            self.addVideos([record])
+
+        return record
+
+    def compact(self):
+        """
+        Rewrite the log with only the current record of every video
+        """
+
+        with self.lock:
+            temporaryPath = self.path.with_suffix(".tmp")
+
+            with open(temporaryPath, "w", encoding="utf-8") as catalogFile:
+                for record in self.videos.values():
+                    catalogFile.write(self.serialize(record))
+                catalogFile.flush()
+                os.fsync(catalogFile.fileno())
+
+            os.replace(temporaryPath, self.path)
+            self.logLines = len(self.videos)
@@ -0,0 +1,223 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, Iterator, List
+import os
+import re
+import threading
+
+import pytest
+
+import functions.DownloadManager
+from functions.DownloadManager import DownloadError, DownloadManager
+from functions.Metrics import metrics
+
+RANGE_SIZE = 64 * 1024
+DATA = os.urandom(RANGE_SIZE * 8 + 123)
+
+
+class RangeServer(ThreadingHTTPServer):
+    """
+    A local server for DATA that answers range requests
+
+    Attributes:
+        requestedRanges (List[int]): The start of every range requested
+        cutShort (Dict[int, int]): The responses still to be cut short,
+            by the start of their range
+    """
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), RangeRequestHandler)
+        self.requestedRanges: List[int] = []
+        self.cutShort: Dict[int, int] = {}
+        self.lock = threading.Lock()
+
+    def getUrl(self, path: str) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/{path}"
+
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *arguments):
+        pass
+
+    def do_GET(self):
+        if self.path == "/redirect":
+            self.send_response(302)
+            self.send_header("Location", "/file")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        requestedRange = re.match(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+        if self.path == "/noRanges" or requestedRange is None:
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(DATA)))
+            self.end_headers()
+            self.wfile.write(DATA)
+            return
+
+        start, end = int(requestedRange.group(1)), int(requestedRange.group(2))
+        body = DATA[start : end + 1]
+
+        cutShort = False
+        # The size probe asks for a single byte, it is not a range of the file
+        if end > start:
+            with self.server.lock:
+                self.server.requestedRanges.append(start)
+
+                cutShort = self.server.cutShort.get(start, 0) > 0
+                if cutShort:
+                    self.server.cutShort[start] -= 1
+
+        self.send_response(206)
+        self.send_header("Content-Range", f"bytes {start}-{end}/{len(DATA)}")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+
+        if cutShort:
+            self.wfile.write(body[:10])
+            self.close_connection = True
+            return
+
+        self.wfile.write(body)
+
+
+@pytest.fixture(autouse=True)
+def metricsLog(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(metrics, "logPath", tmp_path.joinpath("events.jsonl"))
+
+
+@pytest.fixture
+def rangeServer() -> Iterator[RangeServer]:
+    server = RangeServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def sleeps(monkeypatch: pytest.MonkeyPatch) -> List[float]:
+    """
+    The waits between retries, recorded instead of slept
+    """
+
+    waits: List[float] = []
+    monkeypatch.setattr(functions.DownloadManager.time, "sleep", waits.append)
+    return waits
+
+
+def getDownloadManager(**arguments) -> DownloadManager:
+    return DownloadManager(rangeSize=RANGE_SIZE, retryBackoff=0.5, **arguments)
+
+
+def testDownloadsInRanges(tmp_path: Path, rangeServer: RangeServer):
+    outputPath = tmp_path.joinpath("video.mp4")
+
+    getDownloadManager().download(rangeServer.getUrl("file"), outputPath, len(DATA))
+
+    assert outputPath.read_bytes() == DATA
+    assert sorted(rangeServer.requestedRanges) == list(
+        range(0, len(DATA), RANGE_SIZE)
+    )
+    assert not tmp_path.joinpath("video.mp4.part").exists()
+    assert not tmp_path.joinpath("video.mp4.part.json").exists()
+
+
+def testFollowsRedirects(tmp_path: Path, rangeServer: RangeServer):
+    outputPath = tmp_path.joinpath("video.mp4")
+
+    getDownloadManager().download(rangeServer.getUrl("redirect"), outputPath)
+
+    assert outputPath.read_bytes() == DATA
+
+
+def testDownloadsWholeWithoutRanges(tmp_path: Path, rangeServer: RangeServer):
+    outputPath = tmp_path.joinpath("video.mp4")
+
+    getDownloadManager().download(rangeServer.getUrl("noRanges"), outputPath)
+
+    assert outputPath.read_bytes() == DATA
+    assert rangeServer.requestedRanges == []
+
+
+def testResumesAfterCrash(tmp_path: Path, rangeServer: RangeServer):
+    outputPath = tmp_path.joinpath("video.mp4")
+    partPath = tmp_path.joinpath("video.mp4.part")
+    downloadManager = getDownloadManager()
+
+    # A crash after the first two ranges were written
+    finishedBytes = RANGE_SIZE * 2
+    partPath.write_bytes(DATA[:finishedBytes] + bytes(len(DATA) - finishedBytes))
+    downloadManager.saveProgress(
+        downloadManager.getProgressPath(partPath), len(DATA), {0, 1}
+    )
+
+    downloadManager.download(rangeServer.getUrl("file"), outputPath)
+
+    assert outputPath.read_bytes() == DATA
+    assert sorted(rangeServer.requestedRanges) == list(
+        range(finishedBytes, len(DATA), RANGE_SIZE)
+    )
+
+
+def testRestartsProgressOfAnotherSize(tmp_path: Path, rangeServer: RangeServer):
+    outputPath = tmp_path.joinpath("video.mp4")
+    partPath = tmp_path.joinpath("video.mp4.part")
+    downloadManager = getDownloadManager()
+
+    # Progress of an older version of the file, which has to be thrown away
+    partPath.write_bytes(bytes(RANGE_SIZE * 2))
+    downloadManager.saveProgress(
+        downloadManager.getProgressPath(partPath), RANGE_SIZE * 2, {0, 1}
+    )
+
+    downloadManager.download(rangeServer.getUrl("file"), outputPath)
+
+    assert outputPath.read_bytes() == DATA
+    assert 0 in rangeServer.requestedRanges
+
+
+def testRejectsUnexpectedSize(tmp_path: Path, rangeServer: RangeServer):
+    outputPath = tmp_path.joinpath("video.mp4")
+
+    with pytest.raises(DownloadError):
+        getDownloadManager().download(
+            rangeServer.getUrl("file"), outputPath, len(DATA) + 1
+        )
+
+    assert not outputPath.exists()
+    assert rangeServer.requestedRanges == []
+
+
+def testRetriesCutShortRangesWithBackoff(
+    tmp_path: Path, rangeServer: RangeServer, sleeps: List[float]
+):
+    outputPath = tmp_path.joinpath("video.mp4")
+    rangeServer.cutShort[RANGE_SIZE * 3] = 2
+
+    getDownloadManager().download(rangeServer.getUrl("file"), outputPath)
+
+    assert outputPath.read_bytes() == DATA
+    assert rangeServer.requestedRanges.count(RANGE_SIZE * 3) == 3
+    assert sleeps == [0.5, 1.0]
+
+
+def testFailsOnceOutOfRetries(
+    tmp_path: Path, rangeServer: RangeServer, sleeps: List[float]
+):
+    outputPath = tmp_path.joinpath("video.mp4")
+    rangeServer.cutShort[0] = 10
+
+    with pytest.raises(DownloadError):
+        getDownloadManager(maxRetries=3).download(
+            rangeServer.getUrl("file"), outputPath
+        )
+
+    assert not outputPath.exists()
+    assert rangeServer.requestedRanges.count(0) == 3
+    assert sleeps == [0.5, 1.0]
@@ -0,0 +1,162 @@
+from pathlib import Path
+import json
+import multiprocessing
+import time
+
+import pytest
+
+import processing.RenderWorker
+from processing.RenderScheduler import RenderJob, RenderResult
+from processing.RenderWorker import RenderWorker
+from storage.RenderQueue import RenderQueue
+
+
+class LoggedRenderQueue(RenderQueue):
+    """
+    A render queue that writes every part it publishes to a log file,
+    one line per publish, so the parent process can count them
+    """
+
+    def __init__(self, databasePath: Path, publishLog: Path):
+        super().__init__(databasePath)
+        self.publishLog = publishLog
+
+    def complete(self, lease, outputPath, publishOutput, **kwargs) -> bool:
+        def logPublish():
+            publishOutput()
+            with open(self.publishLog, "a") as file:
+                file.write(f"{lease.job.currentPart} {lease.workerId}\n")
+
+        return super().complete(lease, outputPath, logPublish, **kwargs)
+
+
+def renderStub(job: RenderJob, threads: int) -> RenderResult:
+    """
+    Stands in for renderPart, writing the files a render leaves behind
+    """
+
+    partDirectory = job.videoOutputDirectory.joinpath(f"part-{job.currentPart}")
+    partDirectory.mkdir(parents=True, exist_ok=True)
+
+    time.sleep(0.05)
+    outputPath = partDirectory.joinpath("output.mp4")
+    outputPath.write_bytes(b"part")
+    partDirectory.joinpath("metadata.json").write_text(json.dumps({}))
+
+    return RenderResult(job, 0.05, outputPath=outputPath, checksum="stub")
+
+
+def runStubWorker(queuePath: Path, publishLog: Path):
+    renderWorker = RenderWorker(
+        LoggedRenderQueue(queuePath, publishLog),
+        leaseDuration=2,
+        pollInterval=0.05,
+        exitWhenDrained=True,
+    )
+    renderWorker.run()
+
+
+def getJob(outputDirectory: Path, part: int, totalParts: int = 1) -> RenderJob:
+    return RenderJob(
+        videoId="video",
+        videoTitle="Video",
+        videoKeywords=None,
+        videoOutputDirectory=outputDirectory,
+        videoClipPath=outputDirectory.joinpath("clip.mp4"),
+        gameplayClip=None,
+        currentPart=part,
+        totalParts=totalParts,
+    )
+
+
+def testEveryPartIsPublishedOnce(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    # Forked, so the workers keep the stubbed render
+    monkeypatch.setattr(processing.RenderWorker, "renderPart", renderStub)
+
+    queuePath = tmp_path.joinpath("renderQueue.sqlite3")
+    publishLog = tmp_path.joinpath("published.log")
+    outputDirectory = tmp_path.joinpath("render-key")
+
+    totalParts = 12
+    renderQueue = RenderQueue(queuePath)
+    for part in range(totalParts):
+        renderQueue.publish(getJob(outputDirectory, part, totalParts))
+
+    context = multiprocessing.get_context("fork")
+    processes = [
+        context.Process(target=runStubWorker, args=(queuePath, publishLog))
+        for _ in range(4)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+
+    publishedParts = [
+        int(line.split()[0]) for line in publishLog.read_text().splitlines()
+    ]
+    assert sorted(publishedParts) == list(range(totalParts))
+
+    counts = renderQueue.getCounts()
+    assert counts["rendered"] == totalParts
+    assert renderQueue.isDrained()
+
+    for part in range(totalParts):
+        assert outputDirectory.joinpath(f"part-{part}", "output.mp4").is_file()
+        assert outputDirectory.joinpath(f"part-{part}", "metadata.json").is_file()
+
+    results = renderQueue.getResults()
+    assert sorted(result.job.currentPart for result in results) == list(
+        range(totalParts)
+    )
+    assert all(result.succeeded for result in results)
+
+
+def testExpiredLeaseIsReclaimed(tmp_path: Path):
+    renderQueue = RenderQueue(tmp_path.joinpath("renderQueue.sqlite3"))
+    renderQueue.publish(getJob(tmp_path, 0))
+
+    staleLease = renderQueue.claim("stale", leaseDuration=0.05)
+    assert staleLease is not None
+    assert renderQueue.claim("other", leaseDuration=60) is None
+
+    time.sleep(0.1)
+
+    lease = renderQueue.claim("other", leaseDuration=60)
+    assert lease is not None
+    assert lease.job.currentPart == staleLease.job.currentPart
+    assert lease.token == staleLease.token + 1
+
+
+def testStaleHolderCanNotComplete(tmp_path: Path):
+    renderQueue = RenderQueue(tmp_path.joinpath("renderQueue.sqlite3"))
+    renderQueue.publish(getJob(tmp_path, 0))
+
+    staleLease = renderQueue.claim("stale", leaseDuration=0.05)
+    time.sleep(0.1)
+    lease = renderQueue.claim("other", leaseDuration=60)
+
+    published = []
+    outputPath = tmp_path.joinpath("output.mp4")
+
+    assert not renderQueue.heartbeat(staleLease, 60)
+    assert not renderQueue.complete(
+        staleLease, outputPath, lambda: published.append("stale")
+    )
+    assert renderQueue.fail(staleLease, "stale") is None
+    assert published == []
+
+    assert renderQueue.complete(lease, outputPath, lambda: published.append("other"))
+    assert published == ["other"]
+    assert renderQueue.getCounts()["rendered"] == 1
+
+
+def testJobFailsOnceOutOfAttempts(tmp_path: Path):
+    renderQueue = RenderQueue(tmp_path.joinpath("renderQueue.sqlite3"), maxAttempts=2)
+    renderQueue.publish(getJob(tmp_path, 0))
+
+    assert renderQueue.fail(renderQueue.claim("first", 60), "error") == "pending"
+    assert renderQueue.fail(renderQueue.claim("second", 60), "error") == "failed"
+    assert renderQueue.claim("third", 60) is None
+    assert renderQueue.isDrained()
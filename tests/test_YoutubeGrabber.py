@@ -0,0 +1,229 @@
+from pathlib import Path
+from typing import Callable, Dict, List
+import hashlib
+
+from googleapiclient.errors import HttpError
+import httplib2
+import pytest
+
+from storage.VideoCatalog import VideoCatalog
+from youtube.YoutubeGrabber import YoutubeGrabber
+
+PAGE_SIZE = 50
+
+
+class FakeRequest:
+    def __init__(self, execute: Callable[[Dict[str, str]], dict]):
+        self.headers: Dict[str, str] = {}
+        self.execute = lambda: execute(self.headers)
+
+
+class FakeResource:
+    def __init__(self, listRequest: Callable[..., FakeRequest]):
+        self.list = listRequest
+
+
+class FakeYoutubeService:
+    """
+    A fake of the parts of the Data API the grabber uses, serving one channel
+    whose uploads playlist answers conditional requests like the real one
+
+    Attributes:
+        uploads (List[dict]): The videos of the channel, newest first
+        pageRequests (List[str | None]): The page token of every playlist request
+        ifNoneMatch (List[str | None]): The etag every playlist request was made with
+    """
+
+    channelId = "UCchannel"
+    uploadsPlaylistId = "UUchannel"
+
+    def __init__(self, uploadCount: int):
+        self.uploads: List[dict] = []
+        self.pageRequests: List[str | None] = []
+        self.ifNoneMatch: List[str | None] = []
+
+        for _ in range(uploadCount):
+            self.upload()
+
+    def upload(self, title: str | None = None) -> str:
+        """
+        Add a video to the top of the uploads playlist
+
+        Returns:
+            str: The id of the video
+        """
+
+        number = len(self.uploads)
+        videoId = f"video{number:03d}"
+
+        self.uploads.insert(
+            0,
+            {
+                "videoId": videoId,
+                "title": title or f"Video {number}",
+                "publishedAt": f"2024-01-01T00:{number // 60:02d}:{number % 60:02d}Z",
+            },
+        )
+
+        return videoId
+
+    def getPage(self, pageToken: str | None) -> dict:
+        start = int(pageToken or 0)
+        uploads = self.uploads[start : start + PAGE_SIZE]
+
+        page = {
+            "etag": hashlib.md5(
+                "".join(upload["videoId"] for upload in uploads).encode()
+            ).hexdigest(),
+            "items": [
+                {
+                    "etag": f"etag-{upload['videoId']}",
+                    "snippet": {
+                        "title": upload["title"],
+                        "description": "",
+                        "channelId": self.channelId,
+                        "publishedAt": "2025-01-01T00:00:00Z",
+                        "playlistId": self.uploadsPlaylistId,
+                        "position": start + i,
+                        "resourceId": {"videoId": upload["videoId"]},
+                    },
+                    "contentDetails": {"videoPublishedAt": upload["publishedAt"]},
+                }
+                for i, upload in enumerate(uploads)
+            ],
+        }
+
+        if start + PAGE_SIZE < len(self.uploads):
+            page["nextPageToken"] = str(start + PAGE_SIZE)
+
+        return page
+
+    def search(self) -> FakeResource:
+        return FakeResource(
+            lambda **_: FakeRequest(
+                lambda headers: {
+                    "items": [
+                        {
+                            "snippet": {"title": "Channel"},
+                            "id": {"channelId": self.channelId},
+                        }
+                    ]
+                }
+            )
+        )
+
+    def channels(self) -> FakeResource:
+        return FakeResource(
+            lambda **_: FakeRequest(
+                lambda headers: {
+                    "items": [
+                        {
+                            "contentDetails": {
+                                "relatedPlaylists": {"uploads": self.uploadsPlaylistId}
+                            }
+                        }
+                    ]
+                }
+            )
+        )
+
+    def playlistItems(self) -> FakeResource:
+        def listPlaylistItems(playlistId: str, pageToken: str | None = None, **_):
+            assert playlistId == self.uploadsPlaylistId
+
+            def execute(headers: Dict[str, str]) -> dict:
+                self.pageRequests.append(pageToken)
+                self.ifNoneMatch.append(headers.get("If-None-Match"))
+
+                page = self.getPage(pageToken)
+                if headers.get("If-None-Match") == page["etag"]:
+                    raise HttpError(httplib2.Response({"status": 304}), b"")
+
+                return page
+
+            return FakeRequest(execute)
+
+        return FakeResource(listPlaylistItems)
+
+
+@pytest.fixture(autouse=True)
+def dataDirectory(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    # The grabber and the catalog keep their data relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(VideoCatalog, "catalogs", {})
+
+
+def getVideoIds(service: FakeYoutubeService) -> List[str]:
+    return [upload["videoId"] for upload in service.uploads]
+
+
+def testFirstSyncFetchesEveryPage():
+    service = FakeYoutubeService(120)
+    service.upload("Private video")
+
+    youtubeGrabber = YoutubeGrabber("key", "channel", service=service)
+    videos = youtubeGrabber.getVideos()
+
+    assert service.pageRequests == [None, "50", "100"]
+    assert service.ifNoneMatch == [None, None, None]
+    assert [video.videoId for video in videos] == getVideoIds(service)[1:]
+
+
+def testSyncStopsAtCachedVideo():
+    service = FakeYoutubeService(120)
+    youtubeGrabber = YoutubeGrabber("key", "channel", service=service)
+    youtubeGrabber.getVideos()
+
+    newVideoIds = [service.upload() for _ in range(3)]
+    service.pageRequests.clear()
+
+    videos = youtubeGrabber.getVideos(sync=True)
+
+    assert service.pageRequests == [None]
+    assert {video.videoId for video in videos[:3]} == set(newVideoIds)
+    assert [video.videoId for video in videos] == getVideoIds(service)
+
+
+def testSyncWalksPagesUntilCachedVideo():
+    service = FakeYoutubeService(10)
+    youtubeGrabber = YoutubeGrabber("key", "channel", service=service)
+    youtubeGrabber.getVideos()
+
+    for _ in range(60):
+        service.upload()
+    service.pageRequests.clear()
+
+    videos = youtubeGrabber.getVideos(sync=True)
+
+    assert service.pageRequests == [None, "50"]
+    assert [video.videoId for video in videos] == getVideoIds(service)
+
+
+def testUnchangedChannelIsNotFetchedAgain():
+    service = FakeYoutubeService(120)
+    youtubeGrabber = YoutubeGrabber("key", "channel", service=service)
+    savedVideos = youtubeGrabber.getVideos()
+
+    service.pageRequests.clear()
+    service.ifNoneMatch.clear()
+
+    videos = youtubeGrabber.getVideos(sync=True)
+
+    firstPageEtag = service.getPage(None)["etag"]
+    assert service.pageRequests == [None]
+    assert service.ifNoneMatch == [firstPageEtag]
+    assert videos == savedVideos
+
+
+def testSavedVideosAreNotSynced():
+    service = FakeYoutubeService(10)
+    youtubeGrabber = YoutubeGrabber("key", "channel", service=service)
+    youtubeGrabber.getVideos()
+
+    service.upload()
+    service.pageRequests.clear()
+
+    videos = youtubeGrabber.getVideos()
+
+    assert service.pageRequests == []
+    assert len(videos) == 10
@@ -0,0 +1,66 @@
+from multiprocessing import Process
+from pathlib import Path
+import argparse
+
+from processing.RenderWorker import RenderWorker
+from storage.RenderQueue import RenderQueue
+
+
+def runWorker(
+    queuePath: Path,
+    leaseDuration: float,
+    threads: int,
+    exitWhenDrained: bool,
+):
+    # Every process opens its own connection to the queue
+    renderWorker = RenderWorker(
+        RenderQueue(queuePath),
+        leaseDuration=leaseDuration,
+        threads=threads,
+        exitWhenDrained=exitWhenDrained,
+    )
+    renderWorker.run()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Render the parts published to a render queue"
+    )
+    parser.add_argument("--queue", type=Path, default=Path("data/renderQueue.sqlite3"))
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--lease",
+        type=float,
+        default=120,
+        help="Seconds a lease lasts without a heartbeat, the clocks of every "
+        "machine must agree to well within a third of it",
+    )
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument(
+        "--exit-when-drained",
+        action="store_true",
+        help="Stop once every job has been rendered or has failed",
+    )
+    arguments = parser.parse_args()
+
+    processes = [
+        Process(
+            target=runWorker,
+            args=(
+                arguments.queue,
+                arguments.lease,
+                arguments.threads,
+                arguments.exit_when_drained,
+            ),
+        )
+        for _ in range(arguments.workers)
+    ]
+
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
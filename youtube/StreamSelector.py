@@ -0,0 +1,146 @@
+from dataclasses import dataclass
+from pathlib import Path
+import math
+from pytube import Stream, StreamQuery
+
+from functions.DownloadManager import downloadManager
+from processing.SplitVideo import runFfmpeg
+
+
+@dataclass
+class StreamSelection:
+    """
+    The streams chosen to download a video with
+
+    Attributes:
+        videoStream (Stream): The stream with the video track
+        audioStream (Stream | None): The audio stream to mux in, None if the
+            video stream is progressive and has its own audio
+    """
+
+    videoStream: Stream
+    audioStream: Stream | None
+
+    def describe(self) -> dict:
+        """
+        The chosen formats, to be recorded in the catalog
+        """
+
+        return {
+            "videoItag": self.videoStream.itag,
+            "resolution": self.videoStream.resolution,
+            "videoCodec": self.videoStream.video_codec,
+            "progressive": self.audioStream is None,
+            "audioItag": self.audioStream.itag if self.audioStream else None,
+            "audioBitrate": self.audioStream.abr if self.audioStream else None,
+        }
+
+
+def getStreamHeight(stream: Stream) -> int:
+    return int(stream.resolution.rstrip("p")) if stream.resolution else 0
+
+
+def selectStreams(
+    streams: StreamQuery, targetWidth: int = 720, aspectRatio: float = 16 / 9
+) -> StreamSelection:
+    """
+    Select the smallest streams that still fill the width of the render
+    Youtube only lists stream heights, so widths are estimated from the aspect ratio
+
+    Args:
+        streams (StreamQuery): The streams of the video
+        targetWidth (int): The width the video is resized to when rendering
+        aspectRatio (float): The expected width to height ratio of the video
+
+    Returns:
+        StreamSelection: The video stream and, if it has no audio, the audio stream
+    """
+
+    minHeight = math.ceil(targetWidth / aspectRatio)
+
+    videoStreams = [
+        stream
+        for stream in streams.filter(subtype="mp4")
+        if stream.includes_video_track and stream.resolution
+    ]
+
+    largeEnough = [
+        stream for stream in videoStreams if getStreamHeight(stream) >= minHeight
+    ]
+
+    if largeEnough:
+        # Progressive streams win a tie since they do not need muxing, then h264
+        # over the smaller av1, which decodes far slower and can not be smart cut
+        videoStream = min(
+            largeEnough,
+            key=lambda stream: (
+                getStreamHeight(stream),
+                not stream.is_progressive,
+                not (stream.video_codec or "").startswith("avc1"),
+                stream.bitrate or 0,
+            ),
+        )
+    else:
+        videoStream = streams.get_highest_resolution()
+
+    if videoStream.is_progressive:
+        return StreamSelection(videoStream, None)
+
+    audioStream = (
+        streams.filter(only_audio=True, subtype="mp4").order_by("abr").desc().first()
+    )
+
+    return StreamSelection(videoStream, audioStream)
+
+
+def downloadSelection(selection: StreamSelection, outputPath: Path) -> Path:
+    """
+    Download the selected streams, muxing the audio in if it is separate
+
+    Args:
+        selection (StreamSelection): The streams to download
+        outputPath (Path): The path to save the video to
+
+    Returns:
+        Path: The path to the downloaded video
+    """
+
+    videoStream, audioStream = selection.videoStream, selection.audioStream
+
+    if audioStream is None:
+        return downloadManager.download(
+            videoStream.url, outputPath, videoStream.filesize
+        )
+
+    videoPath = outputPath.with_name(f"{outputPath.stem}.video.mp4")
+    audioPath = outputPath.with_name(f"{outputPath.stem}.audio.m4a")
+
+    # Both streams download at once
+    videoFuture = downloadManager.submit(
+        videoStream.url, videoPath, videoStream.filesize
+    )
+    audioFuture = downloadManager.submit(
+        audioStream.url, audioPath, audioStream.filesize
+    )
+    videoFuture.result()
+    audioFuture.result()
+
+    temporaryPath = outputPath.with_name(f"{outputPath.stem}.muxing.mp4")
+
+    runFfmpeg(
+        [
+            "-i", str(videoPath),
+            "-i", str(audioPath),
+            "-map", "0:v:0",
+            "-map", "1:a:0",
+            "-c", "copy",
+            str(temporaryPath),
+        ],
+        check=True,
+    )
+
+    temporaryPath.replace(outputPath)
+    videoPath.unlink()
+    audioPath.unlink()
+
+    return outputPath
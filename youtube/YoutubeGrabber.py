@@ -1,13 +1,26 @@
+from dataclasses import asdict
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import List, Tuple
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 import json
+import os
 from pytube import YouTube as PytubeDownloader
-from pytube.cli import on_progress
 
 from functions.Filesystem import createDirectory
-from functions.utils import assertResponse
-from processing.SplitVideo import splitVideoIntoChunks
+from functions.Metrics import metrics
+from functions.utils import assertResponse, parseIsoDuration
+from processing.SilenceBoundaries import planSilenceBoundaries
+from processing.SplitVideo import (
+    Timestamp,
+    getChunkTimestamps,
+    getVideoDuration,
+    splitVideoIntoChunks,
+)
+from storage.ArtifactStore import artifactStore, getSafeName
+from storage.DiskBudget import DiskBudget
+from storage.VideoCatalog import VideoCatalog, VideoRecord
+from youtube.StreamSelector import downloadSelection, selectStreams
 
 
 class YoutubeGrabber:
@@ -17,22 +30,32 @@ class YoutubeGrabber:
     Attributes:
         apiKey (str): The youtube api key
         targetChannel (str): The target channel to download videos from
-        service (googleapiclient.discovery.Resource): The youtube api service
+        service (googleapiclient.discovery.Resource): The youtube api service,
+            can be passed in to share one client or to use a fake of the api
         channelId (str): The channel id of the target channel
-        directory (Path): The directory to save the videos
+        directory (Path): The directory of the channel, videos/ in it only holds
+            links to the artifacts of the videos
+        catalog (VideoCatalog): The catalog of every fetched video
+        downloadParameters (dict): What the downloads are selected by, part of
+            the key of every artifact made from a download
     """
 
-    def __init__(self, apiKey: str, targetChannel: str):
+    downloadParameters = {"targetWidth": 720}
+
+    def __init__(self, apiKey: str, targetChannel: str, service=None):
         self.apiKey = apiKey
-        self.service = build("youtube", "v3", developerKey=apiKey)
+        self.service = service or build("youtube", "v3", developerKey=apiKey)
 
         self.directory = Path(f"data/{targetChannel}")
 
+        createDirectory("data")
+        createDirectory(self.directory)
+
         self.targetChannel = targetChannel
         self.channelId = self.getChannelID()
 
-        createDirectory("data")
-        createDirectory(self.directory)
+        self.catalog = VideoCatalog.load()
+        self.importFetchedVideos()
 
     def getChannelID(self) -> str:
         """
@@ -62,70 +85,258 @@ class YoutubeGrabber:
 
         return channel["id"]["channelId"]
 
-    def getAllSavedVideos(self) -> Dict[str, dict]:
+    def importFetchedVideos(self):
+        """
+        Moves the videos of fetchedVideos.json, from before the catalog, into the catalog
+        """
+
         jsonPath = self.directory.joinpath("fetchedVideos.json")
 
-        if jsonPath.is_file():
-            with open(jsonPath, "r") as f:
+        if not jsonPath.is_file() or self.catalog.getChannelVideos(self.targetChannel):
+            return
+
+        with open(jsonPath, "r") as f:
+            savedVideos = json.load(f)
+
+        self.catalog.addVideos(
+            [
+                VideoRecord.fromSearchResult(self.targetChannel, video)
+                for video in savedVideos.get(self.targetChannel, [])
+            ]
+        )
+
+    def getChannelSavedVideos(self) -> List[VideoRecord]:
+        return self.catalog.getChannelVideos(self.targetChannel)
+
+    def getSyncState(self) -> dict:
+        syncStatePath = self.directory.joinpath("syncState.json")
+
+        if syncStatePath.is_file():
+            with open(syncStatePath, "r") as f:
                 return json.load(f)
 
         return {}
 
-    def getChannelSavedVideos(self) -> dict:
-        savedVideos = self.getAllSavedVideos()
+    def saveSyncState(self, syncState: dict):
+        with open(self.directory.joinpath("syncState.json"), "w") as f:
+            json.dump(syncState, f, indent=4)
+
+    def getUploadsPlaylistId(self, syncState: dict) -> str:
+        """
+        Fetches the id of the playlist every upload of the channel is added to
+        """
 
-        return (
-            savedVideos[self.targetChannel] if self.targetChannel in savedVideos else {}
+        if "uploadsPlaylistId" in syncState:
+            return syncState["uploadsPlaylistId"]
+
+        channelList = (
+            self.service.channels()
+            .list(part="contentDetails", id=self.channelId)
+            .execute()
         )
+        channel = channelList["items"][0]
 
-    def saveVideos(self, videos: List[dict]):
-        jsonPath = self.directory.joinpath("fetchedVideos.json")
+        return channel["contentDetails"]["relatedPlaylists"]["uploads"]
+
+    @staticmethod
+    def playlistItemToVideo(playlistItem: dict) -> dict:
+        """
+        Converts an uploads playlist item to the shape of a search result
+        so cached videos look the same however they were fetched
+        """
+
+        snippet = dict(playlistItem["snippet"])
+        videoId = snippet.pop("resourceId")["videoId"]
+
+        playlistKeys = (
+            "playlistId",
+            "position",
+            "videoOwnerChannelId",
+            "videoOwnerChannelTitle",
+        )
+        for playlistKey in playlistKeys:
+            snippet.pop(playlistKey, None)
 
-        savedVideos = self.getAllSavedVideos()
-        savedVideos[self.targetChannel] = videos
+        # The playlist item is published when the video is added, not when it is uploaded
+        contentDetails = playlistItem.get("contentDetails", {})
+        snippet["publishedAt"] = contentDetails.get(
+            "videoPublishedAt", snippet["publishedAt"]
+        )
 
-        with open(jsonPath, "w") as f:
-            json.dump(savedVideos, f, indent=4)
+        return {
+            "kind": "youtube#searchResult",
+            "etag": playlistItem["etag"],
+            "id": {"kind": "youtube#video", "videoId": videoId},
+            "snippet": snippet,
+        }
 
-    def getVideos(self) -> List[dict]:
+    def syncVideos(self) -> List[VideoRecord]:
         """
-        Fetches all videos from the target channel
+        Fetches the videos uploaded since the last sync and merges them into the cache
+        Walks the uploads playlist newest first, at 1 quota unit per page,
+        and stops at the newest video that is already cached
 
         Returns:
-            list: A list of videos from the target channel
+            List[VideoRecord]: The videos of the target channel, newest first
         """
 
-        if self.targetChannel in self.getAllSavedVideos():
-            return self.getChannelSavedVideos()
+        savedVideos = self.getChannelSavedVideos()
+
+        syncState = self.getSyncState()
+        syncState["uploadsPlaylistId"] = self.getUploadsPlaylistId(syncState)
 
         nextPageToken = None
-        videos = []
+        newVideos = []
 
         while True:
-            videosListResponse = (
-                self.service.search()
-                .list(
-                    part="snippet",
-                    channelId=self.channelId,
-                    maxResults=50,
-                    type="video",
-                    pageToken=nextPageToken if nextPageToken else None,
+            request = self.service.playlistItems().list(
+                part="snippet,contentDetails",
+                playlistId=syncState["uploadsPlaylistId"],
+                maxResults=50,
+                pageToken=nextPageToken if nextPageToken else None,
+            )
+
+            # An unchanged first page means there is nothing new to fetch
+            if nextPageToken is None and savedVideos and "etag" in syncState:
+                request.headers["If-None-Match"] = syncState["etag"]
+
+            try:
+                playlistItemsResponse = request.execute()
+            except HttpError as error:
+                if error.resp.status == 304:
+                    print("No new videos")
+                    return savedVideos
+                raise
+
+            if nextPageToken is None:
+                syncState["etag"] = playlistItemsResponse["etag"]
+
+            reachedSavedVideos = False
+
+            for playlistItem in playlistItemsResponse["items"]:
+                if playlistItem["snippet"]["resourceId"]["videoId"] in self.catalog:
+                    reachedSavedVideos = True
+                    break
+
+                # Private and deleted uploads stay in the playlist but cannot be downloaded
+                if playlistItem["snippet"]["title"] in ("Private video", "Deleted video"):
+                    continue
+
+                newVideos.append(
+                    VideoRecord.fromSearchResult(
+                        self.targetChannel, self.playlistItemToVideo(playlistItem)
+                    )
                 )
+
+            nextPageToken = playlistItemsResponse.get("nextPageToken")
+
+            if reachedSavedVideos or not nextPageToken:
+                break
+
+        print(f"Found {len(newVideos)} new videos")
+
+        self.catalog.addVideos(newVideos)
+        self.saveSyncState(syncState)
+
+        return self.getChannelSavedVideos()
+
+    def getVideos(self, sync: bool = False) -> List[VideoRecord]:
+        """
+        Fetches all videos from the target channel
+        Returns the saved videos if they have been fetched before
+
+        Args:
+            sync (bool): Fetch the videos uploaded since they were saved
+
+        Returns:
+            List[VideoRecord]: The videos of the target channel, newest first
+        """
+
+        savedVideos = self.getChannelSavedVideos()
+
+        if not sync and savedVideos:
+            return savedVideos
+
+        return self.syncVideos()
+
+    def enrichVideos(self, records: List[VideoRecord]) -> List[VideoRecord]:
+        """
+        Fetches the duration, tags and views of videos that do not have them yet
+        Asks for 50 videos per videos.list call, the most the api allows
+
+        Args:
+            records (List[VideoRecord]): The videos to enrich
+
+        Returns:
+            List[VideoRecord]: The videos with their details, in the same order
+        """
+
+        missingIds = [record.videoId for record in records if record.duration is None]
+
+        for i in range(0, len(missingIds), 50):
+            batchIds = missingIds[i : i + 50]
+
+            videosListResponse = (
+                self.service.videos()
+                .list(part="contentDetails,snippet,statistics", id=",".join(batchIds))
                 .execute()
             )
 
-            videos.extend(videosListResponse["items"])
+            for video in videosListResponse["items"]:
+                self.catalog.updateVideo(
+                    video["id"],
+                    duration=parseIsoDuration(video["contentDetails"]["duration"]),
+                    tags=video["snippet"].get("tags", []),
+                    viewCount=int(video["statistics"].get("viewCount", 0)),
+                )
+
+            # Videos that were deleted or made private are left out of the response
+            returnedIds = {video["id"] for video in videosListResponse["items"]}
+            for videoId in batchIds:
+                if videoId not in returnedIds:
+                    self.catalog.updateVideo(videoId, state="unavailable")
+
+        return [self.catalog.get(record.videoId) for record in records]
+
+    @staticmethod
+    def filterVideos(
+        records: List[VideoRecord],
+        minDuration: float | None = None,
+        maxDuration: float | None = None,
+        minViews: int | None = None,
+        skipStates: Tuple[str, ...] = ("processed", "unavailable"),
+    ) -> List[VideoRecord]:
+        """
+        Filters out the videos not worth downloading, before any bytes are downloaded
+        Videos that have not been enriched are only filtered by their state
 
-            nextPageToken = videosListResponse.get("nextPageToken")
+        Args:
+            records (List[VideoRecord]): The videos to filter
+            minDuration (float | None): The shortest video to keep in seconds
+            maxDuration (float | None): The longest video to keep in seconds
+            minViews (int | None): The fewest views a video needs to be kept
+            skipStates (Tuple[str, ...]): The states of the videos to leave out
 
-            if not nextPageToken:
-                break
+        Returns:
+            List[VideoRecord]: The videos to process, in the same order
+        """
+
+        def keepVideo(record: VideoRecord) -> bool:
+            if record.state in skipStates:
+                return False
 
-        print(f"Found {len(videos)} videos")
+            if record.duration is not None:
+                if minDuration is not None and record.duration < minDuration:
+                    return False
+                if maxDuration is not None and record.duration > maxDuration:
+                    return False
 
-        self.saveVideos(videos)
+            if minViews is not None and record.viewCount is not None:
+                return record.viewCount >= minViews
 
-        return videos
+            return True
+
+        return [record for record in records if keepVideo(record)]
 
     def downloadVideo(self, videoId: str) -> Tuple[Path, List[str]]:
         """
@@ -141,46 +352,151 @@ class YoutubeGrabber:
             -> Path, Keywords
         """
 
-        video = PytubeDownloader(
-            f"https://www.youtube.com/watch?v={videoId}",
-            on_progress_callback=on_progress,
+        path = artifactStore.getPath(
+            videoId, "download", self.downloadParameters, "main.mp4"
         )
-        stream = video.streams.get_highest_resolution()
+        keywordsPath = path.with_name("keywords.json")
+        record = self.catalog.get(videoId)
+
+        # Downloads from before the artifact store are moved into it
+        if not path.is_file() and record is not None:
+            legacyPath = self.directory.joinpath("videos", record.title, "main.mp4")
+            if legacyPath.is_file():
+                os.replace(legacyPath, path)
+
+        # Stored by id, so a renamed upload is not downloaded again,
+        # and nothing is asked of youtube for a video that is already stored
+        if path.is_file():
+            if record is not None:
+                self.linkVideo(videoId, record.title)
+
+            keywords = (
+                artifactStore.readJson(keywordsPath)
+                if keywordsPath.is_file()
+                else record.tags if record else None
+            )
+
+            print(f"{record.title if record else videoId} already downloaded")
+            DiskBudget.markUsed(path)
+            return [path, keywords]
+
+        video = PytubeDownloader(f"https://www.youtube.com/watch?v={videoId}")
+        self.linkVideo(videoId, video.title)
 
-        videoDirectory = Path(f"data/{self.targetChannel}/videos/{video.title}")
-        createDirectory(videoDirectory)
+        selection = selectStreams(video.streams, **self.downloadParameters)
 
         print(f"Downloading {video.title}")
 
-        path = stream.download(output_path=videoDirectory, filename="main.mp4")
+        with metrics.measureStage("download", videoId=videoId) as measurement:
+            path = downloadSelection(selection, path)
+            measurement["bytes"] = path.stat().st_size
+
+        artifactStore.writeJson(keywordsPath, video.keywords)
+
+        if videoId in self.catalog:
+            self.catalog.updateVideo(videoId, streamFormat=selection.describe())
 
         print(f"Downloaded {video.title}")
 
         return [path, video.keywords]
 
-    def splitVideo(self, videoTitle: str) -> List[Path]:
+    def getVideoPath(self, videoId: str) -> Path:
+        return artifactStore.getDirectory(
+            videoId, "download", self.downloadParameters
+        ).joinpath("main.mp4")
+
+    def linkVideo(self, videoId: str, videoTitle: str):
+        """
+        Link data/{channel}/videos/{title} [{videoId}] to the artifacts of a video
+        """
+
+        artifactStore.link(
+            artifactStore.getVideoDirectory(videoId),
+            self.directory.joinpath("videos", f"{getSafeName(videoTitle)} [{videoId}]"),
+        )
+
+    def getSplitParameters(self, silenceAware: bool) -> dict:
+        return {
+            "download": self.downloadParameters,
+            "chunkLength": 60,
+            "silenceAware": silenceAware,
+        }
+
+    def getSplitPlan(self, videoId: str, silenceAware: bool = False) -> List[Timestamp]:
+        """
+        Get the chunk boundaries of a downloaded video, planning them only once
+
+        Args:
+            videoId (str): The id of the video
+            silenceAware (bool): Move the boundaries to the quietest point near
+                every minute instead of cutting on the exact minute
+
+        Returns:
+            List[Timestamp]: The start and end of every chunk
+        """
+
+        planPath = artifactStore.getPath(
+            videoId, "plan", self.getSplitParameters(silenceAware), "plan.json"
+        )
+
+        if planPath.is_file():
+            plan = artifactStore.readJson(planPath)
+            return [Timestamp(**timestamp) for timestamp in plan]
+
+        videoPath = self.getVideoPath(videoId)
+        timeStamps = (
+            planSilenceBoundaries(videoPath)
+            if silenceAware
+            else getChunkTimestamps(getVideoDuration(videoPath))
+        )
+
+        artifactStore.writeJson(
+            planPath, [asdict(timestamp) for timestamp in timeStamps]
+        )
+        return timeStamps
+
+    def getSplitDirectory(self, videoId: str, silenceAware: bool = False) -> Path:
+        return artifactStore.getDirectory(
+            videoId, "split", self.getSplitParameters(silenceAware)
+        )
+
+    def splitVideo(self, videoId: str, silenceAware: bool = False) -> List[Path]:
         """
         Splits a video into 1 minute chunks
-        Uses the downloaded video from the video title
+        Uses the downloaded video of the video id, and is only split once
 
         Args:
-            videoTitle (str): The title of the video to split
+            videoId (str): The id of the video to split
+            silenceAware (bool): Move the boundaries to the quietest point near
+                every minute instead of cutting on the exact minute
 
         Returns:
             list: A list of paths to the split video chunks
         """
 
-        videoDirectory = self.directory.joinpath(f"videos/{videoTitle}")
-        assertResponse(
-            videoDirectory.is_dir(),
-            f"{videoDirectory} has not been created before splitting video",
-        )
+        splitDirectory = self.getSplitDirectory(videoId, silenceAware)
+
+        if splitDirectory.is_dir():
+            DiskBudget.markUsed(splitDirectory)
+        else:
+            # The download may have been evicted once its chunks existed
+            videoPath = self.getVideoPath(videoId)
+            assertResponse(
+                videoPath.is_file(),
+                f"{videoPath} has not been downloaded before splitting",
+            )
+
+            timeStamps = self.getSplitPlan(videoId, silenceAware)
 
-        videoPath = videoDirectory.joinpath("main.mp4")
-        splitVideoIntoChunks(videoPath, videoDirectory)
+            with artifactStore.writeDirectory(
+                videoId, "split", self.getSplitParameters(silenceAware)
+            ) as temporaryDirectory:
+                splitVideoIntoChunks(
+                    videoPath, temporaryDirectory, timeStamps=timeStamps
+                )
 
         return [
             file
-            for file in videoDirectory.iterdir()
+            for file in splitDirectory.iterdir()
             if file.is_file() and "part" in file.name and file.suffix == ".mp4"
         ]
@@ -1,5 +1,7 @@
 from pathlib import Path
 from typing import List
+from processing.SplitVideo import VideoSegment, getVideoSegments
+from storage.VideoCatalog import VideoRecord
 from youtube.YoutubeGrabber import YoutubeGrabber
 
 class YoutubeVideo:
@@ -7,39 +9,36 @@ class YoutubeVideo:
     A class to handle the information from the fetched youtube video
 
     Attributes:
-        videoInfo (dict): The information of the video
+        record (VideoRecord): The catalog record of the video
         videoId (str): The id of the video
         title (str): The title of the video
         description (str): The description of the video
         channelId (str): The channel id of the video
         keywords (List[str]): The keywords of the video
         splitVideos (List[Path]): The paths to the split videos
-        directory (Path): The directory to save the video
-        videoPath (Path): The path to the downloaded video
+        videoPath (Path): The path to the downloaded video, in the artifact store
         youtubeGrabber (YoutubeGrabber): The YoutubeGrabber object
     """ 
 
-    def __init__(self, youtubeGrabber: YoutubeGrabber, videoInfo: dict):
-        self.videoInfo = videoInfo
+    def __init__(self, youtubeGrabber: YoutubeGrabber, record: VideoRecord):
+        self.record = record
 
-        self.videoId = videoInfo["id"]["videoId"]
-        self.title = videoInfo["snippet"]["title"]
-        self.description = videoInfo["snippet"]["description"]
-        self.channelId = videoInfo["snippet"]["channelId"]
+        self.videoId = record.videoId
+        self.title = record.title
+        self.description = record.description
+        self.channelId = record.channelId
         self.targetChannel = youtubeGrabber.targetChannel
 
-        self.keywords: List[str] | None = None
+        self.keywords: List[str] | None = record.tags
         self.splitVideos: List[Path] | None = None
 
-        self.directory = Path(f"data/{self.targetChannel}/videos/{self.title}")
-        self.videoPath = self.directory.joinpath("main.mp4")
-
         self.youtubeGrabber = youtubeGrabber
+        self.videoPath = youtubeGrabber.getVideoPath(self.videoId)
 
     def download(self):
         """
         Downloads the video and saves the keywords
-        Path -> data/{channelId}/videos/{title}/main.mp4
+        Path -> data/artifacts/{videoId}/download-{hash}/main.mp4
 
         Returns:
             Path: The path to the downloaded video
@@ -47,34 +46,61 @@ class YoutubeVideo:
         """
 
         path, keywords = self.youtubeGrabber.downloadVideo(self.videoId)
-        self.keywords = keywords
+
+        # The tags from the api are used when the video has been enriched
+        if self.keywords is None:
+            self.keywords = keywords
 
         return path
 
-    def split(self):
+    def split(self, silenceAware: bool = False):
         """
         Splits the video into 1 minute chunks
-        Path -> data/{channelId}/videos/{title}/part-{i}.mp4
+        Path -> data/artifacts/{videoId}/split-{hash}/part-{i}.mp4
+
+        Args:
+            silenceAware (bool): Cut at the quietest point near every minute
 
         Returns:
             List[Path]: The paths to the split videos
 
         """
 
-        self.splitVideos = self.youtubeGrabber.splitVideo(self.title)
+        self.splitVideos = self.youtubeGrabber.splitVideo(self.videoId, silenceAware)
         return self.splitVideos
     
-    def getVideoSplits(self) -> List[Path]:
+    def getVideoSplits(self, silenceAware: bool = False) -> List[Path]:
         """
         Get the video splits from the directory
         """
 
-        if self.directory.exists() == False:
-            exit("Video not downloaded")
+        splitDirectory = self.youtubeGrabber.getSplitDirectory(
+            self.videoId, silenceAware
+        )
 
+        if splitDirectory.exists() == False:
+            exit("Video not split")
 
-        return [
+        splits = [
             file
-            for file in self.directory.iterdir()
+            for file in splitDirectory.iterdir()
             if file.is_file() and "part" in file.name and file.suffix == ".mp4"
         ]
+
+        # Sort by part number so part-10 comes after part-9
+        return sorted(splits, key=lambda file: int(file.stem.split("-")[-1]))
+
+    def getVideoSegments(self, silenceAware: bool = False) -> List[VideoSegment]:
+        """
+        Get the 1 minute chunks of the video as ranges of the downloaded video
+        Nothing is split, the parts are rendered straight from main.mp4
+
+        Args:
+            silenceAware (bool): End the chunks at the quietest point near every minute
+        """
+
+        if self.videoPath.is_file() == False:
+            exit("Video not downloaded")
+
+        timeStamps = self.youtubeGrabber.getSplitPlan(self.videoId, silenceAware)
+        return getVideoSegments(self.videoPath, timeStamps)